@@ -0,0 +1,84 @@
+"""Compare per-bucket queries with the single $dateTrunc aggregation for trends and daily analytics.
+
+The "per-bucket" versions reproduce the previous implementation: one find()
+per month or day, summed in Python. The "aggregated" versions call the
+current endpoints, which read the daily spending rollups; the first call
+builds them. Seeds one group with a year of expenses.
+
+Usage (from backend/):
+    python -m benchmarks.analytics_benchmark [--expenses 10000] [--runs 20]
+
+Seeds and then drops the BENCH_DB_NAME database (default expense_benchmark)
+on the server at MONGO_URL. $dateTrunc needs MongoDB 5.0+.
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import server
+from benchmarks.common import seed_expenses, time_calls
+
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "expense_benchmark")
+
+
+async def per_bucket_trends(group_ids, months):
+    now = datetime.utcnow()
+    projection = {"currency": 1, "amount": 1, "_id": 0}
+    trends = []
+    for i in range(months - 1, -1, -1):
+        year, month = now.year, now.month - i
+        while month <= 0:
+            month += 12
+            year -= 1
+        month_start = datetime(year, month, 1)
+        month_end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+        amounts = {}
+        async for exp in server.db.expenses.find({"group_id": {"$in": group_ids}, "date": {"$gte": month_start, "$lt": month_end}}, projection):
+            amounts[exp["currency"]] = amounts.get(exp["currency"], 0) + exp["amount"]
+        trends.append(amounts)
+    return trends
+
+
+async def per_bucket_daily(group_ids, days):
+    now = datetime.utcnow()
+    projection = {"currency": 1, "amount": 1, "_id": 0}
+    daily = []
+    for i in range(days - 1, -1, -1):
+        day_start = datetime(now.year, now.month, now.day) - timedelta(days=i)
+        amounts = {}
+        async for exp in server.db.expenses.find({"group_id": {"$in": group_ids}, "date": {"$gte": day_start, "$lt": day_start + timedelta(days=1)}}, projection):
+            amounts[exp["currency"]] = amounts.get(exp["currency"], 0) + exp["amount"]
+        daily.append(amounts)
+    return daily
+
+
+async def main(expense_count, runs):
+    database = server.client[BENCH_DB_NAME]
+    server.db = database
+    await server.client.drop_database(BENCH_DB_NAME)
+    try:
+        group_ids = await seed_expenses(database, expense_count, days=365, group_count=1)
+        user = {"id": "user-0"}
+        scenarios = [
+            ("trends", 6, per_bucket_trends, lambda n: server.get_analytics_trends(group_id=group_ids[0], months=n, include_archived=False, current_user=user)),
+            ("trends", 12, per_bucket_trends, lambda n: server.get_analytics_trends(group_id=group_ids[0], months=n, include_archived=False, current_user=user)),
+            ("daily", 30, per_bucket_daily, lambda n: server.get_analytics_daily(group_id=group_ids[0], days=n, include_archived=False, current_user=user)),
+            ("daily", 365, per_bucket_daily, lambda n: server.get_analytics_daily(group_id=group_ids[0], days=n, include_archived=False, current_user=user)),
+        ]
+        print(f"{expense_count} expenses in one group over 12 months, {runs} runs each")
+        print(f"{'series':<8}{'buckets':>8}  {'version':<12}{'median ms':>12}{'p95 ms':>12}")
+        for name, buckets, per_bucket, aggregated in scenarios:
+            for version, call in (("per-bucket", lambda: per_bucket(group_ids, buckets)), ("aggregated", lambda: aggregated(buckets))):
+                median, p95 = await time_calls(call, runs)
+                print(f"{name:<8}{buckets:>8}  {version:<12}{median:>12.1f}{p95:>12.1f}")
+    finally:
+        await server.client.drop_database(BENCH_DB_NAME)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.expenses, args.runs))
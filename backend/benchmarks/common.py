@@ -0,0 +1,53 @@
+"""Shared seeding and timing helpers for the benchmarks in this package."""
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import server
+
+
+async def seed_expenses(database, expense_count, days=365, group_count=4):
+    """Seed users, groups, default categories and expenses spread over the last `days` days.
+
+    Returns the seeded group IDs. Indexes are built after the bulk insert.
+    """
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    users = [{"id": f"user-{n}", "name": f"User {n}", "avatar_color": "#4ECDC4"} for n in range(8)]
+    groups = [{"id": f"group-{n}", "name": f"Group {n}", "members": [u["id"] for u in users[n % 4:n % 4 + 4]]} for n in range(group_count)]
+    categories = [{"id": f"cat-{n}", "name": f"Category {n}", "icon": "tag", "color": "#FF6B6B", "group_id": None} for n in range(12)]
+    await database.users.insert_many(users)
+    await database.groups.insert_many(groups)
+    await database.categories.insert_many(categories)
+
+    expenses = []
+    for n in range(expense_count):
+        group = rng.choice(groups)
+        expenses.append({
+            "id": f"exp-{n:07d}",
+            "amount": rng.randint(1, 5000),
+            "currency": rng.choice(["INR", "INR", "INR", "USD"]),
+            "category_id": rng.choice(categories)["id"],
+            "description": f"Expense {n}",
+            "paid_by": rng.choice(group["members"]),
+            "group_id": group["id"],
+            "date": now - timedelta(minutes=rng.randint(0, 60 * 24 * days)),
+            "created_at": now,
+        })
+    for start in range(0, len(expenses), 5000):
+        await database.expenses.insert_many(expenses[start:start + 5000])
+    for collection_name, indexes in server.INDEXES.items():
+        await database[collection_name].create_indexes(indexes)
+    return [g["id"] for g in groups]
+
+
+async def time_calls(call, runs):
+    """Median and p95 wall time, in milliseconds, of awaiting call() `runs` times"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)]
@@ -0,0 +1,49 @@
+"""Compare the database and pandas engines for grouping spending rollups.
+
+Times sum_by_dimension over a group's whole history with
+ANALYTICS_PANDAS_MIN_ROWS forced to 0 (always $group in MongoDB) and to 1
+(always pandas), to help pick the threshold for a deployment.
+
+Usage (from backend/):
+    python -m benchmarks.engine_benchmark [--expenses 200000] [--runs 20]
+
+Seeds and then drops the BENCH_DB_NAME database (default expense_benchmark)
+on the server at MONGO_URL. Needs pandas.
+"""
+import argparse
+import asyncio
+import os
+
+import server
+from benchmarks.common import seed_expenses, time_calls
+
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "expense_benchmark")
+
+
+async def main(expense_count, runs):
+    if server.pd is None:
+        raise SystemExit("pandas is not installed")
+    database = server.client[BENCH_DB_NAME]
+    server.db = database
+    await server.client.drop_database(BENCH_DB_NAME)
+    try:
+        group_ids = await seed_expenses(database, expense_count, days=3 * 365, group_count=4)
+        await server.ensure_spending_rollups(group_ids)
+        rows = await database.spending_rollups.count_documents({})
+        print(f"{expense_count} expenses in {rows} rollup rows, {runs} runs each")
+        print(f"{'dimension':<12}{'engine':<10}{'median ms':>12}{'p95 ms':>12}")
+        for dimension in ("category_id", "paid_by", "group_id"):
+            for engine, min_rows in (("database", 0), ("pandas", 1)):
+                server.ANALYTICS_PANDAS_MIN_ROWS = min_rows
+                median, p95 = await time_calls(lambda: server.sum_by_dimension(group_ids, dimension), runs)
+                print(f"{dimension:<12}{engine:<10}{median:>12.1f}{p95:>12.1f}")
+    finally:
+        await server.client.drop_database(BENCH_DB_NAME)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.expenses, args.runs))
@@ -0,0 +1,52 @@
+"""Compare the two expense enrichment strategies against a real MongoDB.
+
+"queries" fetches expenses and then runs three batched lookups for their
+categories, payers and groups; "lookup" joins them server-side in a single
+$lookup aggregation. Both are timed for a list page and a full export.
+
+Usage (from backend/):
+    python -m benchmarks.enrichment_benchmark [--expenses 20000] [--runs 30]
+
+Seeds and then drops the BENCH_DB_NAME database (default expense_benchmark)
+on the server at MONGO_URL.
+"""
+import argparse
+import asyncio
+import os
+
+import server
+from benchmarks.common import seed_expenses, time_calls
+
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "expense_benchmark")
+
+
+async def main(expense_count, runs):
+    database = server.client[BENCH_DB_NAME]
+    server.db = database
+    await server.client.drop_database(BENCH_DB_NAME)
+    try:
+        group_ids = await seed_expenses(database, expense_count)
+        query = {"group_id": {"$in": group_ids}}
+        scenarios = [
+            ("list page", [("date", -1), ("id", -1)], server.DEFAULT_PAGE_SIZE + 1),
+            ("export", [("date", -1)], 10000),
+        ]
+        print(f"{expense_count} expenses, {runs} runs each")
+        print(f"{'scenario':<12}{'strategy':<10}{'median ms':>12}{'p95 ms':>12}")
+        for name, sort, limit in scenarios:
+            for strategy in ("queries", "lookup"):
+                server.ENRICHMENT_STRATEGIES["bench"] = strategy
+                median, p95 = await time_calls(
+                    lambda: server.fetch_enriched_expenses("bench", query, sort, limit), runs
+                )
+                print(f"{name:<12}{strategy:<10}{median:>12.1f}{p95:>12.1f}")
+    finally:
+        await server.client.drop_database(BENCH_DB_NAME)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+    asyncio.run(main(args.expenses, args.runs))
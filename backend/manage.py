@@ -0,0 +1,139 @@
+"""Maintenance commands for the expense tracker database.
+
+Usage:
+    python manage.py backfill-search [--group GROUP_ID]
+    python manage.py backfill-hashes [--group GROUP_ID]
+    python manage.py rebuild-rollups [--group GROUP_ID]
+    python manage.py recount-budgets [--group GROUP_ID]
+    python manage.py load-rates FILE
+"""
+import argparse
+import asyncio
+import csv
+import logging
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from server import (
+    CURRENCIES, db, expense_content_hash, mark_rates_changed, month_start, rebuild_spending_rollups, recount_budget_usage,
+    refresh_search_terms, wanted_rollup_zones
+)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("manage")
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+async def backfill_search(group_id=None):
+    """Recompute search_terms for every expense, e.g. after the tokenizer or a name changes"""
+    query = {"group_id": group_id} if group_id else {}
+    updated = await refresh_search_terms(query)
+    logger.info(f"Done: {updated} expenses updated")
+
+
+async def backfill_hashes(group_id=None):
+    """Recompute content_hash for every expense, e.g. for expenses written before it existed or changed"""
+    query = {"group_id": group_id} if group_id else {}
+
+    updated = 0
+    batch = []
+    projection = {"id": 1, "group_id": 1, "date": 1, "amount": 1, "currency": 1, "description": 1}
+    async for expense in db.expenses.find(query, projection):
+        batch.append(UpdateOne({"id": expense["id"]}, {"$set": {"content_hash": expense_content_hash(expense)}}))
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            await db.expenses.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+            logger.info(f"Backfilled content hashes for {updated} expenses")
+    if batch:
+        await db.expenses.bulk_write(batch, ordered=False)
+        updated += len(batch)
+
+    logger.info(f"Done: {updated} expenses updated")
+
+
+async def rebuild_rollups(group_id=None):
+    """Recompute spending_rollups from the expenses, e.g. after editing expenses outside the API"""
+    query = {"id": group_id} if group_id else {}
+    groups = rows = 0
+    async for group in db.groups.find(query, {"id": 1, "members": 1}):
+        for tz in sorted(await wanted_rollup_zones(group)):
+            rows += await rebuild_spending_rollups(group["id"], tz)
+        groups += 1
+    logger.info(f"Done: {rows} rollup rows across {groups} groups")
+
+
+async def recount_budgets(group_id=None):
+    """Recompute this month's budget counters from the rollups, e.g. after editing expenses outside the API"""
+    query = {"group_id": group_id} if group_id else {}
+    budgets = 0
+    async for budget in db.budgets.find(query):
+        await recount_budget_usage(budget, month_start(datetime.utcnow(), budget["timezone"]))
+        budgets += 1
+    logger.info(f"Done: {budgets} budgets recounted")
+
+
+async def load_rates(path):
+    """Upsert exchange rates from a CSV with date (YYYY-MM-DD), currency and per_usd columns.
+
+    Rollups and budget counters store converted amounts, so they are
+    rebuilt afterwards. Raising the rates version first makes running API
+    processes reload the rates before converting anything else.
+    """
+    batch = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            currency = row["currency"].strip().upper()
+            if currency not in CURRENCIES:
+                logger.warning(f"Line {line}: skipping unsupported currency {currency}")
+                continue
+            date = datetime.strptime(row["date"].strip(), "%Y-%m-%d")
+            batch.append(UpdateOne(
+                {"currency": currency, "date": date},
+                {"$set": {"per_usd": float(row["per_usd"])}},
+                upsert=True
+            ))
+    if batch:
+        await db.exchange_rates.bulk_write(batch, ordered=False)
+    logger.info(f"Loaded {len(batch)} exchange rates")
+    await mark_rates_changed()
+    await rebuild_rollups()
+    await recount_budgets()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser("backfill-search", help="Rebuild the search_terms index field on expenses")
+    backfill.add_argument("--group", dest="group_id", help="Only backfill this group")
+
+    hashes = commands.add_parser("backfill-hashes", help="Rebuild the content_hash used to skip re-imported rows")
+    hashes.add_argument("--group", dest="group_id", help="Only backfill this group")
+
+    rollups = commands.add_parser("rebuild-rollups", help="Rebuild the spending_rollups used by analytics")
+    rollups.add_argument("--group", dest="group_id", help="Only rebuild this group")
+
+    budgets = commands.add_parser("recount-budgets", help="Recount this month's budget consumption")
+    budgets.add_argument("--group", dest="group_id", help="Only recount this group's budgets")
+
+    rates = commands.add_parser("load-rates", help="Load exchange rates for converted analytics totals")
+    rates.add_argument("path", help="CSV file with date, currency and per_usd columns")
+
+    args = parser.parse_args()
+    if args.command == "backfill-search":
+        asyncio.run(backfill_search(args.group_id))
+    elif args.command == "backfill-hashes":
+        asyncio.run(backfill_hashes(args.group_id))
+    elif args.command == "rebuild-rollups":
+        asyncio.run(rebuild_rollups(args.group_id))
+    elif args.command == "recount-budgets":
+        asyncio.run(recount_budgets(args.group_id))
+    elif args.command == "load-rates":
+        asyncio.run(load_rates(args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,51 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, BackgroundTasks, HTTPException, Depends, File, Form, Header, Query, Response, UploadFile, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, IndexModel, ReturnDocument, UpdateOne
+import bson
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import boto3
 import os
 import logging
 from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from collections import OrderedDict
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import random
 import string
 import csv
 import io
+import math
+import json
+import base64
+import bisect
+import hashlib
+import itertools
+import sys
+import time
+import re
+
+try:
+    from PIL import Image
+except ImportError:  # Receipts still work without Pillow, just without thumbnails
+    Image = None
+
+try:
+    import pandas as pd
+except ImportError:  # Analytics then always group in the database
+    pd = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -26,6 +55,13 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Multi-document transactions need a replica set or sharded cluster; detected at startup
+transactions_supported = False
+
+# Receipt storage client and thumbnail workers, created on first use and at startup
+s3_client = None
+thumbnail_executor = None
+
 # Security
 SECRET_KEY = os.environ["SECRET_KEY"]
 ALGORITHM = "HS256"
@@ -80,6 +116,78 @@ DEFAULT_CATEGORIES = [
     {"name": "Others", "icon": "ellipsis-horizontal", "color": "#607D8B"}
 ]
 
+# Pagination
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Batch writes
+MAX_BATCH_OPERATIONS = 500
+IDEMPOTENCY_KEY_TTL_SECONDS = 24 * 60 * 60  # Replays are recognised for a day
+
+# Balance ledgers built from history are redone at most this many times while writes race with them
+LEDGER_REBUILD_ATTEMPTS = 5
+# Likewise for spending rollups rebuilt while expense writes race with them
+ROLLUP_REBUILD_ATTEMPTS = 5
+
+# Delta sync
+TOMBSTONE_RETENTION_DAYS = 90  # Clients holding an older sync token get a full resync
+
+# Expense list enrichment, per endpoint: "lookup" joins categories, payers and
+# groups in one $lookup aggregation (MongoDB 5.0+); "queries" runs three
+# batched follow-up queries
+ENRICHMENT_STRATEGIES = {
+    "expenses": os.environ.get("EXPENSES_ENRICHMENT", "queries"),
+    "export": os.environ.get("EXPORT_ENRICHMENT", "queries"),
+}
+
+# Expense search
+SEARCH_MIN_PREFIX = 2
+SEARCH_MAX_PREFIX = 15  # Longer words are indexed and matched on their first 15 characters
+SEARCH_SCAN_BATCH_SIZE = 1000  # Expenses read per query when refreshing search terms
+SEARCH_WINDOW_SIZE = 1000  # Matches, newest first, ranked together; pages move on to older windows
+DEFAULT_SEARCH_PAGE_SIZE = 20
+
+# Analytics results cached per process, bounded by their estimated size
+ANALYTICS_CACHE_MAX_BYTES = int(os.environ.get("ANALYTICS_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# Rollup scans of at least this many rows are grouped in-process with pandas
+# rather than by a $group on the database; 0 turns the pandas engine off
+ANALYTICS_PANDAS_MIN_ROWS = int(os.environ.get("ANALYTICS_PANDAS_MIN_ROWS", 100000))
+ANALYTICS_BATCH_SIZE = 10000
+
+# CSV export, streamed to the client one batch of expenses at a time
+EXPORT_BATCH_SIZE = 2000
+
+# Budgets: percentages of a monthly budget that raise an alert when spending crosses them
+DEFAULT_BUDGET_THRESHOLDS = [80, 100]
+
+# CSV import
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_ERRORS = 100  # Per-row errors reported back; the rest are only counted
+DEFAULT_IMPORT_MAPPING = {  # Field -> CSV column, matching the CSV export
+    "date": "Date",
+    "category": "Category",
+    "amount": "Amount",
+    "currency": "Currency",
+    "description": "Description",
+    "paid_by": "Paid By"
+}
+
+# Receipt attachments, stored in S3 or an S3-compatible service such as MinIO
+RECEIPTS_BUCKET = os.environ.get("RECEIPTS_BUCKET")  # Receipt endpoints return 503 when unset
+S3_CLIENT_OPTIONS = {
+    "endpoint_url": os.environ.get("S3_ENDPOINT_URL"),
+    "region_name": os.environ.get("S3_REGION")
+}
+RECEIPTS_PREFIX = "receipts/"
+RECEIPTS_THUMBNAIL_PREFIX = "thumbnails/"
+RECEIPT_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "application/pdf"}
+RECEIPT_MAX_BYTES = 10 * 1024 * 1024
+RECEIPT_CHUNK_SIZE = 1024 * 1024
+RECEIPT_URL_TTL_SECONDS = 15 * 60
+RECEIPT_THUMBNAIL_SIZE = 320  # Longest edge, in pixels
+RECEIPT_THUMBNAIL_WORKERS = 2
+
 AVATAR_COLORS = ["#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4", "#FFEAA7", "#DDA0DD", "#98D8C8", "#F7DC6F"]
 GROUP_COLORS = ["#22D3EE", "#3B82F6", "#F59E0B", "#EF4444", "#8B5CF6", "#EC4899", "#06B6D4", "#84CC16"]
 
@@ -100,6 +208,7 @@ class UserResponse(BaseModel):
     email: str
     avatar_color: str
     default_currency: str = "INR"
+    timezone: str = "UTC"  # IANA name; analytics days and months are bucketed in it
     biometric_enabled: bool = False
     auto_lock_enabled: bool = True
     auto_lock_timeout: int = 5  # minutes
@@ -123,14 +232,23 @@ class GroupResponse(BaseModel):
     members: List[dict]
     created_by: str
     created_at: datetime
+    archived: bool = False
+    version: int = 0
 
 class SettlementCreate(BaseModel):
     group_id: str
     paid_to: str  # User ID who received the payment
-    amount: float
+    amount: float = Field(..., gt=0, allow_inf_nan=False)
     currency: str = "INR"
     note: str = ""
 
+class SettlementUpdate(BaseModel):
+    paid_to: Optional[str] = None
+    amount: Optional[float] = Field(None, gt=0, allow_inf_nan=False)
+    currency: Optional[str] = None
+    note: Optional[str] = None
+    version: Optional[int] = None  # Expected current version; If-Match takes precedence
+
 class SettlementResponse(BaseModel):
     id: str
     group_id: str
@@ -143,6 +261,7 @@ class SettlementResponse(BaseModel):
     currency: str
     note: str
     date: datetime
+    version: int = 0
 
 class MemberBalance(BaseModel):
     user_id: str
@@ -173,7 +292,8 @@ class CategoryResponse(BaseModel):
     group_id: Optional[str] = None
 
 class ExpenseCreate(BaseModel):
-    amount: float
+    id: Optional[str] = Field(None, min_length=1, max_length=64)  # Client-generated ID makes retries safe
+    amount: float = Field(..., gt=0, allow_inf_nan=False)
     currency: str = "INR"
     category_id: str
     group_id: str
@@ -181,11 +301,22 @@ class ExpenseCreate(BaseModel):
     date: Optional[datetime] = None
 
 class ExpenseUpdate(BaseModel):
-    amount: Optional[float] = None
+    amount: Optional[float] = Field(None, gt=0, allow_inf_nan=False)
     currency: Optional[str] = None
     category_id: Optional[str] = None
     description: Optional[str] = None
     date: Optional[datetime] = None
+    version: Optional[int] = None  # Expected current version; If-Match takes precedence
+
+class ExpenseBatchOperation(BaseModel):
+    op: str  # "create", "update" or "delete"
+    id: str = Field(..., min_length=1, max_length=64)  # Client-generated for creates
+    expense: Optional[ExpenseCreate] = None  # Required for "create"
+    changes: Optional[ExpenseUpdate] = None  # Required for "update"
+    version: Optional[int] = None  # Expected current version for "update" and "delete"
+
+class ExpenseBatchRequest(BaseModel):
+    operations: List[ExpenseBatchOperation]
 
 class ExpenseResponse(BaseModel):
     id: str
@@ -203,10 +334,22 @@ class ExpenseResponse(BaseModel):
     group_name: str
     date: datetime
     created_at: datetime
+    version: int = 0
+
+class ReceiptResponse(BaseModel):
+    id: str
+    filename: str
+    content_type: str
+    size: int
+    uploaded_by: str
+    uploaded_at: datetime
+    url: str  # Presigned, expires after RECEIPT_URL_TTL_SECONDS
+    thumbnail_url: Optional[str] = None  # Set once the thumbnail has been rendered
 
 class UpdateProfile(BaseModel):
     name: Optional[str] = None
     default_currency: Optional[str] = None
+    timezone: Optional[str] = None
     biometric_enabled: Optional[bool] = None
     auto_lock_enabled: Optional[bool] = None
     auto_lock_timeout: Optional[int] = None
@@ -225,6 +368,18 @@ class ExportRequest(BaseModel):
     end_date: Optional[str] = None
     month: Optional[int] = None  # For monthly export
     year: Optional[int] = None  # For monthly export
+    include_archived: bool = False  # Only applies when exporting all groups
+
+class BudgetCreate(BaseModel):
+    group_id: str
+    category_id: str
+    amount: float = Field(..., gt=0)  # Per month
+    currency: str = "INR"
+    thresholds: List[int] = Field(default_factory=lambda: list(DEFAULT_BUDGET_THRESHOLDS))
+
+class BudgetUpdate(BaseModel):
+    amount: Optional[float] = Field(None, gt=0)
+    thresholds: Optional[List[int]] = None
 
 class Token(BaseModel):
     access_token: str
@@ -290,6 +445,157 @@ async def get_group_info(group_id: str):
         return {"name": group.get("name", "Unknown"), "color": group.get("color", "#999999")}
     return {"name": "Unknown", "color": "#999999"}
 
+async def run_in_transaction(operation):
+    """Run operation(session) inside a transaction when the deployment supports it.
+
+    On a standalone mongod the operation runs without a session.
+    """
+    if not transactions_supported:
+        return await operation(None)
+    
+    async with await client.start_session() as session:
+        return await session.with_transaction(operation)
+
+async def next_change_seq(group_id: str, count: int = 1, *, session) -> int:
+    """Advance a group's change sequence by count and return the new (highest) value.
+
+    Every mutation stamps the documents it writes with a value from this
+    sequence so /sync can return what changed after a client's last token.
+    Callers run inside run_in_transaction and pass its session, so a seq is
+    never visible before the writes it stamps.
+    """
+    if session is None and transactions_supported:
+        raise RuntimeError("next_change_seq must run inside run_in_transaction")
+    group = await db.groups.find_one_and_update(
+        {"id": group_id},
+        {"$inc": {"change_seq": count}},
+        projection={"change_seq": 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    return group["change_seq"] if group else 0
+
+def tombstone(entity: str, doc: dict, seq: int) -> dict:
+    """Deletion marker returned by /sync"""
+    return {
+        "entity": entity,
+        "entity_id": doc["id"],
+        "group_id": doc["group_id"],
+        "seq": seq,
+        "deleted_at": datetime.utcnow()
+    }
+
+async def claim_idempotency_key(user_id: str, key: str):
+    """Return the stored response for a replayed request, or claim the key and return None"""
+    record = await db.idempotency_keys.find_one({"user_id": user_id, "key": key})
+    if record is None:
+        try:
+            await db.idempotency_keys.insert_one({
+                "user_id": user_id,
+                "key": key,
+                "response": None,
+                "created_at": datetime.utcnow()
+            })
+            return None
+        except DuplicateKeyError:
+            record = await db.idempotency_keys.find_one({"user_id": user_id, "key": key})
+    
+    if record is None or record.get("response") is None:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    return record["response"]
+
+async def complete_idempotency_key(user_id: str, key: str, response):
+    await db.idempotency_keys.update_one({"user_id": user_id, "key": key}, {"$set": {"response": response}})
+
+async def release_idempotency_key(user_id: str, key: str):
+    """Forget a claimed key after a failed request so the client can retry it"""
+    await db.idempotency_keys.delete_one({"user_id": user_id, "key": key})
+
+def member_groups_query(user_id: str, include_archived: bool = False) -> dict:
+    """Query for the groups a user belongs to, skipping archived groups by default"""
+    query = {"members": user_id}
+    if not include_archived:
+        query["archived"] = {"$ne": True}
+    return query
+
+async def resolve_group_ids(current_user: dict, group_id: Optional[str] = None, include_archived: bool = False) -> List[str]:
+    """Resolve the group IDs a query should cover.
+
+    An explicit group_id is checked for membership and always honoured, even when
+    archived. Otherwise all of the user's groups are returned, minus archived ones
+    unless include_archived is set.
+    """
+    if group_id:
+        group = await db.groups.find_one({"id": group_id, "members": current_user["id"]}, {"id": 1})
+        if not group:
+            raise HTTPException(status_code=403, detail="Not a member of this group")
+        return [group_id]
+    
+    groups = await db.groups.find(member_groups_query(current_user["id"], include_archived), {"id": 1}).to_list(length=100)
+    return [g["id"] for g in groups]
+
+def encode_token(payload: dict) -> str:
+    """Encode a JSON payload as an opaque URL-safe token"""
+    data = json.dumps(payload, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+def decode_token(token: str) -> dict:
+    padded = token + "=" * (-len(token) % 4)
+    payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if not isinstance(payload, dict):
+        raise ValueError("Token payload must be an object")
+    return payload
+
+def encode_cursor(date: datetime, doc_id: str) -> str:
+    """Encode a (date, id) keyset position as an opaque URL-safe token"""
+    return encode_token({"d": date.isoformat(), "i": doc_id})
+
+def decode_cursor(cursor: str):
+    try:
+        payload = decode_token(cursor)
+        return datetime.fromisoformat(payload["d"]), str(payload["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_after(cursor: Optional[str]) -> Optional[dict]:
+    """Filter selecting documents that sort after the cursor in (date desc, id desc) order"""
+    if not cursor:
+        return None
+    date, doc_id = decode_cursor(cursor)
+    # The redundant $lte bound lets the planner seek straight to the cursor
+    # instead of walking the index from the newest entry
+    return {"$and": [
+        {"date": {"$lte": date}},
+        {"$or": [{"date": {"$lt": date}}, {"date": date, "id": {"$lt": doc_id}}]},
+    ]}
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Version named by an If-Match header carrying one of our ETags; "*" matches any version"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    tag = if_match.split(",")[0].strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+def expected_version(if_match: Optional[str], body_version: Optional[int]) -> Optional[int]:
+    version = parse_if_match(if_match)
+    return version if version is not None else body_version
+
+def version_etag(doc: dict) -> str:
+    return f'"{doc.get("version", 0)}"'
+
+def version_query(version: int) -> dict:
+    """Filter matching a document at the given version; documents written before versioning are version 0"""
+    return {"version": version} if version else {"version": {"$in": [0, None]}}
+
+def check_version(doc: dict, expected: Optional[int], entity: str):
+    if expected is not None and doc.get("version", 0) != expected:
+        raise HTTPException(status_code=409, detail=f"{entity} was changed by someone else; reload and retry")
+
 async def create_personal_group(user_id: str, user_name: str):
     """Create a personal group for a new user"""
     group_id = str(uuid.uuid4())
@@ -301,9 +607,11 @@ async def create_personal_group(user_id: str, user_name: str):
         "color": random.choice(GROUP_COLORS),
         "members": [user_id],
         "created_by": user_id,
-        "created_at": datetime.utcnow()
+        "created_at": datetime.utcnow(),
+        "version": 1
     }
     await db.groups.insert_one(group)
+    await db.group_ledgers.insert_one(empty_ledger(group_id))
     return group_id
 
 async def ensure_default_categories():
@@ -320,6 +628,105 @@ async def ensure_default_categories():
                 "group_id": None
             })
 
+# ==================== INDEXES ====================
+
+# Compound indexes end with "id" so (date, id) keyset pages are read in index order
+INDEXES = {
+    "users": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("email", 1)], unique=True),
+    ],
+    "groups": [
+        IndexModel([("id", 1)], unique=True),
+        # Personal groups have no invite code, so only strings must be unique
+        IndexModel([("invite_code", 1)], unique=True, partialFilterExpression={"invite_code": {"$type": "string"}}),
+        IndexModel([("members", 1)]),
+    ],
+    "expenses": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("group_id", 1), ("date", -1), ("id", -1)]),
+        IndexModel([("group_id", 1), ("category_id", 1), ("date", -1), ("id", -1)]),
+        IndexModel([("group_id", 1), ("paid_by", 1), ("date", -1), ("id", -1)]),
+        # Covering indexes: analytics scans project only these fields, so they never touch documents
+        IndexModel([("group_id", 1), ("date", 1), ("category_id", 1), ("currency", 1), ("amount", 1)]),
+        IndexModel([("group_id", 1), ("date", 1), ("paid_by", 1), ("currency", 1), ("amount", 1)]),
+        IndexModel([("group_id", 1), ("content_hash", 1)]),
+        IndexModel([("group_id", 1), ("seq", 1)]),
+        # Multikey prefix index backing /expenses/search
+        IndexModel([("group_id", 1), ("search_terms", 1), ("date", -1), ("id", -1)]),
+    ],
+    "group_ledgers": [
+        IndexModel([("group_id", 1)], unique=True),
+    ],
+    "spending_rollups": [
+        IndexModel([("group_id", 1), ("timezone", 1), ("day", 1), ("category_id", 1), ("paid_by", 1), ("currency", 1)], unique=True),
+    ],
+    "exchange_rates": [
+        IndexModel([("currency", 1), ("date", 1)], unique=True),
+    ],
+    "budgets": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("group_id", 1), ("category_id", 1)], unique=True),
+    ],
+    "budget_usage": [
+        IndexModel([("budget_id", 1), ("month", 1)], unique=True),
+    ],
+    "idempotency_keys": [
+        IndexModel([("user_id", 1), ("key", 1)], unique=True),
+        # Expiring records keep the replay store bounded
+        IndexModel([("created_at", 1)], expireAfterSeconds=IDEMPOTENCY_KEY_TTL_SECONDS),
+    ],
+    "settlement_revisions": [
+        IndexModel([("settlement_id", 1), ("changed_at", -1)]),
+    ],
+    "receipt_objects": [
+        IndexModel([("hash", 1)], unique=True),
+    ],
+    "categories": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("group_id", 1), ("seq", 1)]),
+    ],
+    "tombstones": [
+        IndexModel([("group_id", 1), ("seq", 1)]),
+        IndexModel([("deleted_at", 1)], expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 24 * 60 * 60),
+    ],
+    "settlements": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("group_id", 1), ("seq", 1)]),
+        IndexModel([("paid_by", 1), ("date", -1), ("id", -1)]),
+        IndexModel([("paid_to", 1), ("date", -1), ("id", -1)]),
+        IndexModel([("group_id", 1), ("date", -1), ("id", -1)]),
+    ],
+}
+
+async def ensure_indexes():
+    """Build any declared index that does not exist yet, logging each build.
+
+    Safe to run on every startup. An index that cannot be built (an option
+    conflict with an existing index of the same name, or duplicates violating
+    a unique index) is logged and skipped so the API still comes up.
+    """
+    built = present = failed = 0
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        for index in indexes:
+            name = index.document["name"]
+            if name in existing:
+                present += 1
+                continue
+            logger.info(f"Building index {collection_name}.{name}")
+            started = time.monotonic()
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                failed += 1
+                logger.error(f"Could not build index {collection_name}.{name}: {e}")
+                continue
+            built += 1
+            logger.info(f"Built index {collection_name}.{name} in {time.monotonic() - started:.1f}s")
+    logger.info(f"Indexes ready: {built} built, {present} already present, {failed} failed")
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=Token)
@@ -343,6 +750,7 @@ async def register(user_data: UserCreate):
         "pin_hash": hash_pin(user_data.pin),
         "avatar_color": avatar_color,
         "default_currency": "INR",
+        "timezone": "UTC",
         "biometric_enabled": False,
         "auto_lock_enabled": True,
         "auto_lock_timeout": 5,
@@ -350,7 +758,11 @@ async def register(user_data: UserCreate):
         "created_at": datetime.utcnow()
     }
     
-    await db.users.insert_one(user)
+    try:
+        await db.users.insert_one(user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create personal group for the user
     await create_personal_group(user_id, user_data.name)
@@ -399,6 +811,7 @@ async def login(login_data: UserLogin):
             email=user["email"],
             avatar_color=user["avatar_color"],
             default_currency=user.get("default_currency", "INR"),
+            timezone=user.get("timezone", "UTC"),
             biometric_enabled=user.get("biometric_enabled", False),
             auto_lock_enabled=user.get("auto_lock_enabled", True),
             auto_lock_timeout=user.get("auto_lock_timeout", 5),
@@ -455,6 +868,7 @@ async def get_me(current_user: dict = Depends(get_current_user)):
         email=current_user["email"],
         avatar_color=current_user["avatar_color"],
         default_currency=current_user.get("default_currency", "INR"),
+        timezone=current_user.get("timezone", "UTC"),
         biometric_enabled=current_user.get("biometric_enabled", False),
         auto_lock_enabled=current_user.get("auto_lock_enabled", True),
         auto_lock_timeout=current_user.get("auto_lock_timeout", 5),
@@ -468,6 +882,8 @@ async def update_profile(profile_data: UpdateProfile, current_user: dict = Depen
         update_data["name"] = profile_data.name
     if profile_data.default_currency and profile_data.default_currency in CURRENCIES:
         update_data["default_currency"] = profile_data.default_currency
+    if profile_data.timezone:
+        update_data["timezone"] = resolve_timezone(profile_data.timezone, current_user)
     if profile_data.biometric_enabled is not None:
         update_data["biometric_enabled"] = profile_data.biometric_enabled
     if profile_data.auto_lock_enabled is not None:
@@ -475,10 +891,19 @@ async def update_profile(profile_data: UpdateProfile, current_user: dict = Depen
     if profile_data.auto_lock_timeout is not None:
         update_data["auto_lock_timeout"] = profile_data.auto_lock_timeout
     
+    updated_user = current_user
     if update_data:
-        await db.users.update_one({"id": current_user["id"]}, {"$set": update_data})
-    
-    updated_user = await db.users.find_one({"id": current_user["id"]})
+        updated_user = await db.users.find_one_and_update(
+            {"id": current_user["id"]},
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+    if updated_user["name"] != current_user["name"]:
+        # The payer's name is part of every expense's search terms
+        await refresh_search_terms({"paid_by": current_user["id"]})
+    if updated_user.get("timezone") != current_user.get("timezone"):
+        group_ids = [g["id"] async for g in db.groups.find({"members": current_user["id"]}, {"id": 1})]
+        await drop_unwanted_rollup_zones(group_ids)
     
     return UserResponse(
         id=updated_user["id"],
@@ -486,6 +911,7 @@ async def update_profile(profile_data: UpdateProfile, current_user: dict = Depen
         email=updated_user["email"],
         avatar_color=updated_user["avatar_color"],
         default_currency=updated_user.get("default_currency", "INR"),
+        timezone=updated_user.get("timezone", "UTC"),
         biometric_enabled=updated_user.get("biometric_enabled", False),
         auto_lock_enabled=updated_user.get("auto_lock_enabled", True),
         auto_lock_timeout=updated_user.get("auto_lock_timeout", 5),
@@ -521,7 +947,9 @@ async def get_groups(current_user: dict = Depends(get_current_user)):
             color=group.get("color", "#22D3EE"),
             members=members,
             created_by=group["created_by"],
-            created_at=group["created_at"]
+            created_at=group["created_at"],
+            archived=group.get("archived", False),
+            version=group.get("version", 0)
         ))
     
     return groups
@@ -549,10 +977,12 @@ async def create_group(group_data: GroupCreate, current_user: dict = Depends(get
         "color": random.choice(GROUP_COLORS),
         "members": [current_user["id"]],
         "created_by": current_user["id"],
-        "created_at": datetime.utcnow()
+        "created_at": datetime.utcnow(),
+        "version": 1
     }
     
     await db.groups.insert_one(group)
+    await db.group_ledgers.insert_one(empty_ledger(group_id))
     
     members = [{
         "id": current_user["id"],
@@ -569,11 +999,12 @@ async def create_group(group_data: GroupCreate, current_user: dict = Depends(get
         color=group["color"],
         members=members,
         created_by=current_user["id"],
-        created_at=group["created_at"]
+        created_at=group["created_at"],
+        version=group["version"]
     )
 
 @api_router.get("/groups/{group_id}", response_model=GroupResponse)
-async def get_group(group_id: str, current_user: dict = Depends(get_current_user)):
+async def get_group(group_id: str, response: Response, current_user: dict = Depends(get_current_user)):
     """Get group details"""
     group = await db.groups.find_one({"id": group_id})
     if not group:
@@ -582,6 +1013,8 @@ async def get_group(group_id: str, current_user: dict = Depends(get_current_user
     if current_user["id"] not in group.get("members", []):
         raise HTTPException(status_code=403, detail="Not a member of this group")
     
+    response.headers["ETag"] = version_etag(group)
+    
     # Get member details
     members = []
     for member_id in group.get("members", []):
@@ -602,88 +1035,59 @@ async def get_group(group_id: str, current_user: dict = Depends(get_current_user
         color=group.get("color", "#22D3EE"),
         members=members,
         created_by=group["created_by"],
-        created_at=group["created_at"]
+        created_at=group["created_at"],
+        archived=group.get("archived", False),
+        version=group.get("version", 0)
     )
 
 @api_router.put("/groups/{group_id}", response_model=GroupResponse)
-async def update_group(group_id: str, group_data: GroupCreate, current_user: dict = Depends(get_current_user)):
-    """Update group details"""
-    group = await db.groups.find_one({"id": group_id})
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    if current_user["id"] not in group.get("members", []):
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
-    if group.get("type") == "personal":
-        raise HTTPException(status_code=400, detail="Cannot modify personal group")
-    
-    await db.groups.update_one({"id": group_id}, {"$set": {"name": group_data.name}})
-    
-    updated_group = await db.groups.find_one({"id": group_id})
-    
-    # Get member details
-    members = []
-    for member_id in updated_group.get("members", []):
-        user = await db.users.find_one({"id": member_id}, {"id": 1, "name": 1, "avatar_color": 1})
-        if user:
-            members.append({
-                "id": user["id"],
-                "name": user["name"],
-                "avatar_color": user["avatar_color"]
-            })
-    
-    return GroupResponse(
-        id=updated_group["id"],
-        name=updated_group["name"],
-        type=updated_group.get("type", "shared"),
-        invite_code=updated_group.get("invite_code"),
-        color=updated_group.get("color", "#22D3EE"),
-        members=members,
-        created_by=updated_group["created_by"],
-        created_at=updated_group["created_at"]
+async def update_group(
+    group_id: str,
+    group_data: GroupCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Update group details; with If-Match the rename only applies to that version"""
+    version = parse_if_match(if_match)
+    query = {"id": group_id, "members": current_user["id"], "type": {"$ne": "personal"}}
+    if version is not None:
+        query.update(version_query(version))
+    
+    updated_group = await db.groups.find_one_and_update(
+        query,
+        {"$set": {"name": group_data.name}, "$inc": {"change_seq": 1, "version": 1}},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_group:
+        # Only a failed update pays for the lookup that explains why
+        group = await db.groups.find_one({"id": group_id}, {"members": 1, "type": 1, "version": 1})
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        if current_user["id"] not in group.get("members", []):
+            raise HTTPException(status_code=403, detail="Not a member of this group")
+        if group.get("type") == "personal":
+            raise HTTPException(status_code=400, detail="Cannot modify personal group")
+        raise HTTPException(status_code=409, detail="Group was changed by someone else; reload and retry")
+    
+    response.headers["ETag"] = version_etag(updated_group)
+    return await build_group_response(updated_group)
 
 @api_router.post("/groups/join", response_model=GroupResponse)
 async def join_group(join_data: GroupJoin, current_user: dict = Depends(get_current_user)):
     """Join a group with invite code"""
-    group = await db.groups.find_one({"invite_code": join_data.invite_code.upper()})
-    if not group:
-        raise HTTPException(status_code=404, detail="Invalid invite code")
-    
-    if current_user["id"] in group.get("members", []):
-        raise HTTPException(status_code=400, detail="Already a member of this group")
-    
-    # Add user to group
-    await db.groups.update_one(
-        {"id": group["id"]},
-        {"$push": {"members": current_user["id"]}}
+    invite_code = join_data.invite_code.upper()
+    updated_group = await db.groups.find_one_and_update(
+        {"invite_code": invite_code, "members": {"$ne": current_user["id"]}},
+        {"$push": {"members": current_user["id"]}, "$inc": {"change_seq": 1, "version": 1}},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_group:
+        if not await db.groups.find_one({"invite_code": invite_code}, {"id": 1}):
+            raise HTTPException(status_code=404, detail="Invalid invite code")
+        raise HTTPException(status_code=400, detail="Already a member of this group")
     
-    # Get updated group
-    updated_group = await db.groups.find_one({"id": group["id"]})
-    
-    # Get member details
-    members = []
-    for member_id in updated_group.get("members", []):
-        user = await db.users.find_one({"id": member_id}, {"id": 1, "name": 1, "avatar_color": 1})
-        if user:
-            members.append({
-                "id": user["id"],
-                "name": user["name"],
-                "avatar_color": user["avatar_color"]
-            })
-    
-    return GroupResponse(
-        id=updated_group["id"],
-        name=updated_group["name"],
-        type=updated_group.get("type", "shared"),
-        invite_code=updated_group.get("invite_code"),
-        color=updated_group.get("color", "#22D3EE"),
-        members=members,
-        created_by=updated_group["created_by"],
-        created_at=updated_group["created_at"]
-    )
+    return await build_group_response(updated_group)
 
 @api_router.post("/groups/{group_id}/leave")
 async def leave_group(group_id: str, current_user: dict = Depends(get_current_user)):
@@ -701,11 +1105,40 @@ async def leave_group(group_id: str, current_user: dict = Depends(get_current_us
     # Remove user from group
     await db.groups.update_one(
         {"id": group_id},
-        {"$pull": {"members": current_user["id"]}}
+        {"$pull": {"members": current_user["id"]}, "$inc": {"change_seq": 1, "version": 1}}
     )
+    await drop_unwanted_rollup_zones([group_id])
     
     return {"message": "Successfully left the group"}
 
+async def set_group_archived(group_id: str, archived: bool, current_user: dict):
+    group = await db.groups.find_one({"id": group_id})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    if current_user["id"] not in group.get("members", []):
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    
+    if group.get("type") == "personal":
+        raise HTTPException(status_code=400, detail="Cannot archive personal group")
+    
+    await db.groups.update_one(
+        {"id": group_id},
+        {"$set": {"archived": archived, "archived_at": datetime.utcnow() if archived else None}, "$inc": {"change_seq": 1, "version": 1}}
+    )
+
+@api_router.post("/groups/{group_id}/archive")
+async def archive_group(group_id: str, current_user: dict = Depends(get_current_user)):
+    """Archive a group so it drops out of the default all-groups views"""
+    await set_group_archived(group_id, True, current_user)
+    return {"message": "Group archived", "archived": True}
+
+@api_router.post("/groups/{group_id}/unarchive")
+async def unarchive_group(group_id: str, current_user: dict = Depends(get_current_user)):
+    """Restore an archived group"""
+    await set_group_archived(group_id, False, current_user)
+    return {"message": "Group unarchived", "archived": False}
+
 @api_router.delete("/groups/{group_id}")
 async def delete_group(group_id: str, current_user: dict = Depends(get_current_user)):
     """Delete a group (only creator can delete)"""
@@ -725,43 +1158,87 @@ async def delete_group(group_id: str, current_user: dict = Depends(get_current_u
     # Delete custom categories for this group
     await db.categories.delete_many({"group_id": group_id})
     
-    # Delete the group
+    # Delete the group and its balance ledger
     await db.groups.delete_one({"id": group_id})
+    await db.group_ledgers.delete_one({"group_id": group_id})
+    await db.spending_rollups.delete_many({"group_id": group_id})
+    budget_ids = [b["id"] async for b in db.budgets.find({"group_id": group_id}, {"id": 1})]
+    await db.budgets.delete_many({"group_id": group_id})
+    await db.budget_usage.delete_many({"budget_id": {"$in": budget_ids}})
     
     return {"message": "Group deleted successfully"}
 
 # ==================== BALANCE & SETTLEMENT ROUTES ====================
 
-@api_router.get("/groups/{group_id}/balances")
-async def get_group_balances(group_id: str, current_user: dict = Depends(get_current_user)):
-    """Get balance summary for a group showing contributions and debts"""
-    group = await db.groups.find_one({"id": group_id})
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    if current_user["id"] not in group.get("members", []):
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
-    mode = group.get("mode", "split")
-    
-    # Get all expenses for this group
-    expenses = await db.expenses.find({"group_id": group_id}).to_list(length=10000)
-    
-    # Get all settlements for this group
-    settlements = await db.settlements.find({"group_id": group_id}).to_list(length=10000)
+async def build_group_response(group: dict) -> GroupResponse:
+    members = await get_member_details(group.get("members", []))
+    return GroupResponse(
+        id=group["id"],
+        name=group["name"],
+        type=group.get("type", "shared"),
+        mode=group.get("mode", "split"),
+        invite_code=group.get("invite_code"),
+        color=group.get("color", "#22D3EE"),
+        members=list(members.values()),
+        created_by=group["created_by"],
+        created_at=group["created_at"],
+        archived=group.get("archived", False),
+        version=group.get("version", 0)
+    )
+
+async def get_member_details(member_ids: List[str]) -> dict:
+    """Fetch name and avatar colour for the given members in one query, keeping their order"""
+    users = {}
+    async for user in db.users.find({"id": {"$in": member_ids}}, {"id": 1, "name": 1, "avatar_color": 1}):
+        users[user["id"]] = user
     
-    # Get member details
     members = {}
-    for member_id in group.get("members", []):
-        user = await db.users.find_one({"id": member_id})
+    for member_id in member_ids:
+        user = users.get(member_id)
         if user:
             members[member_id] = {
                 "id": member_id,
                 "name": user["name"],
                 "avatar_color": user["avatar_color"]
             }
+    return members
+
+def apply_settlement_to_balances(member_balances: dict, settlement: dict):
+    """Settlement reduces what paid_by owes and what paid_to is owed"""
+    currency = settlement["currency"]
+    amount = settlement["amount"]
+    paid_by = settlement["paid_by"]
+    paid_to = settlement["paid_to"]
+    
+    if paid_by in member_balances:
+        if currency not in member_balances[paid_by]["total_paid"]:
+            member_balances[paid_by]["total_paid"][currency] = 0
+        member_balances[paid_by]["total_paid"][currency] += amount
     
-    # Calculate balances per currency
+    if paid_to in member_balances:
+        if currency not in member_balances[paid_to]["total_share"]:
+            member_balances[paid_to]["total_share"][currency] = 0
+        member_balances[paid_to]["total_share"][currency] += amount
+
+def update_net_balances(member_balances: dict):
+    for member_id, balances in member_balances.items():
+        all_currencies = set(list(balances["total_paid"].keys()) + list(balances["total_share"].keys()))
+        for currency in all_currencies:
+            paid = balances["total_paid"].get(currency, 0)
+            share = balances["total_share"].get(currency, 0)
+            balances["net_balance"][currency] = round(paid - share, 2)
+
+def add_to_totals(totals: dict, key: str, currency: str, amount: float):
+    """Add amount to totals[key][currency]"""
+    key_totals = totals.setdefault(key, {})
+    key_totals[currency] = key_totals.get(currency, 0) + amount
+
+def balances_from_ledger(members: dict, ledger: dict) -> dict:
+    """Calculate paid, share and net balances per member and currency from a group ledger.
+
+    Shares are derived at read time so that membership changes are reflected
+    without rewriting the ledger.
+    """
     member_balances = {}
     for member_id in members:
         member_balances[member_id] = {
@@ -772,103 +1249,90 @@ async def get_group_balances(group_id: str, current_user: dict = Depends(get_cur
     
     num_members = len(members)
     
-    # Process expenses
-    for expense in expenses:
-        currency = expense["currency"]
-        amount = expense["amount"]
-        paid_by = expense["paid_by"]
-        
-        if paid_by not in member_balances:
-            continue
-        
-        # Add to payer's total paid
-        if currency not in member_balances[paid_by]["total_paid"]:
-            member_balances[paid_by]["total_paid"][currency] = 0
-        member_balances[paid_by]["total_paid"][currency] += amount
-        
-        # Calculate each member's share (equal split)
-        share_per_person = amount / num_members
+    # Expenses count only when paid by a current member, and are split equally
+    expense_totals = {}
+    for member_id in members:
+        for currency, amount in ledger.get("paid", {}).get(member_id, {}).items():
+            if abs(amount) < 1e-9:
+                continue
+            add_to_totals(member_balances[member_id], "total_paid", currency, amount)
+            expense_totals[currency] = expense_totals.get(currency, 0) + amount
+    
+    for currency, total in expense_totals.items():
+        share_per_person = total / num_members
         for member_id in members:
-            if currency not in member_balances[member_id]["total_share"]:
-                member_balances[member_id]["total_share"][currency] = 0
-            member_balances[member_id]["total_share"][currency] += share_per_person
+            add_to_totals(member_balances[member_id], "total_share", currency, share_per_person)
     
-    # Process settlements
-    for settlement in settlements:
-        currency = settlement["currency"]
-        amount = settlement["amount"]
-        paid_by = settlement["paid_by"]
-        paid_to = settlement["paid_to"]
-        
-        # Settlement reduces what paid_by owes and what paid_to is owed
-        if paid_by in member_balances:
-            if currency not in member_balances[paid_by]["total_paid"]:
-                member_balances[paid_by]["total_paid"][currency] = 0
-            member_balances[paid_by]["total_paid"][currency] += amount
-        
-        if paid_to in member_balances:
-            if currency not in member_balances[paid_to]["total_share"]:
-                member_balances[paid_to]["total_share"][currency] = 0
-            member_balances[paid_to]["total_share"][currency] += amount
+    # Settlements
+    for member_id in members:
+        for currency, amount in ledger.get("settled_out", {}).get(member_id, {}).items():
+            if abs(amount) >= 1e-9:
+                add_to_totals(member_balances[member_id], "total_paid", currency, amount)
+        for currency, amount in ledger.get("settled_in", {}).get(member_id, {}).items():
+            if abs(amount) >= 1e-9:
+                add_to_totals(member_balances[member_id], "total_share", currency, amount)
+    
+    update_net_balances(member_balances)
+    return member_balances
+
+def simplify_debts(members: dict, member_balances: dict) -> List[dict]:
+    """Calculate simplified debts (who owes whom) per currency"""
+    debts = []
     
-    # Calculate net balance for each member
+    # Group debts by currency
+    currency_debts = {}
     for member_id, balances in member_balances.items():
-        all_currencies = set(list(balances["total_paid"].keys()) + list(balances["total_share"].keys()))
-        for currency in all_currencies:
-            paid = balances["total_paid"].get(currency, 0)
-            share = balances["total_share"].get(currency, 0)
-            balances["net_balance"][currency] = round(paid - share, 2)
-    
-    # Calculate simplified debts (who owes whom) - only for split mode
-    debts = []
-    if mode == "split":
-        # Group debts by currency
-        currency_debts = {}
-        for member_id, balances in member_balances.items():
-            for currency, net in balances["net_balance"].items():
-                if currency not in currency_debts:
-                    currency_debts[currency] = {}
-                currency_debts[currency][member_id] = net
+        for currency, net in balances["net_balance"].items():
+            if currency not in currency_debts:
+                currency_debts[currency] = {}
+            currency_debts[currency][member_id] = net
+    
+    # Calculate simplified debts for each currency
+    for currency, net_balances in currency_debts.items():
+        # Separate into creditors and debtors
+        creditors = [(mid, amt) for mid, amt in net_balances.items() if amt > 0]
+        debtors = [(mid, -amt) for mid, amt in net_balances.items() if amt < 0]
+        
+        # Sort by amount
+        creditors.sort(key=lambda x: x[1], reverse=True)
+        debtors.sort(key=lambda x: x[1], reverse=True)
         
-        # Calculate simplified debts for each currency
-        for currency, net_balances in currency_debts.items():
-            # Separate into creditors and debtors
-            creditors = [(mid, amt) for mid, amt in net_balances.items() if amt > 0]
-            debtors = [(mid, -amt) for mid, amt in net_balances.items() if amt < 0]
+        # Match debtors to creditors
+        i, j = 0, 0
+        while i < len(debtors) and j < len(creditors):
+            debtor_id, debt_amount = debtors[i]
+            creditor_id, credit_amount = creditors[j]
             
-            # Sort by amount
-            creditors.sort(key=lambda x: x[1], reverse=True)
-            debtors.sort(key=lambda x: x[1], reverse=True)
+            settle_amount = min(debt_amount, credit_amount)
             
-            # Match debtors to creditors
-            i, j = 0, 0
-            while i < len(debtors) and j < len(creditors):
-                debtor_id, debt_amount = debtors[i]
-                creditor_id, credit_amount = creditors[j]
-                
-                settle_amount = min(debt_amount, credit_amount)
-                
-                if settle_amount > 0.01:  # Ignore tiny amounts
-                    debts.append({
-                        "from_user_id": debtor_id,
-                        "from_user_name": members[debtor_id]["name"],
-                        "from_avatar_color": members[debtor_id]["avatar_color"],
-                        "to_user_id": creditor_id,
-                        "to_user_name": members[creditor_id]["name"],
-                        "to_avatar_color": members[creditor_id]["avatar_color"],
-                        "amount": round(settle_amount, 2),
-                        "currency": currency
-                    })
-                
-                debtors[i] = (debtor_id, debt_amount - settle_amount)
-                creditors[j] = (creditor_id, credit_amount - settle_amount)
-                
-                if debtors[i][1] < 0.01:
-                    i += 1
-                if creditors[j][1] < 0.01:
-                    j += 1
+            if settle_amount > 0.01:  # Ignore tiny amounts
+                debts.append({
+                    "from_user_id": debtor_id,
+                    "from_user_name": members[debtor_id]["name"],
+                    "from_avatar_color": members[debtor_id]["avatar_color"],
+                    "to_user_id": creditor_id,
+                    "to_user_name": members[creditor_id]["name"],
+                    "to_avatar_color": members[creditor_id]["avatar_color"],
+                    "amount": round(settle_amount, 2),
+                    "currency": currency
+                })
+            
+            debtors[i] = (debtor_id, debt_amount - settle_amount)
+            creditors[j] = (creditor_id, credit_amount - settle_amount)
+            
+            if debtors[i][1] < 0.01:
+                i += 1
+            if creditors[j][1] < 0.01:
+                j += 1
+    
+    return debts
+
+def format_group_balances(group: dict, members: dict, member_balances: dict) -> dict:
+    mode = group.get("mode", "split")
+    
+    # Debts are only tracked in split mode
+    debts = simplify_debts(members, member_balances) if mode == "split" else []
     
-    # Format response
     member_balance_list = []
     for member_id, member_info in members.items():
         balances = member_balances.get(member_id, {"total_paid": {}, "total_share": {}, "net_balance": {}})
@@ -882,35 +1346,229 @@ async def get_group_balances(group_id: str, current_user: dict = Depends(get_cur
         })
     
     return {
-        "group_id": group_id,
+        "group_id": group["id"],
         "group_name": group["name"],
         "mode": mode,
         "member_balances": member_balance_list,
         "debts": debts
     }
 
-@api_router.post("/settlements")
-async def create_settlement(settlement_data: SettlementCreate, current_user: dict = Depends(get_current_user)):
-    """Record a settlement payment between two users"""
-    group = await db.groups.find_one({"id": settlement_data.group_id})
+def empty_ledger(group_id: str) -> dict:
+    return {"group_id": group_id, "paid": {}, "settled_out": {}, "settled_in": {}}
+
+def ledger_build_marks(group: Optional[dict]) -> tuple:
+    """The group counters a ledger build without transactions checks for concurrent writes"""
+    group = group or {}
+    return group.get("change_seq", 0), group.get("ledger_misses", 0)
+
+async def rebuild_group_ledger(group_id: str) -> dict:
+    """Build a group's ledger from its full history.
+
+    Used for groups created before ledgers existed; the stored ledger is kept
+    up to date incrementally from then on. A write racing with the scan
+    finds no ledger to update, so its change would be lost: in a transaction
+    such writes conflict with the build. Without transactions a write that
+    misses the ledger raises the group's ledger_misses after its $inc and then
+    drops any ledger stored meanwhile, and the build is redone if
+    ledger_misses or change_seq moved by the time it has stored its ledger.
+    """
+    async def build(session):
+        # Writing the group makes concurrent writes, which advance its change_seq, conflict with this build
+        group = await db.groups.find_one_and_update(
+            {"id": group_id}, {"$set": {"ledger_built_at": datetime.utcnow()}},
+            projection={"change_seq": 1, "ledger_misses": 1}, session=session
+        )
+        ledger = empty_ledger(group_id)
+        
+        async for expense in db.expenses.find({"group_id": group_id}, {"paid_by": 1, "currency": 1, "amount": 1, "_id": 0}, session=session):
+            add_to_totals(ledger["paid"], expense["paid_by"], expense["currency"], expense["amount"])
+        
+        async for settlement in db.settlements.find({"group_id": group_id}, {"paid_by": 1, "paid_to": 1, "currency": 1, "amount": 1, "_id": 0}, session=session):
+            add_to_totals(ledger["settled_out"], settlement["paid_by"], settlement["currency"], settlement["amount"])
+            add_to_totals(ledger["settled_in"], settlement["paid_to"], settlement["currency"], settlement["amount"])
+        
+        # Keep a ledger another request may have built in the meantime
+        fields = {key: value for key, value in ledger.items() if key != "group_id"}
+        existing = await db.group_ledgers.find_one_and_update(
+            {"group_id": group_id}, {"$setOnInsert": fields}, upsert=True, session=session
+        )
+        return ledger_build_marks(group), existing or ledger, existing is None
+    
+    for _ in range(LEDGER_REBUILD_ATTEMPTS):
+        marks, ledger, inserted = await run_in_transaction(build)
+        if not inserted or transactions_supported:
+            return ledger
+        # Read after the ledger is stored, so a write that missed it has either raised these or will drop the ledger
+        group = await db.groups.find_one({"id": group_id}, {"change_seq": 1, "ledger_misses": 1})
+        if group is None or ledger_build_marks(group) == marks:
+            return ledger
+        await db.group_ledgers.delete_one({"group_id": group_id})
+    return ledger
+
+def ledger_increments(expense_changes=(), settlement_changes=()) -> dict:
+    """The $inc each group's ledger needs for the given changes, as {group_id: {path: amount}}.
+
+    Each change is a (before, after) pair of documents; before is None for an
+    insert and after is None for a delete.
+    """
+    increments = {}
+    
+    def add(group_id: str, path: str, amount: float):
+        group_inc = increments.setdefault(group_id, {})
+        group_inc[path] = group_inc.get(path, 0) + amount
+    
+    for before, after in expense_changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            if doc:
+                add(doc["group_id"], f"paid.{doc['paid_by']}.{doc['currency']}", sign * doc["amount"])
+    
+    for before, after in settlement_changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            if doc:
+                add(doc["group_id"], f"settled_out.{doc['paid_by']}.{doc['currency']}", sign * doc["amount"])
+                add(doc["group_id"], f"settled_in.{doc['paid_to']}.{doc['currency']}", sign * doc["amount"])
+    
+    return {
+        group_id: {path: amount for path, amount in inc.items() if amount != 0}
+        for group_id, inc in increments.items()
+    }
+
+async def update_group_ledgers(expense_changes=(), settlement_changes=(), session=None):
+    """Apply expense and settlement changes to the stored group ledgers as deltas.
+
+    Changes are (before, after) pairs as in ledger_increments. One $inc is
+    issued per group.
+    """
+    for group_id, inc in ledger_increments(expense_changes, settlement_changes).items():
+        if inc:
+            # No upsert: a missing ledger is rebuilt from history on the next read
+            result = await db.group_ledgers.update_one({"group_id": group_id}, {"$inc": inc}, session=session)
+            if result.matched_count == 0 and not transactions_supported:
+                # A build scanning without this change either sees the raised counter or loses its ledger here
+                await db.groups.update_one({"id": group_id}, {"$inc": {"ledger_misses": 1}})
+                await db.group_ledgers.delete_one({"group_id": group_id})
+
+async def get_group_ledger(group_id: str) -> dict:
+    ledger = await db.group_ledgers.find_one({"group_id": group_id})
+    if ledger is None:
+        ledger = await rebuild_group_ledger(group_id)
+    return ledger
+
+async def load_group_balances(group: dict):
+    """Load a group's members and their current balances"""
+    ledger = await get_group_ledger(group["id"])
+    members = await get_member_details(group.get("members", []))
+    return members, balances_from_ledger(members, ledger)
+
+@api_router.get("/groups/{group_id}/balances")
+async def get_group_balances(group_id: str, current_user: dict = Depends(get_current_user)):
+    """Get balance summary for a group showing contributions and debts"""
+    group = await db.groups.find_one({"id": group_id})
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
     if current_user["id"] not in group.get("members", []):
         raise HTTPException(status_code=403, detail="Not a member of this group")
     
-    if settlement_data.paid_to not in group.get("members", []):
-        raise HTTPException(status_code=400, detail="Recipient is not a member of this group")
-    
-    if settlement_data.paid_to == current_user["id"]:
-        raise HTTPException(status_code=400, detail="Cannot settle with yourself")
+    members, member_balances = await load_group_balances(group)
+    return format_group_balances(group, members, member_balances)
+
+@api_router.post("/groups/{group_id}/settle-all")
+async def settle_all_debts(group_id: str, current_user: dict = Depends(get_current_user)):
+    """Record a settlement for every outstanding debt in the group in one write"""
+    group = await db.groups.find_one({"id": group_id})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
     
-    # Get user details
-    paid_to_user = await db.users.find_one({"id": settlement_data.paid_to})
-    if not paid_to_user:
-        raise HTTPException(status_code=404, detail="Recipient user not found")
+    if current_user["id"] not in group.get("members", []):
+        raise HTTPException(status_code=403, detail="Not a member of this group")
     
-    settlement_id = str(uuid.uuid4())
+    if group.get("mode", "split") != "split":
+        raise HTTPException(status_code=400, detail="Debts are only tracked for groups in split mode")
+    
+    members = await get_member_details(group.get("members", []))
+    # Groups from before ledgers get one built from their history first
+    await get_group_ledger(group_id)
+    
+    async def write_settlements(session):
+        ledger = await db.group_ledgers.find_one({"group_id": group_id}, session=session)
+        member_balances = balances_from_ledger(members, ledger)
+        now = datetime.utcnow()
+        settlements = [{
+            "id": str(uuid.uuid4()),
+            "group_id": group_id,
+            "paid_by": debt["from_user_id"],
+            "paid_to": debt["to_user_id"],
+            "amount": debt["amount"],
+            "currency": debt["currency"],
+            "note": "Settle all",
+            "recorded_by": current_user["id"],
+            "date": now,
+            "version": 1
+        } for debt in simplify_debts(members, member_balances)]
+        if not settlements:
+            return member_balances, settlements
+        
+        # The plan is only applied to the ledger it was computed from, so a
+        # concurrent settle-all or expense write makes this one fail instead
+        # of recording settlements for balances that no longer hold
+        inc = ledger_increments(settlement_changes=[(None, s) for s in settlements])[group_id]
+        applied = await db.group_ledgers.find_one_and_update(
+            {"group_id": group_id, **{field: ledger[field] for field in ("paid", "settled_out", "settled_in")}},
+            {"$inc": inc},
+            projection={"_id": 1},
+            session=session
+        )
+        if applied is None:
+            raise HTTPException(status_code=409, detail="Balances changed while settling; reload and retry")
+        
+        last_seq = await next_change_seq(group_id, len(settlements), session=session)
+        for offset, settlement in enumerate(settlements):
+            settlement["seq"] = last_seq - len(settlements) + 1 + offset
+        await db.settlements.insert_many([dict(s) for s in settlements], session=session)
+        return member_balances, settlements
+    
+    member_balances, settlements = await run_in_transaction(write_settlements)
+    
+    # Apply the new settlements to the balances already in hand instead of rescanning
+    for settlement in settlements:
+        apply_settlement_to_balances(member_balances, settlement)
+    update_net_balances(member_balances)
+    
+    balances = format_group_balances(group, members, member_balances)
+    balances["settlements"] = [{
+        **settlement,
+        "group_name": group["name"],
+        "paid_by_name": members[settlement["paid_by"]]["name"],
+        "paid_to_name": members[settlement["paid_to"]]["name"]
+    } for settlement in settlements]
+    return balances
+
+@api_router.post("/settlements")
+async def create_settlement(settlement_data: SettlementCreate, current_user: dict = Depends(get_current_user)):
+    """Record a settlement payment between two users"""
+    group = await db.groups.find_one({"id": settlement_data.group_id})
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    if current_user["id"] not in group.get("members", []):
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    
+    if settlement_data.paid_to not in group.get("members", []):
+        raise HTTPException(status_code=400, detail="Recipient is not a member of this group")
+    
+    if settlement_data.paid_to == current_user["id"]:
+        raise HTTPException(status_code=400, detail="Cannot settle with yourself")
+    
+    if settlement_data.currency not in CURRENCIES:
+        raise HTTPException(status_code=400, detail=f"Invalid currency. Allowed: {CURRENCIES}")
+    
+    # Get user details
+    paid_to_user = await db.users.find_one({"id": settlement_data.paid_to})
+    if not paid_to_user:
+        raise HTTPException(status_code=404, detail="Recipient user not found")
+    
+    settlement_id = str(uuid.uuid4())
     settlement = {
         "id": settlement_id,
         "group_id": settlement_data.group_id,
@@ -919,10 +1577,16 @@ async def create_settlement(settlement_data: SettlementCreate, current_user: dic
         "amount": settlement_data.amount,
         "currency": settlement_data.currency,
         "note": settlement_data.note,
-        "date": datetime.utcnow()
+        "date": datetime.utcnow(),
+        "version": 1
     }
     
-    await db.settlements.insert_one(settlement)
+    async def write_settlement(session):
+        settlement["seq"] = await next_change_seq(settlement["group_id"], session=session)
+        await db.settlements.insert_one(dict(settlement), session=session)
+        await update_group_ledgers(settlement_changes=[(None, settlement)], session=session)
+    
+    await run_in_transaction(write_settlement)
     
     return {
         "id": settlement_id,
@@ -935,50 +1599,200 @@ async def create_settlement(settlement_data: SettlementCreate, current_user: dic
         "amount": settlement_data.amount,
         "currency": settlement_data.currency,
         "note": settlement_data.note,
-        "date": settlement["date"]
+        "date": settlement["date"],
+        "version": settlement["version"]
     }
 
+def settlements_query(user_id: str, group_id: Optional[str] = None, cursor: Optional[str] = None) -> dict:
+    """Filter for the settlements a user paid or received, optionally in one group and after a page cursor"""
+    conditions = [{"$or": [{"paid_by": user_id}, {"paid_to": user_id}]}]
+    if group_id:
+        conditions.append({"group_id": group_id})
+    after = keyset_after(cursor)
+    if after:
+        conditions.append(after)
+    return {"$and": conditions} if len(conditions) > 1 else conditions[0]
+
 @api_router.get("/settlements")
-async def get_settlements(group_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    """Get settlements for the user"""
-    query = {"$or": [{"paid_by": current_user["id"]}, {"paid_to": current_user["id"]}]}
+async def get_settlements(
+    response: Response,
+    group_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get settlements for the user, newest first.
+
+    Pages are keyed on (date, id); when more results exist the token for the
+    next page is returned in the X-Next-Cursor header.
+    """
+    query = settlements_query(current_user["id"], group_id, cursor)
+    # Fetch one extra row to know whether another page exists
+    page = await db.settlements.find(query).sort([("date", -1), ("id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+    
+    if len(page) > limit:
+        page = page[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(page[-1]["date"], page[-1]["id"])
+    
+    if not page:
+        return []
     
-    if group_id:
-        query["group_id"] = group_id
+    # Batch fetch groups and users
+    group_ids = list(set(s["group_id"] for s in page))
+    user_ids = list(set(s["paid_by"] for s in page) | set(s["paid_to"] for s in page))
     
-    settlements_cursor = db.settlements.find(query).sort("date", -1)
-    settlements = []
+    groups_dict = {}
+    async for grp in db.groups.find({"id": {"$in": group_ids}}, {"id": 1, "name": 1}):
+        groups_dict[grp["id"]] = grp.get("name", "Unknown")
     
-    async for settlement in settlements_cursor:
-        # Get group name
-        group = await db.groups.find_one({"id": settlement["group_id"]})
-        group_name = group["name"] if group else "Unknown"
-        
-        # Get user names
-        paid_by_user = await db.users.find_one({"id": settlement["paid_by"]})
-        paid_to_user = await db.users.find_one({"id": settlement["paid_to"]})
-        
+    users_dict = {}
+    async for user in db.users.find({"id": {"$in": user_ids}}, {"id": 1, "name": 1}):
+        users_dict[user["id"]] = user.get("name", "Unknown")
+    
+    settlements = []
+    for settlement in page:
         settlements.append({
             "id": settlement["id"],
             "group_id": settlement["group_id"],
-            "group_name": group_name,
+            "group_name": groups_dict.get(settlement["group_id"], "Unknown"),
             "paid_by": settlement["paid_by"],
-            "paid_by_name": paid_by_user["name"] if paid_by_user else "Unknown",
+            "paid_by_name": users_dict.get(settlement["paid_by"], "Unknown"),
             "paid_to": settlement["paid_to"],
-            "paid_to_name": paid_to_user["name"] if paid_to_user else "Unknown",
+            "paid_to_name": users_dict.get(settlement["paid_to"], "Unknown"),
             "amount": settlement["amount"],
             "currency": settlement["currency"],
             "note": settlement.get("note", ""),
-            "date": settlement["date"]
+            "date": settlement["date"],
+            "version": settlement.get("version", 0)
         })
     
     return settlements
 
+SETTLEMENT_REVISION_FIELDS = ("paid_by", "paid_to", "amount", "currency", "note", "date")
+
+async def get_member_settlement(settlement_id: str, current_user: dict):
+    settlement = await db.settlements.find_one({"id": settlement_id})
+    if not settlement:
+        raise HTTPException(status_code=404, detail="Settlement not found")
+    
+    # Verify user is member of the group
+    group = await db.groups.find_one({"id": settlement["group_id"], "members": current_user["id"]})
+    if not group:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return settlement, group
+
+async def record_settlement_revision(settlement: dict, action: str, fields, current_user: dict, session=None):
+    """Keep the previous values of the changed fields only"""
+    await db.settlement_revisions.insert_one({
+        "id": str(uuid.uuid4()),
+        "settlement_id": settlement["id"],
+        "group_id": settlement["group_id"],
+        "action": action,
+        "previous": {field: settlement.get(field) for field in fields},
+        "changed_by": current_user["id"],
+        "changed_at": datetime.utcnow()
+    }, session=session)
+
+@api_router.put("/settlements/{settlement_id}")
+async def update_settlement(
+    settlement_id: str,
+    settlement_data: SettlementUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Correct a settlement; balances are adjusted by the difference"""
+    settlement, group = await get_member_settlement(settlement_id, current_user)
+    check_version(settlement, expected_version(if_match, settlement_data.version), "Settlement")
+    
+    update_data = {}
+    if settlement_data.paid_to is not None:
+        if settlement_data.paid_to not in group.get("members", []):
+            raise HTTPException(status_code=400, detail="Recipient is not a member of this group")
+        if settlement_data.paid_to == settlement["paid_by"]:
+            raise HTTPException(status_code=400, detail="Cannot settle with yourself")
+        update_data["paid_to"] = settlement_data.paid_to
+    if settlement_data.amount is not None:
+        update_data["amount"] = settlement_data.amount
+    if settlement_data.currency is not None:
+        if settlement_data.currency not in CURRENCIES:
+            raise HTTPException(status_code=400, detail=f"Invalid currency. Allowed: {CURRENCIES}")
+        update_data["currency"] = settlement_data.currency
+    if settlement_data.note is not None:
+        update_data["note"] = settlement_data.note
+    
+    changed = {key: value for key, value in update_data.items() if settlement.get(key) != value}
+    
+    if changed:
+        async def write_update(session):
+            # The pre-image returned by the update is what the ledger delta is computed from
+            seq = await next_change_seq(settlement["group_id"], session=session)
+            before = await db.settlements.find_one_and_update(
+                {"id": settlement_id, **version_query(settlement.get("version", 0))},
+                {"$set": {**changed, "seq": seq}, "$inc": {"version": 1}},
+                session=session
+            )
+            if before is None:
+                raise HTTPException(status_code=409, detail="Settlement was changed by someone else; reload and retry")
+            after = {**before, **changed, "seq": seq, "version": before.get("version", 0) + 1}
+            await update_group_ledgers(settlement_changes=[(before, after)], session=session)
+            await record_settlement_revision(before, "update", changed.keys(), current_user, session)
+            return after
+        
+        settlement = await run_in_transaction(write_update)
+    
+    response.headers["ETag"] = version_etag(settlement)
+    users_dict = {}
+    async for user in db.users.find({"id": {"$in": [settlement["paid_by"], settlement["paid_to"]]}}, {"id": 1, "name": 1}):
+        users_dict[user["id"]] = user.get("name", "Unknown")
+    
+    return {
+        "id": settlement["id"],
+        "group_id": settlement["group_id"],
+        "group_name": group["name"],
+        "paid_by": settlement["paid_by"],
+        "paid_by_name": users_dict.get(settlement["paid_by"], "Unknown"),
+        "paid_to": settlement["paid_to"],
+        "paid_to_name": users_dict.get(settlement["paid_to"], "Unknown"),
+        "amount": settlement["amount"],
+        "currency": settlement["currency"],
+        "note": settlement.get("note", ""),
+        "date": settlement["date"],
+        "version": settlement.get("version", 0)
+    }
+
+@api_router.delete("/settlements/{settlement_id}")
+async def delete_settlement(
+    settlement_id: str,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Remove a mistaken settlement; balances are adjusted by reversing it"""
+    existing, _ = await get_member_settlement(settlement_id, current_user)
+    version = parse_if_match(if_match)
+    check_version(existing, version, "Settlement")
+    
+    async def write_delete(session):
+        query = {"id": settlement_id}
+        if version is not None:
+            query.update(version_query(version))
+        settlement = await db.settlements.find_one_and_delete(query, session=session)
+        if settlement is None:
+            raise HTTPException(status_code=409 if version is not None else 404, detail="Settlement was changed or removed; reload and retry")
+        seq = await next_change_seq(settlement["group_id"], session=session)
+        await db.tombstones.insert_one(tombstone("settlement", settlement, seq), session=session)
+        await update_group_ledgers(settlement_changes=[(settlement, None)], session=session)
+        await record_settlement_revision(settlement, "delete", SETTLEMENT_REVISION_FIELDS, current_user, session)
+    
+    await run_in_transaction(write_delete)
+    return {"message": "Settlement deleted"}
+
 @api_router.get("/balances/summary")
 async def get_all_balances(current_user: dict = Depends(get_current_user)):
     """Get overall balance summary across all groups (what you owe/are owed)"""
     # Get all user's groups
-    groups = await db.groups.find({"members": current_user["id"], "mode": "split"}).to_list(length=100)
+    groups = await db.groups.find({**member_groups_query(current_user["id"]), "mode": "split"}).to_list(length=100)
     
     all_debts_to_pay = []  # What current user owes to others
     all_debts_to_receive = []  # What others owe to current user
@@ -986,51 +1800,12 @@ async def get_all_balances(current_user: dict = Depends(get_current_user)):
     for group in groups:
         # Get balances for this group
         group_id = group["id"]
-        expenses = await db.expenses.find({"group_id": group_id}).to_list(length=10000)
-        settlements = await db.settlements.find({"group_id": group_id}).to_list(length=10000)
-        
-        members = {}
-        for member_id in group.get("members", []):
-            user = await db.users.find_one({"id": member_id})
-            if user:
-                members[member_id] = {"name": user["name"], "avatar_color": user["avatar_color"]}
+        members, member_balances = await load_group_balances(group)
         
         if len(members) < 2:
             continue
         
-        # Calculate net balances
-        member_net = {mid: {} for mid in members}
-        num_members = len(members)
-        
-        for expense in expenses:
-            currency = expense["currency"]
-            amount = expense["amount"]
-            paid_by = expense["paid_by"]
-            share_per_person = amount / num_members
-            
-            for member_id in members:
-                if currency not in member_net[member_id]:
-                    member_net[member_id][currency] = 0
-                if member_id == paid_by:
-                    member_net[member_id][currency] += amount - share_per_person
-                else:
-                    member_net[member_id][currency] -= share_per_person
-        
-        for settlement in settlements:
-            currency = settlement["currency"]
-            amount = settlement["amount"]
-            paid_by = settlement["paid_by"]
-            paid_to = settlement["paid_to"]
-            
-            if paid_by in member_net:
-                if currency not in member_net[paid_by]:
-                    member_net[paid_by][currency] = 0
-                member_net[paid_by][currency] += amount
-            
-            if paid_to in member_net:
-                if currency not in member_net[paid_to]:
-                    member_net[paid_to][currency] = 0
-                member_net[paid_to][currency] -= amount
+        member_net = {mid: balances["net_balance"] for mid, balances in member_balances.items()}
         
         # Calculate debts for current user
         current_user_net = member_net.get(current_user["id"], {})
@@ -1106,8 +1881,13 @@ async def get_all_balances(current_user: dict = Depends(get_current_user)):
     }
 
 @api_router.put("/groups/{group_id}/mode")
-async def update_group_mode(group_id: str, mode: str, current_user: dict = Depends(get_current_user)):
-    """Update group mode (split/contribution)"""
+async def update_group_mode(
+    group_id: str,
+    mode: str,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Update group mode (split/contribution); with If-Match only from that group version"""
     if mode not in ["split", "contribution"]:
         raise HTTPException(status_code=400, detail="Mode must be 'split' or 'contribution'")
     
@@ -1121,9 +1901,17 @@ async def update_group_mode(group_id: str, mode: str, current_user: dict = Depen
     if group.get("type") == "personal":
         raise HTTPException(status_code=400, detail="Cannot change mode for personal group")
     
-    await db.groups.update_one({"id": group_id}, {"$set": {"mode": mode}})
+    check_version(group, parse_if_match(if_match), "Group")
+    updated_group = await db.groups.find_one_and_update(
+        {"id": group_id, **version_query(group.get("version", 0))},
+        {"$set": {"mode": mode}, "$inc": {"change_seq": 1, "version": 1}},
+        projection={"version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_group:
+        raise HTTPException(status_code=409, detail="Group was changed by someone else; reload and retry")
     
-    return {"message": f"Group mode updated to {mode}"}
+    return {"message": f"Group mode updated to {mode}", "version": updated_group["version"]}
 
 # ==================== CATEGORY ROUTES ====================
 
@@ -1193,7 +1981,11 @@ async def create_category(cat_data: CategoryCreate, group_id: str, current_user:
         "group_id": group_id
     }
     
-    await db.categories.insert_one(category)
+    async def write_category(session):
+        category["seq"] = await next_change_seq(group_id, session=session)
+        await db.categories.insert_one(dict(category), session=session)
+    
+    await run_in_transaction(write_category)
     
     return CategoryResponse(**category)
 
@@ -1211,11 +2003,220 @@ async def delete_category(category_id: str, current_user: dict = Depends(get_cur
     if not group:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.categories.delete_one({"id": category_id})
+    async def write_delete(session):
+        seq = await next_change_seq(category["group_id"], session=session)
+        await db.categories.delete_one({"id": category_id}, session=session)
+        await db.tombstones.insert_one(tombstone("category", category, seq), session=session)
+        await mark_analytics_changed([category["group_id"]], session=session)
+    
+    await run_in_transaction(write_delete)
     return {"message": "Category deleted"}
 
 # ==================== EXPENSE ROUTES ====================
 
+def expense_lookup_pipeline(query: dict, sort: List[tuple], limit: Optional[int] = None) -> List[dict]:
+    """Aggregation returning matching expenses with their category, payer and group joined in.
+
+    Uses the concise localField/pipeline $lookup form (MongoDB 5.0+) so each
+    join is an index lookup on the foreign "id".
+    """
+    pipeline = [{"$match": query}, {"$sort": dict(sort)}]
+    if limit:
+        pipeline.append({"$limit": limit})
+    for collection, local_field, fields, alias in (
+        ("categories", "category_id", {"name": 1, "icon": 1, "color": 1}, "category"),
+        ("users", "paid_by", {"name": 1, "avatar_color": 1}, "payer"),
+        ("groups", "group_id", {"name": 1}, "group"),
+    ):
+        pipeline.append({"$lookup": {
+            "from": collection,
+            "localField": local_field,
+            "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "id": 1, **fields}}],
+            "as": alias,
+        }})
+    pipeline.append({"$project": {"_id": 0, "search_terms": 0}})
+    return pipeline
+
+async def fetch_enriched_expenses(endpoint: str, query: dict, sort: List[tuple], limit: Optional[int] = None):
+    """Expenses matching the query and the category, payer and group details they reference.
+
+    Returns (expenses, categories_dict, users_dict, groups_dict) in the shape
+    build_expense_response expects. ENRICHMENT_STRATEGIES picks, per endpoint,
+    between one $lookup aggregation and three batched follow-up queries.
+    """
+    categories_dict = {}
+    users_dict = {}
+    groups_dict = {}
+    
+    if ENRICHMENT_STRATEGIES.get(endpoint) == "lookup":
+        expenses = await db.expenses.aggregate(expense_lookup_pipeline(query, sort, limit)).to_list(length=None)
+        for exp in expenses:
+            for cat in exp.pop("category", []):
+                categories_dict[cat["id"]] = cat
+            for user in exp.pop("payer", []):
+                users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+            for grp in exp.pop("group", []):
+                groups_dict[grp["id"]] = grp.get("name", "Unknown")
+        return expenses, categories_dict, users_dict, groups_dict
+    
+    cursor = db.expenses.find(query, {"_id": 0, "search_terms": 0}).sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    expenses = await cursor.to_list(length=limit)
+    if not expenses:
+        return expenses, categories_dict, users_dict, groups_dict
+    
+    async for cat in db.categories.find({"id": {"$in": list(set(exp["category_id"] for exp in expenses))}}, {"id": 1, "name": 1, "icon": 1, "color": 1}):
+        categories_dict[cat["id"]] = cat
+    
+    async for user in db.users.find({"id": {"$in": list(set(exp["paid_by"] for exp in expenses))}}, {"id": 1, "name": 1, "avatar_color": 1}):
+        users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+    
+    async for grp in db.groups.find({"id": {"$in": list(set(exp["group_id"] for exp in expenses))}}, {"id": 1, "name": 1}):
+        groups_dict[grp["id"]] = grp.get("name", "Unknown")
+    
+    return expenses, categories_dict, users_dict, groups_dict
+
+async def iter_enriched_expenses(endpoint: str, query: dict, sort: List[tuple], batch_size: int):
+    """Stream expenses matching the query in batches, like fetch_enriched_expenses without a limit.
+
+    Yields (expenses, categories_dict, users_dict, groups_dict) per batch of
+    at most batch_size expenses. The dicts accumulate across batches, so the
+    "queries" strategy only looks up IDs it has not seen yet and memory stays
+    bounded by the batch size plus the distinct referenced documents.
+    """
+    categories_dict = {}
+    users_dict = {}
+    groups_dict = {}
+    lookup = ENRICHMENT_STRATEGIES.get(endpoint) == "lookup"
+    
+    async def enrich(expenses):
+        if lookup:
+            for exp in expenses:
+                for cat in exp.pop("category", []):
+                    categories_dict[cat["id"]] = cat
+                for user in exp.pop("payer", []):
+                    users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+                for grp in exp.pop("group", []):
+                    groups_dict[grp["id"]] = grp.get("name", "Unknown")
+            return
+        
+        category_ids = list(set(exp["category_id"] for exp in expenses) - categories_dict.keys())
+        async for cat in db.categories.find({"id": {"$in": category_ids}}, {"id": 1, "name": 1, "icon": 1, "color": 1}):
+            categories_dict[cat["id"]] = cat
+        
+        user_ids = list(set(exp["paid_by"] for exp in expenses) - users_dict.keys())
+        async for user in db.users.find({"id": {"$in": user_ids}}, {"id": 1, "name": 1, "avatar_color": 1}):
+            users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+        
+        group_ids = list(set(exp["group_id"] for exp in expenses) - groups_dict.keys())
+        async for grp in db.groups.find({"id": {"$in": group_ids}}, {"id": 1, "name": 1}):
+            groups_dict[grp["id"]] = grp.get("name", "Unknown")
+    
+    if lookup:
+        cursor = db.expenses.aggregate(expense_lookup_pipeline(query, sort), batchSize=batch_size)
+    else:
+        cursor = db.expenses.find(query, {"_id": 0, "search_terms": 0}).sort(sort).batch_size(batch_size)
+    
+    batch = []
+    async for expense in cursor:
+        batch.append(expense)
+        if len(batch) >= batch_size:
+            await enrich(batch)
+            yield batch, categories_dict, users_dict, groups_dict
+            batch = []
+    if batch:
+        await enrich(batch)
+        yield batch, categories_dict, users_dict, groups_dict
+
+def build_expense_response(expense: dict, categories_dict: dict, users_dict: dict, groups_dict: dict) -> ExpenseResponse:
+    category = categories_dict.get(expense["category_id"], {"name": "Unknown", "icon": "help-circle", "color": "#999999"})
+    user_info = users_dict.get(expense["paid_by"], {"name": "Unknown", "color": "#999999"})
+    
+    return ExpenseResponse(
+        id=expense["id"],
+        amount=expense["amount"],
+        currency=expense["currency"],
+        category_id=expense["category_id"],
+        category_name=category.get("name", "Unknown"),
+        category_icon=category.get("icon", "help-circle"),
+        category_color=category.get("color", "#999999"),
+        description=expense.get("description", ""),
+        paid_by=expense["paid_by"],
+        paid_by_name=user_info["name"],
+        paid_by_color=user_info["color"],
+        group_id=expense["group_id"],
+        group_name=groups_dict.get(expense["group_id"], "Unknown"),
+        date=expense["date"],
+        created_at=expense["created_at"],
+        version=expense.get("version", 0)
+    )
+
+def expense_content_hash(expense: dict) -> str:
+    """Hash of the fields that identify an expense's content, used to spot re-imported rows.
+
+    Only the day of the date is hashed, as that is all a CSV export keeps.
+    """
+    content = "|".join([
+        expense["group_id"],
+        expense["date"].strftime("%Y-%m-%d"),
+        f"{round(float(expense['amount']), 2):.2f}",
+        expense["currency"],
+        " ".join(expense.get("description", "").lower().split())
+    ])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def search_words(text: str) -> List[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+def build_search_terms(description: str, category_name: str, payer_name: str) -> List[str]:
+    """Every prefix of every word in the description, category and payer names.
+
+    Stored on the expense and indexed, so a prefix query is an index lookup.
+    """
+    terms = set()
+    for word in search_words(f"{description} {category_name} {payer_name}"):
+        word = word[:SEARCH_MAX_PREFIX]
+        for end in range(SEARCH_MIN_PREFIX, len(word) + 1):
+            terms.add(word[:end])
+    return sorted(terms)
+
+async def refresh_search_terms(query: dict) -> int:
+    """Recompute search_terms of the matching expenses, e.g. after their payer was renamed"""
+    updated = 0
+    batch = []
+    
+    async def write(expenses: List[dict]):
+        categories_dict = {}
+        async for cat in db.categories.find({"id": {"$in": list(set(e["category_id"] for e in expenses))}}, {"id": 1, "name": 1}):
+            categories_dict[cat["id"]] = cat.get("name", "")
+        users_dict = {}
+        async for user in db.users.find({"id": {"$in": list(set(e["paid_by"] for e in expenses))}}, {"id": 1, "name": 1}):
+            users_dict[user["id"]] = user.get("name", "")
+        await db.expenses.bulk_write([
+            UpdateOne({"id": e["id"]}, {"$set": {"search_terms": build_search_terms(
+                e.get("description", ""), categories_dict.get(e["category_id"], ""), users_dict.get(e["paid_by"], "")
+            )}})
+            for e in expenses
+        ], ordered=False)
+    
+    projection = {"_id": 0, "id": 1, "description": 1, "category_id": 1, "paid_by": 1}
+    async for expense in db.expenses.find(query, projection):
+        batch.append(expense)
+        if len(batch) >= SEARCH_SCAN_BATCH_SIZE:
+            await write(batch)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await write(batch)
+        updated += len(batch)
+    return updated
+
+def is_replayed_create(existing: dict, expense_data: ExpenseCreate, current_user: dict) -> bool:
+    """A create whose client ID already exists is a retry if it came from the same user and group"""
+    return existing["paid_by"] == current_user["id"] and existing["group_id"] == expense_data.group_id
+
 @api_router.post("/expenses", response_model=ExpenseResponse)
 async def create_expense(expense_data: ExpenseCreate, current_user: dict = Depends(get_current_user)):
     # Verify user is member of the group
@@ -1229,7 +2230,7 @@ async def create_expense(expense_data: ExpenseCreate, current_user: dict = Depen
     category = await get_category_info(expense_data.category_id, expense_data.group_id)
     user_info = await get_user_info(current_user["id"])
     
-    expense_id = str(uuid.uuid4())
+    expense_id = expense_data.id or str(uuid.uuid4())
     expense_date = expense_data.date or datetime.utcnow()
     
     expense = {
@@ -1241,115 +2242,447 @@ async def create_expense(expense_data: ExpenseCreate, current_user: dict = Depen
         "paid_by": current_user["id"],
         "group_id": expense_data.group_id,
         "date": expense_date,
-        "created_at": datetime.utcnow()
+        "created_at": datetime.utcnow(),
+        "version": 1
     }
+    expense["content_hash"] = expense_content_hash(expense)
+    expense["search_terms"] = build_search_terms(expense_data.description, category.get("name", ""), user_info["name"])
+    
+    async def write_expense(session):
+        expense["seq"] = await next_change_seq(expense["group_id"], session=session)
+        await db.expenses.insert_one(dict(expense), session=session)
+        await update_group_ledgers(expense_changes=[(None, expense)], session=session)
+        await update_spending_rollups([(None, expense)], session=session)
+        await update_budget_usage([(None, expense)], session=session)
+    
+    existing = await db.expenses.find_one({"id": expense_id}) if expense_data.id else None
+    if existing is None:
+        try:
+            await run_in_transaction(write_expense)
+        except DuplicateKeyError:
+            existing = await db.expenses.find_one({"id": expense_id})
+    
+    if existing is not None:
+        # A retried create returns the expense stored by the first attempt
+        if not is_replayed_create(existing, expense_data, current_user):
+            raise HTTPException(status_code=409, detail="Expense ID already in use")
+        expense = existing
+    
+    return build_expense_response(
+        expense,
+        {expense["category_id"]: category},
+        {current_user["id"]: user_info},
+        {group["id"]: group["name"]}
+    )
+
+@api_router.post("/expenses/batch")
+async def batch_expenses(
+    batch: ExpenseBatchRequest,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Apply many expense creates, updates and deletes in one request.
+
+    Creates use client-generated IDs, so replaying an operation never
+    duplicates an expense. Requests sent with an Idempotency-Key header return
+    the stored result when replayed. Each operation gets its own result, and
+    operations that fail validation do not block the rest.
+    """
+    operations = batch.operations
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+    
+    if len(set(op.id for op in operations)) != len(operations):
+        raise HTTPException(status_code=400, detail="Each expense ID may appear only once per batch")
+    
+    if idempotency_key:
+        replayed = await claim_idempotency_key(current_user["id"], idempotency_key)
+        if replayed is not None:
+            return replayed
     
-    await db.expenses.insert_one(expense)
+    try:
+        result = await apply_expense_batch(operations, current_user)
+    except Exception:
+        if idempotency_key:
+            await release_idempotency_key(current_user["id"], idempotency_key)
+        raise
+    
+    result = jsonable_encoder(result)
+    if idempotency_key:
+        await complete_idempotency_key(current_user["id"], idempotency_key, result)
+    return result
+
+async def apply_expense_batch(operations: List[ExpenseBatchOperation], current_user: dict) -> dict:
+    # Existing documents for every ID, in one query
+    existing = {}
+    async for exp in db.expenses.find({"id": {"$in": [op.id for op in operations]}}):
+        existing[exp["id"]] = exp
+    
+    # Authorise each group once
+    group_ids = set()
+    for op in operations:
+        if op.op == "create" and op.expense:
+            group_ids.add(op.expense.group_id)
+        elif op.id in existing:
+            group_ids.add(existing[op.id]["group_id"])
     
-    return ExpenseResponse(
-        id=expense_id,
-        amount=expense_data.amount,
-        currency=expense_data.currency,
-        category_id=expense_data.category_id,
-        category_name=category.get("name", "Unknown"),
-        category_icon=category.get("icon", "help-circle"),
-        category_color=category.get("color", "#999999"),
-        description=expense_data.description,
-        paid_by=current_user["id"],
-        paid_by_name=user_info["name"],
-        paid_by_color=user_info["color"],
-        group_id=expense_data.group_id,
-        group_name=group["name"],
-        date=expense_date,
-        created_at=expense["created_at"]
-    )
+    groups_dict = {}
+    async for grp in db.groups.find({"id": {"$in": list(group_ids)}, "members": current_user["id"]}, {"id": 1, "name": 1}):
+        groups_dict[grp["id"]] = grp.get("name", "Unknown")
+    
+    # Resolve categories and payers once for the whole batch
+    category_ids = set(exp["category_id"] for exp in existing.values())
+    for op in operations:
+        if op.expense:
+            category_ids.add(op.expense.category_id)
+        if op.changes and op.changes.category_id:
+            category_ids.add(op.changes.category_id)
+    
+    categories_dict = {}
+    async for cat in db.categories.find({"id": {"$in": list(category_ids)}}, {"id": 1, "name": 1, "icon": 1, "color": 1}):
+        categories_dict[cat["id"]] = cat
+    
+    users_dict = {}
+    payer_ids = list(set(exp["paid_by"] for exp in existing.values()) | {current_user["id"]})
+    async for user in db.users.find({"id": {"$in": payer_ids}}, {"id": 1, "name": 1, "avatar_color": 1}):
+        users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+    
+    def with_search_terms(expense: dict) -> dict:
+        category_name = categories_dict.get(expense["category_id"], {}).get("name", "")
+        payer_name = users_dict.get(expense["paid_by"], {}).get("name", "")
+        expense["search_terms"] = build_search_terms(expense.get("description", ""), category_name, payer_name)
+        return expense
+    
+    now = datetime.utcnow()
+    results = []
+    # (result index, before, after) per write; before is None for creates and after is None for deletes
+    pending = []
+    
+    def fail(op, status_code: int, detail: str):
+        results.append({"id": op.id, "op": op.op, "status": "error", "status_code": status_code, "detail": detail})
+    
+    for op in operations:
+        if op.op == "create":
+            if op.expense is None:
+                fail(op, 400, "Create requires an expense")
+            elif op.expense.group_id not in groups_dict:
+                fail(op, 403, "Not a member of this group")
+            elif op.expense.currency not in CURRENCIES:
+                fail(op, 400, f"Invalid currency. Allowed: {CURRENCIES}")
+            elif op.id in existing:
+                if is_replayed_create(existing[op.id], op.expense, current_user):
+                    results.append({"id": op.id, "op": op.op, "status": "unchanged"})
+                else:
+                    fail(op, 409, "Expense ID already in use")
+            else:
+                expense = {
+                    "id": op.id,
+                    "amount": op.expense.amount,
+                    "currency": op.expense.currency,
+                    "category_id": op.expense.category_id,
+                    "description": op.expense.description,
+                    "paid_by": current_user["id"],
+                    "group_id": op.expense.group_id,
+                    "date": op.expense.date or now,
+                    "created_at": now,
+                    "version": 1
+                }
+                expense["content_hash"] = expense_content_hash(expense)
+                pending.append((len(results), None, with_search_terms(expense)))
+                results.append({"id": op.id, "op": op.op, "status": "created"})
+            continue
+        
+        if op.op not in ("update", "delete"):
+            fail(op, 400, "Operation must be 'create', 'update' or 'delete'")
+            continue
+        
+        before = existing.get(op.id)
+        if before is None:
+            fail(op, 404, "Expense not found")
+        elif before["group_id"] not in groups_dict:
+            fail(op, 403, "Not authorized")
+        elif op.version is not None and before.get("version", 0) != op.version:
+            fail(op, 409, "Expense was changed by someone else; reload and retry")
+        elif op.op == "delete":
+            pending.append((len(results), before, None))
+            results.append({"id": op.id, "op": op.op, "status": "deleted"})
+        elif op.changes is None:
+            fail(op, 400, "Update requires changes")
+        elif op.changes.currency is not None and op.changes.currency not in CURRENCIES:
+            fail(op, 400, f"Invalid currency. Allowed: {CURRENCIES}")
+        else:
+            update_data = op.changes.model_dump(exclude_none=True, exclude={"version"})
+            if update_data:
+                update_data["version"] = before.get("version", 0) + 1
+                update_data["content_hash"] = expense_content_hash({**before, **update_data})
+                pending.append((len(results), before, with_search_terms({**before, **update_data})))
+            results.append({"id": op.id, "op": op.op, "status": "updated"})
+    
+    changes = []
+    if pending:
+        async def write_batch(session):
+            # One sequence range per group, handed out in operation order
+            group_counts = {}
+            for _, before, after in pending:
+                group_id = (after or before)["group_id"]
+                group_counts[group_id] = group_counts.get(group_id, 0) + 1
+            next_seqs = {}
+            for group_id, count in group_counts.items():
+                next_seqs[group_id] = await next_change_seq(group_id, count, session=session) - count + 1
+            
+            requests, writes = [], []
+            for index, before, after in pending:
+                group_id = (after or before)["group_id"]
+                seq = next_seqs[group_id]
+                next_seqs[group_id] += 1
+                if before is None:
+                    after["seq"] = seq
+                    # Upsert on the client ID so a concurrent create cannot insert twice
+                    requests.append(UpdateOne({"id": after["id"]}, {"$setOnInsert": dict(after)}, upsert=True))
+                elif after is None:
+                    requests.append(DeleteOne({"id": before["id"], **version_query(before.get("version", 0))}))
+                else:
+                    after["seq"] = seq
+                    update_data = {key: value for key, value in after.items() if key != "_id" and before.get(key) != value}
+                    # Only applies if nobody changed the expense since it was read above
+                    requests.append(UpdateOne({"id": after["id"], **version_query(before.get("version", 0))}, {"$set": update_data}))
+                writes.append((index, before, after, seq))
+            
+            # Every write in one round trip; which ones took effect is read back below
+            result = await db.expenses.bulk_write(requests, ordered=False, session=session)
+            current_seqs = {}
+            existing_ids = [before["id"] for _, before, _, _ in writes if before is not None]
+            if existing_ids:
+                async for exp in db.expenses.find({"id": {"$in": existing_ids}}, {"id": 1, "seq": 1, "_id": 0}, session=session):
+                    current_seqs[exp["id"]] = exp.get("seq")
+            gone = [before for _, before, after, _ in writes if after is None and before["id"] not in current_seqs]
+            # Fewer deletes than missing expenses means another request deleted some of
+            # them (possible only without transactions), so whose delete was whose is unknown
+            deletes_known = result.deleted_count == len(gone)
+            
+            # Only operations that took effect move balances and analytics; the rest are reported as conflicts
+            applied, conflicts = [], []
+            for position, (index, before, after, seq) in enumerate(writes):
+                if before is None:
+                    done = position in result.upserted_ids
+                elif after is None:
+                    done = before["id"] not in current_seqs
+                else:
+                    # The seq is this write's own, so it is only there if the update applied
+                    done = current_seqs.get(after["id"]) == seq
+                if not done:
+                    conflicts.append(index)
+                elif after is not None or deletes_known:
+                    applied.append((before, after))
+            
+            tombstones = [tombstone("expense", before, seq) for _, before, after, seq in writes if after is None and before in gone]
+            if not deletes_known:
+                # Rebuild these groups' ledgers and rollups from history on their next read
+                for group_id in {before["group_id"] for before in gone}:
+                    await db.group_ledgers.delete_one({"group_id": group_id}, session=session)
+                    await db.groups.update_one({"id": group_id}, {"$set": {"rollup_timezones": []}}, session=session)
+            if tombstones:
+                await db.tombstones.insert_many(tombstones, session=session)
+            await update_group_ledgers(expense_changes=applied, session=session)
+            await update_spending_rollups(applied, session=session)
+            await update_budget_usage(applied, session=session)
+            return applied, conflicts
+        
+        changes, conflicts = await run_in_transaction(write_batch)
+        for index in conflicts:
+            result = results[index]
+            detail = "Expense ID already in use" if result["op"] == "create" else "Expense was changed by someone else; reload and retry"
+            results[index] = {"id": result["id"], "op": result["op"], "status": "error", "status_code": 409, "detail": detail}
+    
+    written = [after for _, after in changes if after]
+    
+    return {
+        "results": results,
+        "expenses": [build_expense_response(e, categories_dict, users_dict, groups_dict) for e in written]
+    }
+
+def expenses_query(
+    group_ids: List[str],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    category_id: Optional[str] = None,
+    paid_by: Optional[str] = None,
+    cursor: Optional[str] = None
+) -> dict:
+    """Filter for the expense list: the groups' expenses within the filters, after a page cursor"""
+    query = {"group_id": {"$in": group_ids}}
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = start
+        if end:
+            query["date"]["$lte"] = end
+    if category_id:
+        query["category_id"] = category_id
+    if paid_by:
+        query["paid_by"] = paid_by
+    after = keyset_after(cursor)
+    if after:
+        query.update(after)
+    return query
 
 @api_router.get("/expenses", response_model=List[ExpenseResponse])
 async def get_expenses(
+    response: Response,
     group_id: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     category_id: Optional[str] = None,
     paid_by: Optional[str] = None,
-    limit: int = 100,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    include_archived: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
-    # Get all groups user is member of
-    if group_id:
-        group = await db.groups.find_one({"id": group_id, "members": current_user["id"]})
-        if not group:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        group_ids = [group_id]
-    else:
-        groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
-        group_ids = [g["id"] for g in groups]
-    
-    query = {"group_id": {"$in": group_ids}}
-    
-    if start_date:
-        query["date"] = {"$gte": datetime.fromisoformat(start_date)}
-    if end_date:
-        if "date" in query:
-            query["date"]["$lte"] = datetime.fromisoformat(end_date)
-        else:
-            query["date"] = {"$lte": datetime.fromisoformat(end_date)}
-    if category_id:
-        query["category_id"] = category_id
-    if paid_by:
-        query["paid_by"] = paid_by
+    """List expenses newest first.
+
+    Pages are keyed on (date, id); when more results exist the token for the
+    next page is returned in the X-Next-Cursor header. Larger limits are
+    clamped to MAX_PAGE_SIZE rather than rejected.
+    """
+    limit = min(limit, MAX_PAGE_SIZE)
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    query = expenses_query(
+        group_ids,
+        datetime.fromisoformat(start_date) if start_date else None,
+        datetime.fromisoformat(end_date) if end_date else None,
+        category_id,
+        paid_by,
+        cursor
+    )
     
-    # Fetch expenses first
-    expenses_cursor = db.expenses.find(query).sort("date", -1).limit(limit)
-    expenses_list = await expenses_cursor.to_list(length=limit)
+    # Fetch one extra row to know whether another page exists
+    expenses_list, categories_dict, users_dict, groups_dict = await fetch_enriched_expenses(
+        "expenses", query, [("date", -1), ("id", -1)], limit + 1
+    )
     
-    if not expenses_list:
-        return []
+    if len(expenses_list) > limit:
+        expenses_list = expenses_list[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(expenses_list[-1]["date"], expenses_list[-1]["id"])
     
-    # Batch fetch categories, users, and groups
-    category_ids = list(set(exp["category_id"] for exp in expenses_list))
-    user_ids = list(set(exp["paid_by"] for exp in expenses_list))
-    exp_group_ids = list(set(exp["group_id"] for exp in expenses_list))
+    return [build_expense_response(exp, categories_dict, users_dict, groups_dict) for exp in expenses_list]
+
+def score_search_match(tokens: List[str], expense: dict, other_names: str) -> int:
+    """Rank a candidate: whole-word description hits beat prefix hits, which beat category/payer hits"""
+    description_words = [w[:SEARCH_MAX_PREFIX] for w in search_words(expense.get("description", ""))]
+    other_words = [w[:SEARCH_MAX_PREFIX] for w in search_words(other_names)]
+    score = 0
+    for token in tokens:
+        if token in description_words:
+            score += 3
+        elif any(w.startswith(token) for w in description_words):
+            score += 2
+        elif any(w.startswith(token) for w in other_words):
+            score += 1
+    return score
+
+def search_query(group_ids: List[str], tokens: List[str], cursor: Optional[str] = None) -> dict:
+    """Filter for the groups' expenses indexed under every token, after a (date, id) cursor"""
+    query = {"group_id": {"$in": group_ids}, "search_terms": {"$all": tokens}}
+    after = keyset_after(cursor)
+    if after:
+        query.update(after)
+    return query
+
+@api_router.get("/expenses/search", response_model=List[ExpenseResponse])
+async def search_expenses(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    group_id: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_archived: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Search expenses by description, category and payer name.
+
+    Every query word is matched as a prefix through the indexed search_terms
+    array. Matches are read newest first in windows of SEARCH_WINDOW_SIZE,
+    one index query each, and ranked by relevance, then date, within their
+    window; once a window's results are paged through, the next page moves on
+    to the following, older window. The token for the next page is returned
+    in the X-Next-Cursor header.
+    """
+    tokens = sorted(set(w[:SEARCH_MAX_PREFIX] for w in search_words(q) if len(w) >= SEARCH_MIN_PREFIX))
+    if not tokens:
+        raise HTTPException(status_code=400, detail=f"Search terms must be at least {SEARCH_MIN_PREFIX} characters")
+    
+    # The cursor holds where the current window starts and, within it, the last result returned
+    window, position = None, None
+    if cursor:
+        try:
+            payload = decode_token(cursor)
+            window = payload.get("w") or None
+            if window is not None and not isinstance(window, str):
+                raise ValueError("window")
+            if "s" in payload:
+                position = (int(payload["s"]), datetime.fromisoformat(payload["d"]), str(payload["i"]))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
     
     categories_dict = {}
-    async for cat in db.categories.find({"id": {"$in": category_ids}}, {"id": 1, "name": 1, "icon": 1, "color": 1}):
-        categories_dict[cat["id"]] = cat
-    
     users_dict = {}
-    async for user in db.users.find({"id": {"$in": user_ids}}, {"id": 1, "name": 1, "avatar_color": 1}):
-        users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+    page = []
+    next_cursor = None
+    while True:
+        # One extra match tells whether an older window exists
+        matches = await db.expenses.find(search_query(group_ids, tokens, window), {"_id": 0, "search_terms": 0}).sort(
+            [("date", -1), ("id", -1)]
+        ).limit(SEARCH_WINDOW_SIZE + 1).to_list(length=SEARCH_WINDOW_SIZE + 1)
+        older = len(matches) > SEARCH_WINDOW_SIZE
+        matches = matches[:SEARCH_WINDOW_SIZE]
+        
+        new_category_ids = list(set(e["category_id"] for e in matches) - categories_dict.keys())
+        async for cat in db.categories.find({"id": {"$in": new_category_ids}}, {"id": 1, "name": 1, "icon": 1, "color": 1}):
+            categories_dict[cat["id"]] = cat
+        new_user_ids = list(set(e["paid_by"] for e in matches) - users_dict.keys())
+        async for user in db.users.find({"id": {"$in": new_user_ids}}, {"id": 1, "name": 1, "avatar_color": 1}):
+            users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+        
+        ranked = []
+        for exp in matches:
+            other_names = f"{categories_dict.get(exp['category_id'], {}).get('name', '')} {users_dict.get(exp['paid_by'], {}).get('name', '')}"
+            key = (score_search_match(tokens, exp, other_names), exp["date"], exp["id"])
+            if position is None or key < position:
+                ranked.append((*key, exp))
+        ranked.sort(key=lambda r: (r[0], r[1], r[2]), reverse=True)
+        
+        taken = ranked[:limit - len(page)]
+        page.extend(taken)
+        if len(ranked) > len(taken):
+            score, date, doc_id, _ = taken[-1]
+            next_cursor = encode_token({"w": window or "", "s": score, "d": date.isoformat(), "i": doc_id})
+            break
+        if not older:
+            break
+        window, position = encode_cursor(matches[-1]["date"], matches[-1]["id"]), None
+        if len(page) == limit:
+            next_cursor = encode_token({"w": window})
+            break
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     groups_dict = {}
-    async for grp in db.groups.find({"id": {"$in": exp_group_ids}}, {"id": 1, "name": 1}):
+    async for grp in db.groups.find({"id": {"$in": list(set(r[3]["group_id"] for r in page))}}, {"id": 1, "name": 1}):
         groups_dict[grp["id"]] = grp.get("name", "Unknown")
     
-    expenses = []
-    for exp in expenses_list:
-        category = categories_dict.get(exp["category_id"], {"name": "Unknown", "icon": "help-circle", "color": "#999999"})
-        user_info = users_dict.get(exp["paid_by"], {"name": "Unknown", "color": "#999999"})
-        group_name = groups_dict.get(exp["group_id"], "Unknown")
-        
-        expenses.append(ExpenseResponse(
-            id=exp["id"],
-            amount=exp["amount"],
-            currency=exp["currency"],
-            category_id=exp["category_id"],
-            category_name=category.get("name", "Unknown"),
-            category_icon=category.get("icon", "help-circle"),
-            category_color=category.get("color", "#999999"),
-            description=exp.get("description", ""),
-            paid_by=exp["paid_by"],
-            paid_by_name=user_info["name"],
-            paid_by_color=user_info["color"],
-            group_id=exp["group_id"],
-            group_name=group_name,
-            date=exp["date"],
-            created_at=exp["created_at"]
-        ))
-    
-    return expenses
+    return [build_expense_response(r[3], categories_dict, users_dict, groups_dict) for r in page]
 
 @api_router.get("/expenses/{expense_id}", response_model=ExpenseResponse)
-async def get_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
+async def get_expense(
+    expense_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     expense = await db.expenses.find_one({"id": expense_id})
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
@@ -1359,6 +2692,11 @@ async def get_expense(expense_id: str, current_user: dict = Depends(get_current_
     if not group:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    etag = version_etag(expense)
+    if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
     category = await get_category_info(expense["category_id"], expense["group_id"])
     user_info = await get_user_info(expense["paid_by"])
     
@@ -1377,11 +2715,19 @@ async def get_expense(expense_id: str, current_user: dict = Depends(get_current_
         group_id=expense["group_id"],
         group_name=group["name"],
         date=expense["date"],
-        created_at=expense["created_at"]
+        created_at=expense["created_at"],
+        version=expense.get("version", 0)
     )
 
 @api_router.put("/expenses/{expense_id}", response_model=ExpenseResponse)
-async def update_expense(expense_id: str, expense_data: ExpenseUpdate, current_user: dict = Depends(get_current_user)):
+async def update_expense(
+    expense_id: str,
+    expense_data: ExpenseUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Update an expense; with If-Match (or a version in the body) only from that version"""
     expense = await db.expenses.find_one({"id": expense_id})
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
@@ -1391,6 +2737,8 @@ async def update_expense(expense_id: str, expense_data: ExpenseUpdate, current_u
     if not group:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    check_version(expense, expected_version(if_match, expense_data.version), "Expense")
+    
     update_data = {}
     if expense_data.amount is not None:
         update_data["amount"] = expense_data.amount
@@ -1405,13 +2753,38 @@ async def update_expense(expense_id: str, expense_data: ExpenseUpdate, current_u
     if expense_data.date is not None:
         update_data["date"] = expense_data.date
     
-    if update_data:
-        await db.expenses.update_one({"id": expense_id}, {"$set": update_data})
+    merged = {**expense, **update_data}
+    category = await get_category_info(merged["category_id"], merged["group_id"])
+    user_info = await get_user_info(merged["paid_by"])
     
-    updated_expense = await db.expenses.find_one({"id": expense_id})
-    category = await get_category_info(updated_expense["category_id"], updated_expense["group_id"])
-    user_info = await get_user_info(updated_expense["paid_by"])
+    if update_data:
+        update_data["content_hash"] = expense_content_hash(merged)
+        update_data["search_terms"] = build_search_terms(merged.get("description", ""), category.get("name", ""), user_info["name"])
+        
+        async def write_update(session):
+            update_data["seq"] = await next_change_seq(expense["group_id"], session=session)
+            # The derived fields above were computed from this read, so only
+            # apply them if the version is unchanged. The pre-image comes back
+            # from the same operation for the ledger delta.
+            before = await db.expenses.find_one_and_update(
+                {"id": expense_id, **version_query(expense.get("version", 0))},
+                {"$set": update_data, "$inc": {"version": 1}},
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+            if not before:
+                raise HTTPException(status_code=409, detail="Expense was changed by someone else; reload and retry")
+            after = {**before, **update_data, "version": before.get("version", 0) + 1}
+            await update_group_ledgers(expense_changes=[(before, after)], session=session)
+            await update_spending_rollups([(before, after)], session=session)
+            await update_budget_usage([(before, after)], session=session)
+            return after
+        
+        updated_expense = await run_in_transaction(write_update)
+    else:
+        updated_expense = expense
     
+    response.headers["ETag"] = version_etag(updated_expense)
     return ExpenseResponse(
         id=updated_expense["id"],
         amount=updated_expense["amount"],
@@ -1427,11 +2800,16 @@ async def update_expense(expense_id: str, expense_data: ExpenseUpdate, current_u
         group_id=updated_expense["group_id"],
         group_name=group["name"],
         date=updated_expense["date"],
-        created_at=updated_expense["created_at"]
+        created_at=updated_expense["created_at"],
+        version=updated_expense.get("version", 0)
     )
 
 @api_router.delete("/expenses/{expense_id}")
-async def delete_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_expense(
+    expense_id: str,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     expense = await db.expenses.find_one({"id": expense_id})
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
@@ -1441,324 +2819,1538 @@ async def delete_expense(expense_id: str, current_user: dict = Depends(get_curre
     if not group:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.expenses.delete_one({"id": expense_id})
+    check_version(expense, parse_if_match(if_match), "Expense")
+    
+    async def write_delete(session):
+        seq = await next_change_seq(expense["group_id"], session=session)
+        deleted = await db.expenses.find_one_and_delete({"id": expense_id, **version_query(expense.get("version", 0))}, session=session)
+        if deleted is None:
+            raise HTTPException(status_code=409, detail="Expense was changed by someone else; reload and retry")
+        await db.tombstones.insert_one(tombstone("expense", expense, seq), session=session)
+        await update_group_ledgers(expense_changes=[(expense, None)], session=session)
+        await update_spending_rollups([(expense, None)], session=session)
+        await update_budget_usage([(expense, None)], session=session)
+    
+    await run_in_transaction(write_delete)
     return {"message": "Expense deleted"}
 
-# ==================== ANALYTICS ROUTES ====================
+# ==================== RECEIPT ROUTES ====================
 
-@api_router.get("/analytics/summary")
-async def get_analytics_summary(group_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    # Get group IDs
-    if group_id:
-        group = await db.groups.find_one({"id": group_id, "members": current_user["id"]})
-        if not group:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        group_ids = [group_id]
-    else:
-        groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
-        group_ids = [g["id"] for g in groups]
-    
-    now = datetime.utcnow()
-    today_start = datetime(now.year, now.month, now.day)
-    month_start = datetime(now.year, now.month, 1)
-    
-    if now.month == 1:
-        last_month_start = datetime(now.year - 1, 12, 1)
-        last_month_end = datetime(now.year, 1, 1)
-    else:
-        last_month_start = datetime(now.year, now.month - 1, 1)
-        last_month_end = datetime(now.year, now.month, 1)
-    
-    projection = {"currency": 1, "amount": 1, "_id": 0}
-    base_query = {"group_id": {"$in": group_ids}}
-    
-    today_expenses = {}
-    async for exp in db.expenses.find({**base_query, "date": {"$gte": today_start}}, projection):
-        currency = exp["currency"]
-        today_expenses[currency] = today_expenses.get(currency, 0) + exp["amount"]
+def get_s3_client():
+    """Shared S3 client for the receipt bucket; boto3 clients are thread-safe"""
+    global s3_client
+    if not RECEIPTS_BUCKET:
+        raise HTTPException(status_code=503, detail="Receipt storage is not configured")
+    if s3_client is None:
+        s3_client = boto3.client("s3", **S3_CLIENT_OPTIONS)
+    return s3_client
+
+def make_receipt_thumbnail(bucket: str, key: str, thumbnail_key: str, client_options: dict):
+    """Render a JPEG thumbnail of a stored receipt image; runs in the thumbnail process pool.
+
+    The worker fetches and stores the image itself, so image bytes never pass
+    through the API process.
+    """
+    s3 = boto3.client("s3", **client_options)
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    with Image.open(io.BytesIO(body.read())) as image:
+        image.thumbnail((RECEIPT_THUMBNAIL_SIZE, RECEIPT_THUMBNAIL_SIZE))
+        output = io.BytesIO()
+        image.convert("RGB").save(output, "JPEG", quality=80)
+    output.seek(0)
+    s3.put_object(Bucket=bucket, Key=thumbnail_key, Body=output, ContentType="image/jpeg")
+
+async def generate_receipt_thumbnail(receipt_hash: str, key: str):
+    thumbnail_key = f"{RECEIPTS_THUMBNAIL_PREFIX}{receipt_hash}.jpg"
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(thumbnail_executor, make_receipt_thumbnail, RECEIPTS_BUCKET, key, thumbnail_key, S3_CLIENT_OPTIONS)
+    except Exception as e:
+        logger.warning(f"Could not generate thumbnail for receipt {receipt_hash}: {e}")
+        return
+    await db.receipt_objects.update_one({"hash": receipt_hash}, {"$set": {"thumbnail_key": thumbnail_key}})
+
+def hash_upload(file: UploadFile) -> tuple:
+    """SHA-256 and size of an upload, read in chunks from Starlette's spooled temp file"""
+    digest = hashlib.sha256()
+    size = 0
+    file.file.seek(0)
+    for chunk in iter(lambda: file.file.read(RECEIPT_CHUNK_SIZE), b""):
+        size += len(chunk)
+        if size > RECEIPT_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Receipts are limited to {RECEIPT_MAX_BYTES // (1024 * 1024)} MB")
+        digest.update(chunk)
+    file.file.seek(0)
+    return digest.hexdigest(), size
+
+def receipt_object_key(receipt_hash: str) -> str:
+    return f"{RECEIPTS_PREFIX}{receipt_hash[:2]}/{receipt_hash}"
+
+def presigned_receipt_url(key: str) -> str:
+    return get_s3_client().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": RECEIPTS_BUCKET, "Key": key},
+        ExpiresIn=RECEIPT_URL_TTL_SECONDS
+    )
+
+async def build_receipt_responses(receipts: List[dict]) -> List[ReceiptResponse]:
+    """Receipt entries with presigned download (and, once rendered, thumbnail) URLs"""
+    objects = {}
+    async for obj in db.receipt_objects.find({"hash": {"$in": [r["hash"] for r in receipts]}}, {"_id": 0}):
+        objects[obj["hash"]] = obj
+    
+    responses = []
+    for receipt in receipts:
+        obj = objects.get(receipt["hash"], {})
+        thumbnail_key = obj.get("thumbnail_key")
+        responses.append(ReceiptResponse(
+            id=receipt["id"],
+            filename=receipt["filename"],
+            content_type=receipt["content_type"],
+            size=receipt["size"],
+            uploaded_by=receipt["uploaded_by"],
+            uploaded_at=receipt["uploaded_at"],
+            url=presigned_receipt_url(obj.get("key", receipt_object_key(receipt["hash"]))),
+            thumbnail_url=presigned_receipt_url(thumbnail_key) if thumbnail_key else None
+        ))
+    return responses
+
+async def get_member_expense(expense_id: str, current_user: dict) -> dict:
+    expense = await db.expenses.find_one({"id": expense_id})
+    if not expense:
+        raise HTTPException(status_code=404, detail="Expense not found")
     
-    month_expenses = {}
-    async for exp in db.expenses.find({**base_query, "date": {"$gte": month_start}}, projection):
-        currency = exp["currency"]
-        month_expenses[currency] = month_expenses.get(currency, 0) + exp["amount"]
+    group = await db.groups.find_one({"id": expense["group_id"], "members": current_user["id"]}, {"id": 1})
+    if not group:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return expense
+
+@api_router.post("/expenses/{expense_id}/receipts", response_model=ReceiptResponse)
+async def upload_receipt(
+    expense_id: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """Attach a receipt image or PDF to an expense.
+
+    The upload is hashed and streamed to the receipt bucket in chunks; content
+    already stored (by anyone) is not uploaded again. Image thumbnails are
+    rendered in the background.
+    """
+    s3 = get_s3_client()
+    expense = await get_member_expense(expense_id, current_user)
+    
+    content_type = (file.content_type or "").split(";")[0].strip().lower()
+    if content_type not in RECEIPT_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported receipt type. Allowed: {sorted(RECEIPT_CONTENT_TYPES)}")
+    
+    receipt_hash, size = await run_in_threadpool(hash_upload, file)
+    key = receipt_object_key(receipt_hash)
+    
+    if not await db.receipt_objects.find_one({"hash": receipt_hash}, {"hash": 1}):
+        # upload_fileobj sends the spooled file in multipart chunks
+        await run_in_threadpool(s3.upload_fileobj, file.file, RECEIPTS_BUCKET, key, ExtraArgs={"ContentType": content_type})
+        try:
+            await db.receipt_objects.insert_one({
+                "hash": receipt_hash,
+                "key": key,
+                "content_type": content_type,
+                "size": size,
+                "created_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            pass  # A concurrent upload of the same bytes stored it first
+        else:
+            if thumbnail_executor is not None and content_type.startswith("image/"):
+                background_tasks.add_task(generate_receipt_thumbnail, receipt_hash, key)
+    
+    receipt = {
+        "id": str(uuid.uuid4()),
+        "hash": receipt_hash,
+        "filename": file.filename or "receipt",
+        "content_type": content_type,
+        "size": size,
+        "uploaded_by": current_user["id"],
+        "uploaded_at": datetime.utcnow()
+    }
+    async def write_receipt(session):
+        seq = await next_change_seq(expense["group_id"], session=session)
+        await db.expenses.update_one(
+            {"id": expense_id},
+            {"$push": {"receipts": receipt}, "$set": {"seq": seq}, "$inc": {"version": 1}},
+            session=session
+        )
     
-    last_month_expenses = {}
-    async for exp in db.expenses.find({**base_query, "date": {"$gte": last_month_start, "$lt": last_month_end}}, projection):
-        currency = exp["currency"]
-        last_month_expenses[currency] = last_month_expenses.get(currency, 0) + exp["amount"]
+    await run_in_transaction(write_receipt)
     
-    total_expenses = {}
-    async for exp in db.expenses.find(base_query, projection):
-        currency = exp["currency"]
-        total_expenses[currency] = total_expenses.get(currency, 0) + exp["amount"]
+    return (await build_receipt_responses([receipt]))[0]
+
+@api_router.get("/expenses/{expense_id}/receipts", response_model=List[ReceiptResponse])
+async def get_receipts(expense_id: str, current_user: dict = Depends(get_current_user)):
+    """List an expense's receipts with short-lived presigned download URLs"""
+    expense = await get_member_expense(expense_id, current_user)
+    return await build_receipt_responses(expense.get("receipts", []))
+
+@api_router.delete("/expenses/{expense_id}/receipts/{receipt_id}")
+async def delete_receipt(expense_id: str, receipt_id: str, current_user: dict = Depends(get_current_user)):
+    """Detach a receipt; the stored object may still be shared with other expenses"""
+    expense = await get_member_expense(expense_id, current_user)
+    if not any(r["id"] == receipt_id for r in expense.get("receipts", [])):
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    
+    async def write_detach(session):
+        seq = await next_change_seq(expense["group_id"], session=session)
+        await db.expenses.update_one(
+            {"id": expense_id},
+            {"$pull": {"receipts": {"id": receipt_id}}, "$set": {"seq": seq}, "$inc": {"version": 1}},
+            session=session
+        )
     
-    total_count = await db.expenses.count_documents(base_query)
+    await run_in_transaction(write_detach)
+    return {"message": "Receipt removed"}
+
+# ==================== ANALYTICS ROUTES ====================
+
+def estimate_size(value) -> int:
+    """Rough deep size in bytes of a cached analytics result"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+class AnalyticsCache:
+    """LRU cache of analytics results, bounded by their estimated size.
+
+    Keys include the change_seq and analytics_seq of every group a result
+    covers. Any write to a group advances one of them, so stale entries are
+    never hit again and simply age out; nothing expires by time.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    
+    def put(self, key, value):
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+analytics_cache = AnalyticsCache(ANALYTICS_CACHE_MAX_BYTES)
+
+async def cached_analytics(name: str, group_ids: List[str], tz: str, params: tuple, compute):
+    """Return await compute(), reusing a result computed at the groups' current sequences.
+
+    change_seq is raised before a write's documents are stored, so it alone
+    could key a result computed from half-written data. analytics_seq is
+    raised once expenses and rollups are written (see mark_analytics_changed),
+    and the sequences are read before computing, so a write that races with
+    the computation only makes the stored entry unreachable. tz rollups are
+    built first, as building them raises analytics_seq too. Results are
+    shared between requests and must not be modified.
+    """
+    await ensure_spending_rollups(group_ids, tz)
+    seqs = sorted([
+        (group["id"], group.get("change_seq", 0), group.get("analytics_seq", 0))
+        async for group in db.groups.find({"id": {"$in": group_ids}}, {"id": 1, "change_seq": 1, "analytics_seq": 1})
+    ])
+    key = (name, tuple(seqs), tz, params)
+    result = analytics_cache.get(key)
+    if result is None:
+        result = await compute()
+        analytics_cache.put(key, result)
+    return result
+
+ROLLUP_DIMENSIONS = ("group_id", "category_id", "paid_by", "currency")
+# The fields that identify a spending_rollups row, as rollup_key builds them
+ROLLUP_KEY_FIELDS = ROLLUP_DIMENSIONS + ("timezone", "day")
+
+def resolve_timezone(tz: Optional[str], user: dict) -> str:
+    """The IANA time zone analytics are bucketed in: the tz parameter, else the user's profile setting"""
+    name = tz or user.get("timezone") or "UTC"
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown time zone: {name}")
+    return name
+
+def to_local(date: datetime, tz: str) -> datetime:
+    """Wall-clock time in tz of a stored (naive UTC) or aware datetime"""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(ZoneInfo(tz)).replace(tzinfo=None)
+
+def to_utc(local: datetime, tz: str) -> datetime:
+    """Stored (naive UTC) form of a wall-clock time in tz"""
+    return local.replace(tzinfo=ZoneInfo(tz)).astimezone(timezone.utc).replace(tzinfo=None)
+
+def parse_local_datetime(value: Optional[str], tz: str) -> Optional[datetime]:
+    """Parse an ISO date filter; values without an offset are wall-clock times in tz"""
+    if not value:
+        return None
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is not None:
+        return date.astimezone(timezone.utc).replace(tzinfo=None)
+    return to_utc(date, tz)
+
+def day_start(date: datetime, tz: str = "UTC") -> datetime:
+    """Start of the day in tz containing date, as stored (naive UTC)"""
+    local = to_local(date, tz)
+    return to_utc(datetime(local.year, local.month, local.day), tz)
+
+def next_day_start(day: datetime, tz: str) -> datetime:
+    return to_utc(to_local(day, tz) + timedelta(days=1), tz)
+
+def month_start(date: datetime, tz: str = "UTC") -> datetime:
+    """Start of the month in tz containing date, as stored (naive UTC)"""
+    local = to_local(date, tz)
+    return to_utc(datetime(local.year, local.month, 1), tz)
+
+def rollup_key(expense: dict, tz: str = "UTC") -> dict:
+    """The spending_rollups row an expense is counted in for time zone tz"""
+    key = {field: expense[field] for field in ROLLUP_DIMENSIONS}
+    key["timezone"] = tz
+    key["day"] = day_start(expense["date"], tz)
+    return key
+
+# The app_state document whose version manage.py load-rates raises after loading rates
+RATES_STATE_ID = "exchange_rates"
+
+# Loaded from exchange_rates on first use, and again once the rates version moves
+exchange_rates = None
+exchange_rates_version = None
+
+async def mark_rates_changed():
+    """Advance the rates version so every API process reloads exchange_rates on its next use"""
+    await db.app_state.update_one({"_id": RATES_STATE_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+async def get_exchange_rates() -> dict:
+    """Per currency, the sorted dates of its rates and the units per USD on each"""
+    global exchange_rates, exchange_rates_version
+    # Read before the rates, so rates loaded during a change are reloaded on the next call
+    state = await db.app_state.find_one({"_id": RATES_STATE_ID}, {"version": 1})
+    version = (state or {}).get("version", 0)
+    if exchange_rates is None or version != exchange_rates_version:
+        rates = {}
+        projection = {"currency": 1, "date": 1, "per_usd": 1, "_id": 0}
+        async for row in db.exchange_rates.find({}, projection).sort([("currency", 1), ("date", 1)]):
+            dates, values = rates.setdefault(row["currency"], ([], []))
+            dates.append(row["date"])
+            values.append(row["per_usd"])
+        exchange_rates, exchange_rates_version = rates, version
+    return exchange_rates
+
+def rate_on(rates: dict, currency: str, date: datetime) -> Optional[float]:
+    """Units of currency per USD on date: the latest rate on or before it, else the earliest"""
+    if currency not in rates:
+        return None
+    dates, values = rates[currency]
+    return values[max(bisect.bisect_right(dates, date) - 1, 0)]
+
+def conversion_factors(rates: dict, currency: str, day: datetime, tz: str) -> dict:
+    """What one unit of currency is worth in each convertible currency, at the rates of day in tz.
+
+    A currency is always worth exactly one of itself, with or without rates.
+    """
+    factors = {currency: 1.0}
+    date = to_local(day, tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    source = rate_on(rates, currency, date)
+    if source is not None:
+        for target in CURRENCIES:
+            if target in rates and target != currency:
+                factors[target] = rate_on(rates, target, date) / source
+    return factors
+
+def converted_amount_expression(rates: dict, target: str, day: datetime, tz: str) -> dict:
+    """Aggregation expression for an expense's amount in target, for expenses dated within day"""
+    branches = []
+    for currency in CURRENCIES:
+        factor = conversion_factors(rates, currency, day, tz).get(target)
+        if factor is not None:
+            branches.append({"case": {"$eq": ["$currency", currency]}, "then": factor})
+    if not branches:
+        return 0
+    return {"$multiply": ["$amount", {"$switch": {"branches": branches, "default": 0}}]}
+
+def unconverted_currencies(rates: dict, target: str, currencies) -> List[str]:
+    """Those of currencies that cannot be converted to target, so converted totals leave them out"""
+    return sorted(
+        currency for currency in currencies
+        if currency != target and (target not in rates or currency not in rates)
+    )
+
+async def mark_analytics_changed(group_ids: List[str], session=None):
+    """Advance the groups' analytics_seq, after the expenses and rollups analytics read were written"""
+    await db.groups.update_many({"id": {"$in": list(group_ids)}}, {"$inc": {"analytics_seq": 1}}, session=session)
+
+async def update_spending_rollups(expense_changes, session=None):
+    """Apply expense changes to spending_rollups as $inc upserts.
+
+    Each change is a (before, after) pair like in update_group_ledgers and is
+    counted once per time zone the group keeps rollups for. Rows whose count
+    drops to zero are removed. converted holds the row's amount in each
+    currency of the exchange rate table, at the rates of the row's day.
+    """
+    group_ids = list({doc["group_id"] for change in expense_changes for doc in change if doc})
+    group_timezones = {}
+    async for group in db.groups.find({"id": {"$in": group_ids}}, {"id": 1, "rollup_timezones": 1}, session=session):
+        group_timezones[group["id"]] = group.get("rollup_timezones", [])
+    
+    rates = await get_exchange_rates()
+    deltas = {}
+    for before, after in expense_changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            if not doc:
+                continue
+            for tz in group_timezones.get(doc["group_id"], []):
+                key = rollup_key(doc, tz)
+                delta = deltas.setdefault(tuple(key.items()), {"amount": 0, "count": 0})
+                delta["amount"] += sign * doc["amount"]
+                delta["count"] += sign
+                for target, factor in conversion_factors(rates, doc["currency"], key["day"], tz).items():
+                    field = f"converted.{target}"
+                    delta[field] = delta.get(field, 0) + sign * doc["amount"] * factor
+    
+    writes = [
+        UpdateOne(dict(key), {"$inc": delta}, upsert=True)
+        for key, delta in deltas.items() if delta["amount"] or delta["count"]
+    ]
+    if writes:
+        await db.spending_rollups.bulk_write(writes, ordered=False, session=session)
+    
+    emptied = [dict(key) for key, delta in deltas.items() if delta["count"] < 0]
+    if emptied:
+        await db.spending_rollups.delete_many({"$or": emptied, "count": {"$lte": 0}}, session=session)
+    # Expenses are always written before their rollups
+    if group_ids:
+        await mark_analytics_changed(group_ids, session=session)
+
+def rollup_pipeline(match: dict, tz: str) -> List[dict]:
+    """Aggregation of the expenses matching match into rollup rows for time zone tz"""
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "group_id": "$group_id",
+                "day": {"$dateTrunc": {"date": "$date", "unit": "day", "timezone": tz}},
+                "category_id": "$category_id",
+                "paid_by": "$paid_by",
+                "currency": "$currency"
+            },
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }}
+    ]
+
+def rollup_row(row: dict, tz: str, rates: dict) -> dict:
+    """A spending_rollups document from a rollup_pipeline row"""
+    factors = conversion_factors(rates, row["_id"]["currency"], row["_id"]["day"], tz)
+    return {
+        "timezone": tz, **row["_id"], "amount": row["amount"], "count": row["count"],
+        "converted": {target: row["amount"] * factor for target, factor in factors.items()}
+    }
+
+async def wanted_rollup_zones(group: dict, session=None) -> set:
+    """Time zones a group keeps rollups for: its members' profile zones and its budgets' zones"""
+    zones = set()
+    async for user in db.users.find({"id": {"$in": group.get("members", [])}}, {"timezone": 1}, session=session):
+        zones.add(user.get("timezone") or "UTC")
+    async for budget in db.budgets.find({"group_id": group["id"]}, {"timezone": 1}, session=session):
+        zones.add(budget["timezone"])
+    return zones
+
+async def rebuild_spending_rollups(group_id: str, tz: str = "UTC") -> int:
+    """Recompute a group's rollups for time zone tz from its expenses and return the number of rows.
+
+    Rollups of zones the group no longer wants (see wanted_rollup_zones)
+    are dropped at the same time. Rows are written as $set upserts, so an
+    expense write's $inc upsert landing on a row first cannot fail the
+    rebuild on a duplicate key. Without transactions the rows are recomputed
+    if an expense write advanced the group's analytics_seq meanwhile.
+    """
+    rates = await get_exchange_rates()
+    
+    async def write_rollups(session):
+        # Writing the group first makes concurrent expense writes, which
+        # advance its change_seq, conflict with this rebuild instead of
+        # missing the new time zone
+        group = await db.groups.find_one({"id": group_id}, {"id": 1, "members": 1, "rollup_timezones": 1}, session=session)
+        if group is None:
+            return 0
+        wanted = await wanted_rollup_zones(group, session=session)
+        others = [name for name in group.get("rollup_timezones", []) if name != tz]
+        kept = [name for name in others if name in wanted]
+        await db.groups.update_one({"id": group_id}, {"$set": {"rollup_timezones": kept + [tz]}}, session=session)
+        
+        dropped = [name for name in others if name not in kept]
+        for _ in range(ROLLUP_REBUILD_ATTEMPTS):
+            # Expense writes advance analytics_seq after their rollup $inc
+            marks = await db.groups.find_one({"id": group_id}, {"analytics_seq": 1}, session=session)
+            # Rows from before rollups were kept per time zone have no timezone field
+            await db.spending_rollups.delete_many(
+                {"group_id": group_id, "timezone": {"$in": [tz, None, *dropped]}}, session=session
+            )
+            rows = [
+                rollup_row(row, tz, rates)
+                async for row in db.expenses.aggregate(rollup_pipeline({"group_id": group_id}, tz), session=session)
+            ]
+            if rows:
+                writes = [
+                    UpdateOne({field: row[field] for field in ROLLUP_KEY_FIELDS}, {"$set": row}, upsert=True)
+                    for row in rows
+                ]
+                await db.spending_rollups.bulk_write(writes, ordered=False, session=session)
+            if transactions_supported:
+                break
+            current = await db.groups.find_one({"id": group_id}, {"analytics_seq": 1})
+            if (current or {}).get("analytics_seq", 0) == (marks or {}).get("analytics_seq", 0):
+                break
+        await mark_analytics_changed([group_id], session=session)
+        return len(rows)
+    
+    return await run_in_transaction(write_rollups)
+
+async def drop_unwanted_rollup_zones(group_ids: List[str]):
+    """Stop keeping rollups for zones the groups no longer want, e.g. after a profile's time zone changed"""
+    async def drop(group_id: str, session):
+        group = await db.groups.find_one({"id": group_id}, {"id": 1, "members": 1, "rollup_timezones": 1}, session=session)
+        wanted = await wanted_rollup_zones(group, session=session)
+        kept = group.get("rollup_timezones", [])
+        dropped = [name for name in kept if name not in wanted]
+        if dropped:
+            await db.groups.update_one(
+                {"id": group_id}, {"$set": {"rollup_timezones": [name for name in kept if name in wanted]}}, session=session
+            )
+            await db.spending_rollups.delete_many({"group_id": group_id, "timezone": {"$in": dropped}}, session=session)
+    
+    async for group in db.groups.find({"id": {"$in": group_ids}, "rollup_timezones.0": {"$exists": True}}, {"id": 1}):
+        await run_in_transaction(lambda session, group_id=group["id"]: drop(group_id, session))
+
+async def ensure_spending_rollups(group_ids: List[str], tz: str = "UTC") -> bool:
+    """Build tz rollups for groups that want them but do not keep them yet.
+
+    Returns whether every group keeps tz rollups; when not, analytics come
+    from zone_rollup_rows instead.
+    """
+    stored = True
+    async for group in db.groups.find({"id": {"$in": group_ids}, "rollup_timezones": {"$ne": tz}}, {"id": 1, "members": 1}):
+        if tz in await wanted_rollup_zones(group):
+            await rebuild_spending_rollups(group["id"], tz)
+        else:
+            stored = False
+    return stored
+
+async def zone_rollup_rows(group_ids: List[str], tz: str, day_range: Optional[dict] = None) -> List[dict]:
+    """The groups' rollup rows for a zone they do not keep, aggregated from the expenses and not stored.
+
+    day_range bounds the rows' day like in a rollup query; its bounds are
+    day boundaries in tz, so it applies to the expense dates as well.
+    """
+    match = {"group_id": {"$in": group_ids}}
+    if day_range:
+        match["date"] = day_range
+    rates = await get_exchange_rates()
+    return [rollup_row(row, tz, rates) async for row in db.expenses.aggregate(rollup_pipeline(match, tz))]
+
+def rollup_match(group_ids: List[str], tz: str, day_range: Optional[dict] = None) -> dict:
+    """Filter for the groups' stored tz rollup rows, optionally within a range of days"""
+    match = {"group_id": {"$in": group_ids}, "timezone": tz}
+    if day_range:
+        match["day"] = day_range
+    return match
+
+def rollup_dimension_rows(rows: List[dict], dimension: str, target: Optional[str] = None) -> list:
+    """The rows dimension_group_stage would return, per rollup row rather than grouped"""
+    dimension_rows = []
+    for row in rows:
+        dimension_row = {"_id": {"key": row[dimension], "currency": row["currency"]}, "amount": row["amount"], "count": row["count"]}
+        if target:
+            dimension_row["converted"] = row["converted"].get(target, 0)
+        dimension_rows.append(dimension_row)
+    return dimension_rows
+
+def rollup_bucket_rows(rows: List[dict], unit: str, tz: str, target: str) -> list:
+    """The rows bucket_group_stage would return, per rollup row rather than grouped"""
+    bucket_rows = []
+    for row in rows:
+        local = to_local(row["day"], tz)
+        bucket = datetime(local.year, local.month, 1 if unit == "month" else local.day)
+        bucket_rows.append({
+            "_id": {"bucket": to_utc(bucket, tz), "currency": row["currency"]},
+            "amount": row["amount"],
+            "converted": row["converted"].get(target, 0)
+        })
+    return bucket_rows
+
+def rollup_summary_rows(rows: List[dict], periods: dict, target: Optional[str] = None) -> list:
+    """The rows summary_group_stage would return, per rollup row rather than grouped"""
+    summary_rows = []
+    for row in rows:
+        converted = row["converted"].get(target, 0) if target else 0
+        summary_row = {"_id": row["currency"], "total": row["amount"], "count": row["count"], "converted_total": converted}
+        for period, (start, end) in periods.items():
+            within = row["day"] >= start and (end is None or row["day"] < end)
+            summary_row[period] = row["amount"] if within else 0
+            summary_row[f"{period}_count"] = row["count"] if within else 0
+            summary_row[f"converted_{period}"] = converted if within else 0
+        summary_rows.append(summary_row)
+    return summary_rows
+
+async def sum_by_dimension(
+    group_ids: List[str],
+    dimension: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    tz: str = "UTC",
+    target: Optional[str] = None
+) -> dict:
+    """Amounts per currency and expense count per value of dimension, for start <= date <= end.
+
+    Whole days in tz come from spending_rollups. Where a bound falls inside
+    a day, that part of the day is aggregated from the expenses themselves,
+    one day per query so a single day's exchange rates convert it. With a
+    target currency each total also has converted_amount.
+    """
+    stored = await ensure_spending_rollups(group_ids, tz)
+    
+    day_range, date_ranges = {}, []
+    if start is not None:
+        first_day = day_start(start, tz)
+        if first_day < start:
+            first_day = next_day_start(first_day, tz)
+        day_range["$gte"] = first_day
+    if end is not None:
+        last_day = day_start(end, tz)
+        day_range["$lt"] = last_day
+    
+    if start is not None and end is not None and first_day >= last_day:
+        day_range = None
+        if start < last_day:
+            date_ranges.append(({"$gte": start, "$lt": last_day}, day_start(start, tz)))
+            date_ranges.append(({"$gte": last_day, "$lte": end}, last_day))
+        else:
+            date_ranges.append(({"$gte": start, "$lte": end}, last_day))
+    else:
+        if start is not None and start < first_day:
+            date_ranges.append(({"$gte": start, "$lt": first_day}, day_start(start, tz)))
+        if end is not None:
+            date_ranges.append(({"$gte": last_day, "$lte": end}, last_day))
+    
+    rates = await get_exchange_rates() if target else {}
+    totals = {}
+    queries = []
+    if day_range is not None and not stored:
+        add_dimension_rows(totals, rollup_dimension_rows(await zone_rollup_rows(group_ids, tz, day_range), dimension, target))
+    elif day_range is not None:
+        match = rollup_match(group_ids, tz, day_range)
+        converted = f"converted.{target}" if target else None
+        if await use_pandas_engine(match):
+            fields = [dimension, "currency", "amount", "count"] + ([converted] if converted else [])
+            frame = await load_rollup_frame(match, fields)
+            add_dimension_rows(totals, frame_dimension_rows(frame, dimension, converted))
+        else:
+            queries.append((db.spending_rollups, match, "$count", converted and f"${converted}"))
+    for date_range, day in date_ranges:
+        converted = converted_amount_expression(rates, target, day, tz) if target else None
+        queries.append((db.expenses, {"group_id": {"$in": group_ids}, "date": date_range}, 1, converted))
+    
+    for collection, match, count, converted in queries:
+        pipeline = [{"$match": match}, dimension_group_stage(dimension, count, converted)]
+        add_dimension_rows(totals, [row async for row in collection.aggregate(pipeline)])
+    return totals
+
+async def use_pandas_engine(match: dict) -> bool:
+    """Whether the rollup rows matching match are numerous enough to group with pandas"""
+    if pd is None or ANALYTICS_PANDAS_MIN_ROWS <= 0:
+        return False
+    return await db.spending_rollups.count_documents(match, limit=ANALYTICS_PANDAS_MIN_ROWS) >= ANALYTICS_PANDAS_MIN_ROWS
+
+async def load_rollup_frame(match: dict, fields: List[str]):
+    """Load the given fields of the rollup rows matching match into a DataFrame.
+
+    Rows arrive as raw BSON batches that bson.decode_all turns into one dict
+    per row; only the projected fields are copied into the column lists the
+    frame is built from.
+    """
+    columns = {field: [] for field in fields}
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    async for batch in db.spending_rollups.find_raw_batches(match, projection, batch_size=ANALYTICS_BATCH_SIZE):
+        for doc in bson.decode_all(batch):
+            for field in fields:
+                value = doc
+                for part in field.split("."):
+                    value = value.get(part) if isinstance(value, dict) else None
+                columns[field].append(value)
+    return pd.DataFrame(columns)
+
+def frame_dimension_rows(frame, dimension: str, converted: Optional[str] = None) -> list:
+    """The rows dimension_group_stage would return, from one vectorized groupby"""
+    if frame.empty:
+        return []
+    sums = ["amount", "count"] + ([converted] if converted else [])
+    grouped = frame.groupby([dimension, "currency"], sort=False, dropna=False)[sums].sum()
+    rows = [
+        {"_id": {"key": key, "currency": currency}, "amount": amount, "count": count}
+        for (key, currency), amount, count in zip(grouped.index, grouped["amount"].tolist(), grouped["count"].tolist())
+    ]
+    if converted:
+        for row, value in zip(rows, grouped[converted].tolist()):
+            row["converted"] = value
+    return rows
+
+def dimension_group_stage(dimension: str, count, converted=None) -> dict:
+    """$group summing amount per (dimension, currency); count is "$count" over rollups or 1 over expenses.
+
+    converted, if given, is the expression for an amount in the target currency.
+    """
+    stage = {"$group": {
+        "_id": {"key": f"${dimension}", "currency": "$currency"},
+        "amount": {"$sum": "$amount"},
+        "count": {"$sum": count}
+    }}
+    if converted is not None:
+        stage["$group"]["converted"] = {"$sum": converted}
+    return stage
+
+def add_dimension_rows(totals: dict, rows) -> dict:
+    for row in rows:
+        total = totals.setdefault(row["_id"]["key"], {"amounts": {}, "count": 0})
+        currency = row["_id"]["currency"]
+        total["amounts"][currency] = total["amounts"].get(currency, 0) + row["amount"]
+        total["count"] += row["count"]
+        if "converted" in row:
+            total["converted_amount"] = total.get("converted_amount", 0) + row["converted"]
+    return totals
+
+def summary_periods(now: datetime, tz: str) -> dict:
+    """(start, end) bounds on a rollup's day for each period reported by the summary, with days and months in tz"""
+    local = to_local(now, tz)
+    today_start = to_utc(datetime(local.year, local.month, local.day), tz)
+    month_start = to_utc(datetime(local.year, local.month, 1), tz)
+    
+    if local.month == 1:
+        last_month_start = to_utc(datetime(local.year - 1, 12, 1), tz)
+    else:
+        last_month_start = to_utc(datetime(local.year, local.month - 1, 1), tz)
+    last_month_end = month_start
     
     return {
-        "today": today_expenses,
-        "this_month": month_expenses,
-        "last_month": last_month_expenses,
-        "total": total_expenses,
-        "total_count": total_count,
-        "currency_symbols": CURRENCY_SYMBOLS
+        "today": (today_start, None),
+        "this_month": (month_start, None),
+        "last_month": (last_month_start, last_month_end)
     }
 
-@api_router.get("/analytics/by-category")
-async def get_analytics_by_category(
+def period_condition(bounds: tuple) -> dict:
+    start, end = bounds
+    if end is None:
+        return {"$gte": ["$day", start]}
+    return {"$and": [{"$gte": ["$day", start]}, {"$lt": ["$day", end]}]}
+
+def summary_group_stage(periods: dict, target: Optional[str] = None) -> dict:
+    # One pass over the groups' daily rollups, summed per currency in the database;
+    # the per-period counts tell which currencies actually occur in a period
+    accumulators = {"total": {"$sum": "$amount"}, "count": {"$sum": "$count"}}
+    conditions = {period: period_condition(bounds) for period, bounds in periods.items()}
+    for period, condition in conditions.items():
+        accumulators[period] = {"$sum": {"$cond": [condition, "$amount", 0]}}
+        accumulators[f"{period}_count"] = {"$sum": {"$cond": [condition, "$count", 0]}}
+    if target:
+        # Rows without a rate for target have no converted value, which $sum skips
+        converted = f"$converted.{target}"
+        accumulators["converted_total"] = {"$sum": converted}
+        for period, condition in conditions.items():
+            accumulators[f"converted_{period}"] = {"$sum": {"$cond": [condition, converted, 0]}}
+    return {"$group": {"_id": "$currency", **accumulators}}
+
+def summary_from_rows(rows, periods: dict, target: Optional[str] = None, rates: Optional[dict] = None) -> dict:
+    summary = {period: {} for period in periods}
+    summary["total"] = {}
+    summary["total_count"] = 0
+    if target:
+        converted = {"currency": target, "total": 0, **{period: 0 for period in periods}}
+    for row in rows:
+        currency = row["_id"]
+        summary["total"][currency] = summary["total"].get(currency, 0) + row["total"]
+        summary["total_count"] += row["count"]
+        for period in periods:
+            if row[f"{period}_count"]:
+                summary[period][currency] = summary[period].get(currency, 0) + row[period]
+        if target:
+            converted["total"] += row["converted_total"]
+            for period in periods:
+                converted[period] += row[f"converted_{period}"]
+    if target:
+        converted["unconverted_currencies"] = unconverted_currencies(rates, target, summary["total"])
+        summary["converted"] = converted
+    return summary
+
+@api_router.get("/analytics/summary")
+async def get_analytics_summary(
     group_id: Optional[str] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
+    include_archived: bool = False,
+    tz: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    if group_id:
-        group = await db.groups.find_one({"id": group_id, "members": current_user["id"]})
-        if not group:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        group_ids = [group_id]
-    else:
-        groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
-        group_ids = [g["id"] for g in groups]
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    tz = resolve_timezone(tz, current_user)
     
-    query = {"group_id": {"$in": group_ids}}
-    if start_date:
-        query["date"] = {"$gte": datetime.fromisoformat(start_date)}
-    if end_date:
-        if "date" in query:
-            query["date"]["$lte"] = datetime.fromisoformat(end_date)
-        else:
-            query["date"] = {"$lte": datetime.fromisoformat(end_date)}
+    target = current_user.get("default_currency", "INR")
+    rates = await get_exchange_rates()
     
-    projection = {"category_id": 1, "currency": 1, "amount": 1, "_id": 0}
-    expenses_list = await db.expenses.find(query, projection).to_list(length=10000)
+    now = datetime.utcnow()
+    periods = summary_periods(now, tz)
+    pipeline = [{"$match": rollup_match(group_ids, tz)}, summary_group_stage(periods, target)]
     
-    if not expenses_list:
-        return []
+    async def compute():
+        if await ensure_spending_rollups(group_ids, tz):
+            rows = [row async for row in db.spending_rollups.aggregate(pipeline)]
+        else:
+            rows = rollup_summary_rows(await zone_rollup_rows(group_ids, tz), periods, target)
+        return summary_from_rows(rows, periods, target, rates)
     
-    category_ids = list(set(exp["category_id"] for exp in expenses_list))
+    summary = await cached_analytics("summary", group_ids, tz, (day_start(now, tz), target), compute)
+    return {
+        **summary,
+        "currency_symbols": CURRENCY_SYMBOLS
+    }
+
+async def category_breakdown(totals: dict) -> list:
+    """Per-category totals from sum_by_dimension, with each category's name, icon and color"""
     categories_dict = {}
-    async for cat in db.categories.find({"id": {"$in": category_ids}}, {"id": 1, "name": 1, "icon": 1, "color": 1}):
+    async for cat in db.categories.find({"id": {"$in": list(totals)}}, {"id": 1, "name": 1, "icon": 1, "color": 1}):
         categories_dict[cat["id"]] = cat
     
-    category_expenses = {}
-    for exp in expenses_list:
-        cat_id = exp["category_id"]
-        currency = exp["currency"]
-        
-        if cat_id not in category_expenses:
-            category = categories_dict.get(cat_id, {"name": "Unknown", "icon": "help-circle", "color": "#999999"})
-            category_expenses[cat_id] = {
-                "category_id": cat_id,
-                "category_name": category.get("name", "Unknown"),
-                "category_icon": category.get("icon", "help-circle"),
-                "category_color": category.get("color", "#999999"),
-                "amounts": {},
-                "count": 0
-            }
-        
-        category_expenses[cat_id]["amounts"][currency] = category_expenses[cat_id]["amounts"].get(currency, 0) + exp["amount"]
-        category_expenses[cat_id]["count"] += 1
+    category_expenses = []
+    for cat_id, total in totals.items():
+        category = categories_dict.get(cat_id, {"name": "Unknown", "icon": "help-circle", "color": "#999999"})
+        category_expenses.append({
+            "category_id": cat_id,
+            "category_name": category.get("name", "Unknown"),
+            "category_icon": category.get("icon", "help-circle"),
+            "category_color": category.get("color", "#999999"),
+            **total
+        })
+    return category_expenses
+
+async def member_breakdown(totals: dict) -> list:
+    """Per-payer totals from sum_by_dimension, with each payer's name and color"""
+    users_dict = {}
+    async for user in db.users.find({"id": {"$in": list(totals)}}, {"id": 1, "name": 1, "avatar_color": 1}):
+        users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
+    
+    member_expenses = []
+    for user_id, total in totals.items():
+        user_info = users_dict.get(user_id, {"name": "Unknown", "color": "#999999"})
+        member_expenses.append({
+            "user_id": user_id,
+            "user_name": user_info["name"],
+            "user_color": user_info["color"],
+            **total
+        })
+    return member_expenses
+
+@api_router.get("/analytics/by-category")
+async def get_analytics_by_category(
+    group_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    include_archived: bool = False,
+    tz: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    tz = resolve_timezone(tz, current_user)
+    
+    start = parse_local_datetime(start_date, tz)
+    end = parse_local_datetime(end_date, tz)
+    target = current_user.get("default_currency", "INR")
+    totals = await cached_analytics(
+        "by-category_id", group_ids, tz, (start, end, target),
+        lambda: sum_by_dimension(group_ids, "category_id", start, end, tz, target)
+    )
     
-    return list(category_expenses.values())
+    return await category_breakdown(totals)
 
 @api_router.get("/analytics/by-member")
 async def get_analytics_by_member(
     group_id: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    include_archived: bool = False,
+    tz: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    if group_id:
-        group = await db.groups.find_one({"id": group_id, "members": current_user["id"]})
-        if not group:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        group_ids = [group_id]
-    else:
-        groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
-        group_ids = [g["id"] for g in groups]
-    
-    query = {"group_id": {"$in": group_ids}}
-    if start_date:
-        query["date"] = {"$gte": datetime.fromisoformat(start_date)}
-    if end_date:
-        if "date" in query:
-            query["date"]["$lte"] = datetime.fromisoformat(end_date)
-        else:
-            query["date"] = {"$lte": datetime.fromisoformat(end_date)}
-    
-    projection = {"paid_by": 1, "currency": 1, "amount": 1, "_id": 0}
-    expenses_list = await db.expenses.find(query, projection).to_list(length=10000)
-    
-    if not expenses_list:
-        return []
-    
-    user_ids = list(set(exp["paid_by"] for exp in expenses_list))
-    users_dict = {}
-    async for user in db.users.find({"id": {"$in": user_ids}}, {"id": 1, "name": 1, "avatar_color": 1}):
-        users_dict[user["id"]] = {"name": user.get("name", "Unknown"), "color": user.get("avatar_color", "#999999")}
-    
-    member_expenses = {}
-    for exp in expenses_list:
-        user_id = exp["paid_by"]
-        currency = exp["currency"]
-        
-        if user_id not in member_expenses:
-            user_info = users_dict.get(user_id, {"name": "Unknown", "color": "#999999"})
-            member_expenses[user_id] = {
-                "user_id": user_id,
-                "user_name": user_info["name"],
-                "user_color": user_info["color"],
-                "amounts": {},
-                "count": 0
-            }
-        
-        member_expenses[user_id]["amounts"][currency] = member_expenses[user_id]["amounts"].get(currency, 0) + exp["amount"]
-        member_expenses[user_id]["count"] += 1
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    tz = resolve_timezone(tz, current_user)
+    
+    start = parse_local_datetime(start_date, tz)
+    end = parse_local_datetime(end_date, tz)
+    target = current_user.get("default_currency", "INR")
+    totals = await cached_analytics(
+        "by-paid_by", group_ids, tz, (start, end, target),
+        lambda: sum_by_dimension(group_ids, "paid_by", start, end, tz, target)
+    )
     
-    return list(member_expenses.values())
+    return await member_breakdown(totals)
 
 @api_router.get("/analytics/by-group")
 async def get_analytics_by_group(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    include_archived: bool = False,
+    tz: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """Get expense breakdown by group"""
-    groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
+    groups = await db.groups.find(member_groups_query(current_user["id"], include_archived)).to_list(length=100)
     group_ids = [g["id"] for g in groups]
     groups_dict = {g["id"]: g for g in groups}
+    tz = resolve_timezone(tz, current_user)
+    
+    start = parse_local_datetime(start_date, tz)
+    end = parse_local_datetime(end_date, tz)
+    target = current_user.get("default_currency", "INR")
+    totals = await cached_analytics(
+        "by-group_id", group_ids, tz, (start, end, target),
+        lambda: sum_by_dimension(group_ids, "group_id", start, end, tz, target)
+    )
     
-    query = {"group_id": {"$in": group_ids}}
-    if start_date:
-        query["date"] = {"$gte": datetime.fromisoformat(start_date)}
-    if end_date:
-        if "date" in query:
-            query["date"]["$lte"] = datetime.fromisoformat(end_date)
-        else:
-            query["date"] = {"$lte": datetime.fromisoformat(end_date)}
-    
-    projection = {"group_id": 1, "currency": 1, "amount": 1, "_id": 0}
-    expenses_list = await db.expenses.find(query, projection).to_list(length=10000)
-    
-    group_expenses = {}
-    for exp in expenses_list:
-        grp_id = exp["group_id"]
-        currency = exp["currency"]
-        
-        if grp_id not in group_expenses:
-            grp = groups_dict.get(grp_id, {"name": "Unknown", "color": "#999999", "type": "shared"})
-            group_expenses[grp_id] = {
-                "group_id": grp_id,
-                "group_name": grp.get("name", "Unknown"),
-                "group_color": grp.get("color", "#999999"),
-                "group_type": grp.get("type", "shared"),
-                "amounts": {},
-                "count": 0
-            }
-        
-        group_expenses[grp_id]["amounts"][currency] = group_expenses[grp_id]["amounts"].get(currency, 0) + exp["amount"]
-        group_expenses[grp_id]["count"] += 1
+    group_expenses = []
+    for grp_id, total in totals.items():
+        grp = groups_dict.get(grp_id, {"name": "Unknown", "color": "#999999", "type": "shared"})
+        group_expenses.append({
+            "group_id": grp_id,
+            "group_name": grp.get("name", "Unknown"),
+            "group_color": grp.get("color", "#999999"),
+            "group_type": grp.get("type", "shared"),
+            **total
+        })
     
-    return list(group_expenses.values())
+    return group_expenses
+
+async def sum_by_bucket(
+    group_ids: List[str], unit: str, start: datetime, end: datetime, tz: str = "UTC", target: str = "INR"
+) -> dict:
+    """Expense totals per bucket start, per currency and converted to target, for start <= date < end.
+
+    start and end are day boundaries in tz. One $group of the daily rollups
+    on $dateTrunc buckets in tz (MongoDB 5.0+), so the cost grows with days
+    in range rather than expenses. Empty buckets are absent.
+    """
+    if not await ensure_spending_rollups(group_ids, tz):
+        rows = await zone_rollup_rows(group_ids, tz, {"$gte": start, "$lt": end})
+        return buckets_from_rows(rollup_bucket_rows(rows, unit, tz, target))
+    pipeline = [{"$match": rollup_match(group_ids, tz, {"$gte": start, "$lt": end})}, bucket_group_stage(unit, tz, target)]
+    return buckets_from_rows([row async for row in db.spending_rollups.aggregate(pipeline)])
+
+def bucket_group_stage(unit: str, tz: str, target: str) -> dict:
+    return {"$group": {
+        "_id": {"bucket": {"$dateTrunc": {"date": "$day", "unit": unit, "timezone": tz}}, "currency": "$currency"},
+        "amount": {"$sum": "$amount"},
+        "converted": {"$sum": f"$converted.{target}"}
+    }}
+
+EMPTY_BUCKET = {"amounts": {}, "converted_amount": 0}
+
+def buckets_from_rows(rows) -> dict:
+    buckets = {}
+    for row in rows:
+        bucket = buckets.setdefault(row["_id"]["bucket"], {"amounts": {}, "converted_amount": 0})
+        currency = row["_id"]["currency"]
+        bucket["amounts"][currency] = bucket["amounts"].get(currency, 0) + row["amount"]
+        bucket["converted_amount"] += row["converted"]
+    return buckets
+
+def trend_month_starts(local_now: datetime, months: int) -> List[datetime]:
+    """First day of each of the last `months` months (wall-clock), oldest first"""
+    month_starts = []
+    for i in range(months - 1, -1, -1):
+        year = local_now.year
+        month = local_now.month - i
+        while month <= 0:
+            month += 12
+            year -= 1
+        month_starts.append(datetime(year, month, 1))
+    return month_starts
+
+def next_month_start(month_start: datetime) -> datetime:
+    if month_start.month == 12:
+        return datetime(month_start.year + 1, 1, 1)
+    return datetime(month_start.year, month_start.month + 1, 1)
+
+def trends_from_buckets(month_starts: List[datetime], buckets: dict, tz: str) -> list:
+    return [{
+        "month": month_start.strftime("%b %Y"),
+        "year": month_start.year,
+        "month_num": month_start.month,
+        **buckets.get(to_utc(month_start, tz), EMPTY_BUCKET)
+    } for month_start in month_starts]
 
 @api_router.get("/analytics/trends")
 async def get_analytics_trends(
     group_id: Optional[str] = None,
     months: int = 6,
+    include_archived: bool = False,
+    tz: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    if group_id:
-        group = await db.groups.find_one({"id": group_id, "members": current_user["id"]})
-        if not group:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        group_ids = [group_id]
-    else:
-        groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
-        group_ids = [g["id"] for g in groups]
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    tz = resolve_timezone(tz, current_user)
     
-    now = datetime.utcnow()
-    projection = {"currency": 1, "amount": 1, "date": 1, "_id": 0}
+    month_starts = trend_month_starts(to_local(datetime.utcnow(), tz), months)
     
-    trends = []
-    for i in range(months - 1, -1, -1):
-        year = now.year
-        month = now.month - i
-        while month <= 0:
-            month += 12
-            year -= 1
-        
-        month_start = datetime(year, month, 1)
-        if month == 12:
-            month_end = datetime(year + 1, 1, 1)
-        else:
-            month_end = datetime(year, month + 1, 1)
-        
-        month_name = month_start.strftime("%b %Y")
-        
-        month_expenses = {}
-        async for exp in db.expenses.find({"group_id": {"$in": group_ids}, "date": {"$gte": month_start, "$lt": month_end}}, projection):
-            currency = exp["currency"]
-            month_expenses[currency] = month_expenses.get(currency, 0) + exp["amount"]
-        
-        trends.append({
-            "month": month_name,
-            "year": year,
-            "month_num": month,
-            "amounts": month_expenses
-        })
+    if not month_starts:
+        return []
+    
+    start = to_utc(month_starts[0], tz)
+    end = to_utc(next_month_start(month_starts[-1]), tz)
+    target = current_user.get("default_currency", "INR")
+    buckets = await cached_analytics(
+        "trends", group_ids, tz, (start, end, target),
+        lambda: sum_by_bucket(group_ids, "month", start, end, tz, target)
+    )
     
-    return trends
+    return trends_from_buckets(month_starts, buckets, tz)
 
 @api_router.get("/analytics/daily")
 async def get_analytics_daily(
     group_id: Optional[str] = None,
     days: int = 30,
+    include_archived: bool = False,
+    tz: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    if group_id:
-        group = await db.groups.find_one({"id": group_id, "members": current_user["id"]})
-        if not group:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        group_ids = [group_id]
-    else:
-        groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
-        group_ids = [g["id"] for g in groups]
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    tz = resolve_timezone(tz, current_user)
+    
+    local_now = to_local(datetime.utcnow(), tz)
+    today = datetime(local_now.year, local_now.month, local_now.day)
+    day_starts = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    
+    if not day_starts:
+        return []
+    
+    start = to_utc(day_starts[0], tz)
+    end = to_utc(today + timedelta(days=1), tz)
+    target = current_user.get("default_currency", "INR")
+    buckets = await cached_analytics(
+        "daily", group_ids, tz, (start, end, target),
+        lambda: sum_by_bucket(group_ids, "day", start, end, tz, target)
+    )
+    
+    return [{
+        "date": day_start.strftime("%Y-%m-%d"),
+        "day": day_start.strftime("%d"),
+        "month": day_start.strftime("%b"),
+        **buckets.get(to_utc(day_start, tz), EMPTY_BUCKET)
+    } for day_start in day_starts]
+
+@api_router.get("/analytics/cache-stats")
+async def get_analytics_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Size and hit rate of this process's analytics result cache"""
+    return analytics_cache.stats()
+
+# ==================== DASHBOARD ROUTES ====================
+
+DASHBOARD_SECTIONS = ("summary", "by-category", "by-member", "trends", "recent")
+DASHBOARD_RECENT_EXPENSES = 5
+
+def dashboard_facets(requested: List[str], periods: dict, trends_range: dict, tz: str, target: str) -> dict:
+    """$facet branches computing the requested rollup-based dashboard sections in one pass"""
+    converted = f"$converted.{target}"
+    facets = {}
+    if "summary" in requested:
+        facets["summary"] = [summary_group_stage(periods, target)]
+    if "by-category" in requested:
+        facets["by-category"] = [dimension_group_stage("category_id", "$count", converted)]
+    if "by-member" in requested:
+        facets["by-member"] = [dimension_group_stage("paid_by", "$count", converted)]
+    if "trends" in requested:
+        facets["trends"] = [{"$match": {"day": trends_range}}, bucket_group_stage("month", tz, target)]
+    return facets
+
+@api_router.get("/dashboard")
+async def get_dashboard(
+    group_id: Optional[str] = None,
+    sections: Optional[str] = None,
+    months: int = Query(6, ge=1, le=60),
+    include_archived: bool = False,
+    tz: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """The home and analytics screens' data in one request.
+
+    sections is a comma-separated subset of DASHBOARD_SECTIONS (default all).
+    Groups are resolved once and summary, by-category, by-member and trends
+    come from a single $facet aggregation over the rollups, cached like the
+    individual /analytics endpoints.
+    """
+    requested = [name.strip() for name in sections.split(",") if name.strip()] if sections else list(DASHBOARD_SECTIONS)
+    unknown = [name for name in requested if name not in DASHBOARD_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {unknown}. Allowed: {list(DASHBOARD_SECTIONS)}")
+    
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    tz = resolve_timezone(tz, current_user)
+    target = current_user.get("default_currency", "INR")
+    rates = await get_exchange_rates()
     
     now = datetime.utcnow()
-    projection = {"currency": 1, "amount": 1, "date": 1, "_id": 0}
+    periods = summary_periods(now, tz)
+    month_starts = trend_month_starts(to_local(now, tz), months)
+    trends_range = {"$gte": to_utc(month_starts[0], tz), "$lt": to_utc(next_month_start(month_starts[-1]), tz)}
+    facets = dashboard_facets(requested, periods, trends_range, tz, target)
+    
+    async def compute():
+        if not await ensure_spending_rollups(group_ids, tz):
+            # The same facets, reduced here from rows aggregated for this zone
+            rows = await zone_rollup_rows(group_ids, tz)
+            results = {}
+            if "summary" in facets:
+                results["summary"] = rollup_summary_rows(rows, periods, target)
+            if "by-category" in facets:
+                results["by-category"] = rollup_dimension_rows(rows, "category_id", target)
+            if "by-member" in facets:
+                results["by-member"] = rollup_dimension_rows(rows, "paid_by", target)
+            if "trends" in facets:
+                in_range = [row for row in rows if trends_range["$gte"] <= row["day"] < trends_range["$lt"]]
+                results["trends"] = rollup_bucket_rows(in_range, "month", tz, target)
+            return results
+        pipeline = [{"$match": rollup_match(group_ids, tz)}, {"$facet": facets}]
+        results = {}
+        async for doc in db.spending_rollups.aggregate(pipeline):
+            results = doc
+        return results
+    
+    results = {}
+    if facets:
+        params = (tuple(facets), day_start(now, tz), months, target)
+        results = await cached_analytics("dashboard", group_ids, tz, params, compute)
+    
+    dashboard = {}
+    if "summary" in requested:
+        summary = summary_from_rows(results["summary"], periods, target, rates)
+        dashboard["summary"] = {**summary, "currency_symbols": CURRENCY_SYMBOLS}
+    if "by-category" in requested:
+        dashboard["by_category"] = await category_breakdown(add_dimension_rows({}, results["by-category"]))
+    if "by-member" in requested:
+        dashboard["by_member"] = await member_breakdown(add_dimension_rows({}, results["by-member"]))
+    if "trends" in requested:
+        dashboard["trends"] = trends_from_buckets(month_starts, buckets_from_rows(results["trends"]), tz)
+    if "recent" in requested:
+        expenses_list, categories_dict, users_dict, groups_dict = await fetch_enriched_expenses(
+            "expenses", {"group_id": {"$in": group_ids}}, [("date", -1), ("id", -1)], DASHBOARD_RECENT_EXPENSES
+        )
+        dashboard["recent_expenses"] = [
+            build_expense_response(exp, categories_dict, users_dict, groups_dict) for exp in expenses_list
+        ]
+    return dashboard
+
+# ==================== BUDGET ROUTES ====================
+
+def crossed_thresholds(budget: dict, spent: float) -> List[int]:
+    return [threshold for threshold in budget["thresholds"] if spent >= budget["amount"] * threshold / 100]
+
+def new_crossings(old_budget: dict, old_spent: float, budget: dict, spent: float) -> List[int]:
+    """Thresholds crossed now that were not crossed before a change to spending or to the budget"""
+    already = set(crossed_thresholds(old_budget, old_spent))
+    return [threshold for threshold in crossed_thresholds(budget, spent) if threshold not in already]
+
+def budget_spend(expense: dict, budget: dict, rates: dict) -> Optional[float]:
+    """An expense's amount in the budget's currency, or None if its currency cannot be converted"""
+    tz = budget["timezone"]
+    factor = conversion_factors(rates, expense["currency"], day_start(expense["date"], tz), tz).get(budget["currency"])
+    return None if factor is None else expense["amount"] * factor
+
+async def record_budget_alerts(budget: dict, month: datetime, thresholds: List[int], spent: float, session=None, **details):
+    """Store an alert on the month's counter for each newly crossed threshold"""
+    alerts = [{"threshold": threshold, "spent": spent, "at": datetime.utcnow(), **details} for threshold in thresholds]
+    if alerts:
+        await db.budget_usage.update_one(
+            {"budget_id": budget["id"], "month": month}, {"$push": {"alerts": {"$each": alerts}}}, session=session
+        )
+        logger.info(f"Budget {budget['id']} crossed {[a['threshold'] for a in alerts]}% in {month:%Y-%m}")
+    return alerts
+
+async def update_budget_usage(expense_changes, session=None):
+    """Apply expense changes to the monthly consumption counters of the budgets they fall under.
+
+    Each change is a (before, after) pair like in update_group_ledgers. A
+    counter is moved with one $inc that returns its new value, so exactly
+    one write sees each threshold being crossed and records the alert.
+    Expenses in other currencies count at the rates of their day; those
+    without rates are not counted.
+    """
+    group_ids = list({doc["group_id"] for change in expense_changes for doc in change if doc})
+    budgets = {}
+    async for budget in db.budgets.find({"group_id": {"$in": group_ids}}, session=session):
+        budgets.setdefault((budget["group_id"], budget["category_id"]), []).append(budget)
+    if not budgets:
+        return
+    
+    rates = await get_exchange_rates()
+    deltas = {}
+    for before, after in expense_changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            if not doc:
+                continue
+            for budget in budgets.get((doc["group_id"], doc["category_id"]), []):
+                month = month_start(doc["date"], budget["timezone"])
+                spend = budget_spend(doc, budget, rates)
+                # Months before the budget existed have no counter to adjust
+                if month < budget["start_month"] or spend is None:
+                    continue
+                delta = deltas.setdefault((budget["id"], month), {"budget": budget, "spent": 0, "count": 0})
+                delta["spent"] += sign * spend
+                delta["count"] += sign
+                if sign > 0:
+                    delta["expense_id"] = doc["id"]
+    
+    for (budget_id, month), delta in deltas.items():
+        if not delta["spent"] and not delta["count"]:
+            continue
+        usage = await db.budget_usage.find_one_and_update(
+            {"budget_id": budget_id, "month": month},
+            {"$inc": {"spent": delta["spent"], "count": delta["count"]}, "$setOnInsert": {"alerts": []}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        budget = delta["budget"]
+        crossed = new_crossings(budget, usage["spent"] - delta["spent"], budget, usage["spent"])
+        await record_budget_alerts(budget, month, crossed, usage["spent"], session=session, expense_id=delta.get("expense_id"))
+
+def budget_month_pipeline(budget: dict, month: datetime) -> List[dict]:
+    """Aggregation of the daily rollups into a budget's spending and expense count in a month"""
+    tz = budget["timezone"]
+    currency = budget["currency"]
+    return [
+        {"$match": {
+            "group_id": budget["group_id"],
+            "timezone": tz,
+            "category_id": budget["category_id"],
+            "day": {"$gte": month, "$lt": to_utc(next_month_start(to_local(month, tz)), tz)}
+        }},
+        {"$group": {
+            "_id": None,
+            "spent": {"$sum": {"$cond": [{"$eq": ["$currency", currency]}, "$amount", f"$converted.{currency}"]}},
+            "count": {"$sum": "$count"}
+        }}
+    ]
+
+async def count_budget_month(budget: dict, month: datetime, session=None) -> dict:
+    """Spending and expense count under budget in a month, summed from the daily rollups"""
+    async for row in db.spending_rollups.aggregate(budget_month_pipeline(budget, month), session=session):
+        return {"spent": row["spent"], "count": row["count"]}
+    return {"spent": 0, "count": 0}
+
+async def recount_budget_usage(budget: dict, month: datetime) -> dict:
+    """Reset a budget's counter for month from the rollups, keeping its alerts"""
+    await ensure_spending_rollups([budget["group_id"]], budget["timezone"])
+    
+    async def write_usage(session):
+        previous = await db.budget_usage.find_one({"budget_id": budget["id"], "month": month}, {"spent": 1}, session=session)
+        usage = await count_budget_month(budget, month, session=session)
+        await db.budget_usage.update_one(
+            {"budget_id": budget["id"], "month": month},
+            {"$set": usage, "$setOnInsert": {"alerts": []}},
+            upsert=True,
+            session=session
+        )
+        crossed = new_crossings(budget, previous["spent"] if previous else 0, budget, usage["spent"])
+        await record_budget_alerts(budget, month, crossed, usage["spent"], session=session)
+        return usage
     
-    daily_data = []
-    for i in range(days - 1, -1, -1):
-        day_start = datetime(now.year, now.month, now.day) - timedelta(days=i)
-        day_end = day_start + timedelta(days=1)
-        
-        day_expenses = {}
-        async for exp in db.expenses.find({"group_id": {"$in": group_ids}, "date": {"$gte": day_start, "$lt": day_end}}, projection):
-            currency = exp["currency"]
-            day_expenses[currency] = day_expenses.get(currency, 0) + exp["amount"]
-        
-        daily_data.append({
-            "date": day_start.strftime("%Y-%m-%d"),
-            "day": day_start.strftime("%d"),
-            "month": day_start.strftime("%b"),
-            "amounts": day_expenses
-        })
+    return await run_in_transaction(write_usage)
+
+def validate_thresholds(thresholds: List[int]) -> List[int]:
+    if any(threshold <= 0 for threshold in thresholds):
+        raise HTTPException(status_code=400, detail="Thresholds must be positive percentages")
+    return sorted(set(thresholds))
+
+def build_budget_response(budget: dict, usage: Optional[dict], category: dict) -> dict:
+    usage = usage or {"spent": 0, "count": 0, "alerts": []}
+    spent = round(usage["spent"], 2)
+    return {
+        "id": budget["id"],
+        "group_id": budget["group_id"],
+        "category_id": budget["category_id"],
+        "category_name": category.get("name", "Unknown"),
+        "category_icon": category.get("icon", "help-circle"),
+        "category_color": category.get("color", "#999999"),
+        "amount": budget["amount"],
+        "currency": budget["currency"],
+        "thresholds": budget["thresholds"],
+        "timezone": budget["timezone"],
+        "month": to_local(datetime.utcnow(), budget["timezone"]).strftime("%Y-%m"),
+        "spent": spent,
+        "remaining": round(budget["amount"] - spent, 2),
+        "percent": round(spent * 100 / budget["amount"], 1),
+        "count": usage["count"],
+        "crossed_thresholds": crossed_thresholds(budget, usage["spent"]),
+        "alerts": usage.get("alerts", [])
+    }
+
+@api_router.post("/budgets")
+async def create_budget(budget_data: BudgetCreate, current_user: dict = Depends(get_current_user)):
+    """Create a monthly budget for a category in a group.
+
+    Months follow the creator's profile time zone. Spending so far this
+    month is counted once here; from then on expense writes keep it current.
+    """
+    group = await db.groups.find_one({"id": budget_data.group_id, "members": current_user["id"]}, {"id": 1})
+    if not group:
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    
+    if budget_data.currency not in CURRENCIES:
+        raise HTTPException(status_code=400, detail=f"Invalid currency. Allowed: {CURRENCIES}")
+    
+    category = await db.categories.find_one({"id": budget_data.category_id, "group_id": {"$in": [None, budget_data.group_id]}})
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    if await db.budgets.find_one({"group_id": budget_data.group_id, "category_id": budget_data.category_id}, {"id": 1}):
+        raise HTTPException(status_code=409, detail="This category already has a budget in this group")
+    
+    tz = resolve_timezone(None, current_user)
+    month = month_start(datetime.utcnow(), tz)
+    budget = {
+        "id": str(uuid.uuid4()),
+        "group_id": budget_data.group_id,
+        "category_id": budget_data.category_id,
+        "amount": budget_data.amount,
+        "currency": budget_data.currency,
+        "thresholds": validate_thresholds(budget_data.thresholds),
+        "timezone": tz,
+        "start_month": month,
+        "created_by": current_user["id"],
+        "created_at": datetime.utcnow()
+    }
+    try:
+        await db.budgets.insert_one(dict(budget))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="This category already has a budget in this group")
+    
+    await recount_budget_usage(budget, month)
+    usage = await db.budget_usage.find_one({"budget_id": budget["id"], "month": month})
+    return build_budget_response(budget, usage, category)
+
+@api_router.get("/budgets")
+async def get_budgets(
+    group_id: Optional[str] = None,
+    include_archived: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Budgets with this month's spending, read from their counters"""
+    group_ids = await resolve_group_ids(current_user, group_id, include_archived)
+    budgets = await db.budgets.find({"group_id": {"$in": group_ids}}).to_list(length=None)
+    if not budgets:
+        return []
+    
+    now = datetime.utcnow()
+    usage_keys = [{"budget_id": b["id"], "month": month_start(now, b["timezone"])} for b in budgets]
+    usages = {}
+    async for usage in db.budget_usage.find({"$or": usage_keys}):
+        usages[(usage["budget_id"], usage["month"])] = usage
+    
+    categories_dict = {}
+    async for cat in db.categories.find({"id": {"$in": list({b["category_id"] for b in budgets})}}):
+        categories_dict[cat["id"]] = cat
+    
+    return [
+        build_budget_response(budget, usages.get((key["budget_id"], key["month"])), categories_dict.get(budget["category_id"], {}))
+        for budget, key in zip(budgets, usage_keys)
+    ]
+
+@api_router.put("/budgets/{budget_id}")
+async def update_budget(budget_id: str, budget_data: BudgetUpdate, current_user: dict = Depends(get_current_user)):
+    """Change a budget's amount or thresholds; thresholds this month's spending now crosses raise alerts"""
+    budget = await db.budgets.find_one({"id": budget_id})
+    if not budget:
+        raise HTTPException(status_code=404, detail="Budget not found")
+    
+    group = await db.groups.find_one({"id": budget["group_id"], "members": current_user["id"]}, {"id": 1})
+    if not group:
+        raise HTTPException(status_code=403, detail="Not authorized")
     
-    return daily_data
+    update_data = {}
+    if budget_data.amount is not None:
+        update_data["amount"] = budget_data.amount
+    if budget_data.thresholds is not None:
+        update_data["thresholds"] = validate_thresholds(budget_data.thresholds)
+    
+    month = month_start(datetime.utcnow(), budget["timezone"])
+    usage = await db.budget_usage.find_one({"budget_id": budget_id, "month": month})
+    if update_data:
+        updated = {**budget, **update_data}
+        crossed = new_crossings(budget, usage["spent"], updated, usage["spent"]) if usage else []
+        await db.budgets.update_one({"id": budget_id}, {"$set": update_data})
+        if crossed:
+            await record_budget_alerts(updated, month, crossed, usage["spent"])
+            usage = await db.budget_usage.find_one({"budget_id": budget_id, "month": month})
+        budget = updated
+    
+    category = await get_category_info(budget["category_id"], budget["group_id"])
+    return build_budget_response(budget, usage, category)
+
+@api_router.delete("/budgets/{budget_id}")
+async def delete_budget(budget_id: str, current_user: dict = Depends(get_current_user)):
+    budget = await db.budgets.find_one({"id": budget_id})
+    if not budget:
+        raise HTTPException(status_code=404, detail="Budget not found")
+    
+    group = await db.groups.find_one({"id": budget["group_id"], "members": current_user["id"]}, {"id": 1})
+    if not group:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    await db.budgets.delete_one({"id": budget_id})
+    await db.budget_usage.delete_many({"budget_id": budget_id})
+    await drop_unwanted_rollup_zones([budget["group_id"]])
+    return {"message": "Budget deleted"}
+
+# ==================== SYNC ROUTES ====================
+
+SYNC_EXPENSE_FIELDS = {"_id": 0, "content_hash": 0, "search_terms": 0}
+
+def changed_since_query(group_ids: List[str], known: dict):
+    """Filter for documents changed after the client's per-group sequence.
+
+    Groups the client has never synced are returned in full.
+    """
+    clauses = []
+    for group_id in group_ids:
+        if group_id in known:
+            clauses.append({"group_id": group_id, "seq": {"$gt": known[group_id]}})
+        else:
+            clauses.append({"group_id": group_id})
+    return {"$or": clauses} if clauses else None
+
+@api_router.get("/sync")
+async def sync_changes(since: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Return what changed in the user's groups since a previous sync token.
+
+    Without a token, or with one older than the tombstone retention window,
+    everything is returned and reset is true. Otherwise only expenses,
+    settlements and categories with a newer change sequence are returned,
+    together with tombstones for deletions. Groups whose sequence has not
+    moved are skipped without touching their data. Pass the returned token
+    on the next call.
+    
+    Needs a replica set: without transactions a group's sequence moves
+    before the documents stamped with it are written, so a token could
+    skip changes that are still in flight.
+    """
+    if not transactions_supported:
+        raise HTTPException(status_code=503, detail="Sync requires MongoDB to run as a replica set")
+    
+    known = {}
+    reset = True
+    if since:
+        try:
+            payload = decode_token(since)
+            issued_at = float(payload["t"])
+            known = {str(gid): int(seq) for gid, seq in payload["g"].items()}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+        reset = issued_at < time.time() - TOMBSTONE_RETENTION_DAYS * 24 * 60 * 60
+        if reset:
+            known = {}
+    
+    groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
+    group_seqs = {g["id"]: g.get("change_seq", 0) for g in groups}
+    changed_groups = [g for g in groups if g["id"] not in known or group_seqs[g["id"]] > known[g["id"]]]
+    changed_ids = [g["id"] for g in changed_groups]
+    
+    expenses, settlements, categories = [], [], []
+    deleted = {"expense": [], "settlement": [], "category": []}
+    
+    query = changed_since_query(changed_ids, known)
+    if query:
+        expenses = await db.expenses.find(query, SYNC_EXPENSE_FIELDS).to_list(length=None)
+        settlements = await db.settlements.find(query, {"_id": 0}).to_list(length=None)
+        categories = await db.categories.find(query, {"_id": 0}).to_list(length=None)
+    
+    # Tombstones only matter for groups the client already holds
+    synced_ids = [gid for gid in changed_ids if gid in known]
+    if synced_ids:
+        tombstone_query = changed_since_query(synced_ids, known)
+        async for marker in db.tombstones.find(tombstone_query, {"entity": 1, "entity_id": 1, "_id": 0}):
+            deleted[marker["entity"]].append(marker["entity_id"])
+    
+    if reset:
+        categories = await db.categories.find({"group_id": None}, {"_id": 0}).to_list(length=None) + categories
+    
+    member_ids = list(set(mid for g in changed_groups for mid in g.get("members", [])))
+    members = await get_member_details(member_ids)
+    
+    group_records = [{
+        "id": g["id"],
+        "name": g["name"],
+        "type": g.get("type", "shared"),
+        "mode": g.get("mode", "split"),
+        "invite_code": g.get("invite_code"),
+        "color": g.get("color", "#22D3EE"),
+        "members": [members[mid] for mid in g.get("members", []) if mid in members],
+        "created_by": g["created_by"],
+        "created_at": g["created_at"],
+        "archived": g.get("archived", False)
+    } for g in changed_groups]
+    
+    return {
+        "token": encode_token({"g": group_seqs, "t": int(time.time())}),
+        "reset": reset,
+        "groups": group_records,
+        "removed_groups": [gid for gid in known if gid not in group_seqs],
+        "expenses": expenses,
+        "settlements": settlements,
+        "categories": categories,
+        "deleted": {
+            "expenses": deleted["expense"],
+            "settlements": deleted["settlement"],
+            "categories": deleted["category"]
+        }
+    }
 
 # ==================== EXPORT ROUTES ====================
 
 @api_router.post("/export/csv")
 async def export_expenses_csv(export_data: ExportRequest, current_user: dict = Depends(get_current_user)):
     """Export expenses to CSV file"""
-    # Get group IDs
-    if export_data.group_id:
-        group = await db.groups.find_one({"id": export_data.group_id, "members": current_user["id"]})
-        if not group:
-            raise HTTPException(status_code=403, detail="Not a member of this group")
-        group_ids = [export_data.group_id]
-    else:
-        groups = await db.groups.find({"members": current_user["id"]}).to_list(length=100)
-        group_ids = [g["id"] for g in groups]
+    group_ids = await resolve_group_ids(current_user, export_data.group_id, export_data.include_archived)
     
     query = {"group_id": {"$in": group_ids}}
     
@@ -1776,53 +4368,41 @@ async def export_expenses_csv(export_data: ExportRequest, current_user: dict = D
             "$lte": datetime.fromisoformat(export_data.end_date)
         }
     
-    # Fetch expenses
-    expenses = await db.expenses.find(query).sort("date", -1).to_list(length=10000)
-    
-    if not expenses:
+    if await db.expenses.find_one(query, {"_id": 1}) is None:
         raise HTTPException(status_code=404, detail="No expenses found for the specified criteria")
     
-    # Batch fetch related data
-    category_ids = list(set(exp["category_id"] for exp in expenses))
-    user_ids = list(set(exp["paid_by"] for exp in expenses))
-    exp_group_ids = list(set(exp["group_id"] for exp in expenses))
-    
-    categories_dict = {}
-    async for cat in db.categories.find({"id": {"$in": category_ids}}):
-        categories_dict[cat["id"]] = cat.get("name", "Unknown")
-    
-    users_dict = {}
-    async for user in db.users.find({"id": {"$in": user_ids}}):
-        users_dict[user["id"]] = user.get("name", "Unknown")
-    
-    groups_dict = {}
-    async for grp in db.groups.find({"id": {"$in": exp_group_ids}}):
-        groups_dict[grp["id"]] = grp.get("name", "Unknown")
-    
-    # Create CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow(["Date", "Group", "Category", "Amount", "Currency", "Description", "Paid By"])
-    
-    # Data rows
-    for exp in expenses:
-        writer.writerow([
-            exp["date"].strftime("%Y-%m-%d"),
-            groups_dict.get(exp["group_id"], "Unknown"),
-            categories_dict.get(exp["category_id"], "Unknown"),
-            exp["amount"],
-            exp["currency"],
-            exp.get("description", ""),
-            users_dict.get(exp["paid_by"], "Unknown")
-        ])
-    
-    output.seek(0)
+    async def csv_chunks():
+        """The CSV, one chunk per batch of expenses with their categories, payers and groups"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        
+        # Header
+        writer.writerow(["Date", "Group", "Category", "Amount", "Currency", "Description", "Paid By"])
+        
+        async for expenses, categories_dict, users_dict, groups_dict in iter_enriched_expenses(
+            "export", query, [("date", -1), ("id", -1)], EXPORT_BATCH_SIZE
+        ):
+            for exp in expenses:
+                writer.writerow([
+                    exp["date"].strftime("%Y-%m-%d"),
+                    groups_dict.get(exp["group_id"], "Unknown"),
+                    categories_dict.get(exp["category_id"], {}).get("name", "Unknown"),
+                    exp["amount"],
+                    exp["currency"],
+                    exp.get("description", ""),
+                    users_dict.get(exp["paid_by"], {}).get("name", "Unknown")
+                ])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+        
+        if output.tell():
+            yield output.getvalue()
     
     # Generate filename
     if export_data.group_id:
-        group_name = groups_dict.get(export_data.group_id, "expenses").replace(" ", "_")
+        group = await db.groups.find_one({"id": export_data.group_id}, {"name": 1})
+        group_name = (group or {}).get("name", "expenses").replace(" ", "_")
     else:
         group_name = "all_groups"
     
@@ -1834,11 +4414,211 @@ async def export_expenses_csv(export_data: ExportRequest, current_user: dict = D
         filename = f"{group_name}_all_expenses.csv"
     
     return StreamingResponse(
-        iter([output.getvalue()]),
+        csv_chunks(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
+# ==================== IMPORT ROUTES ====================
+
+def parse_import_row(row: dict, context: dict) -> dict:
+    """Turn one CSV row into an expense document, raising ValueError with a readable message"""
+    mapping = context["mapping"]
+    
+    def column(field: str) -> str:
+        header = mapping.get(field)
+        return (row.get(header) or "").strip() if header else ""
+    
+    raw_date = column("date")
+    if not raw_date:
+        raise ValueError("Missing date")
+    try:
+        if context["date_format"]:
+            expense_date = datetime.strptime(raw_date, context["date_format"])
+        else:
+            expense_date = datetime.fromisoformat(raw_date)
+    except ValueError:
+        raise ValueError(f"Invalid date '{raw_date}'")
+    
+    raw_amount = column("amount").replace(",", "")
+    try:
+        amount = float(raw_amount)
+    except ValueError:
+        raise ValueError(f"Invalid amount '{raw_amount}'")
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError(f"Invalid amount '{raw_amount}'")
+    
+    currency = column("currency").upper() or context["default_currency"]
+    if currency not in CURRENCIES:
+        raise ValueError(f"Invalid currency '{currency}'")
+    
+    category_name = column("category")
+    category_id = context["categories"].get(category_name.lower()) if category_name else None
+    if category_id is None:
+        category_id = context["default_category_id"]
+    if category_id is None:
+        raise ValueError(f"Unknown category '{category_name}'")
+    
+    payer_name = column("paid_by")
+    paid_by = context["members"].get(payer_name.lower()) if payer_name else context["user_id"]
+    if paid_by is None:
+        raise ValueError(f"Unknown payer '{payer_name}'")
+    
+    expense = {
+        "id": str(uuid.uuid4()),
+        "amount": amount,
+        "currency": currency,
+        "category_id": category_id,
+        "description": column("description"),
+        "paid_by": paid_by,
+        "group_id": context["group_id"],
+        "date": expense_date,
+        "created_at": context["now"],
+        "version": 1
+    }
+    expense["content_hash"] = expense_content_hash(expense)
+    expense["search_terms"] = build_search_terms(
+        expense["description"],
+        context["category_names"].get(category_id, ""),
+        context["member_names"].get(paid_by, "")
+    )
+    return expense
+
+@api_router.post("/import/csv")
+async def import_expenses_csv(
+    file: UploadFile = File(...),
+    group_id: str = Form(...),
+    mapping: Optional[str] = Form(None),
+    date_format: Optional[str] = Form(None),
+    default_category_id: Optional[str] = Form(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Import expenses from a CSV statement into a group.
+
+    The file is read in batches of IMPORT_BATCH_SIZE rows, never all at once.
+    Columns default to those written by the CSV export. Pass mapping as a
+    JSON object (field -> column header) for bank statements, with fields
+    date, amount, currency, category, description and paid_by. Rows that
+    match an existing expense by content hash are skipped as duplicates.
+    """
+    started = time.monotonic()
+    
+    group = await db.groups.find_one({"id": group_id, "members": current_user["id"]})
+    if not group:
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    
+    column_mapping = dict(DEFAULT_IMPORT_MAPPING)
+    if mapping:
+        try:
+            custom_mapping = json.loads(mapping)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="mapping must be a JSON object")
+        if not isinstance(custom_mapping, dict):
+            raise HTTPException(status_code=400, detail="mapping must be a JSON object")
+        column_mapping.update(custom_mapping)
+    
+    # Category names and member names are resolved through lookups built once
+    categories = {}
+    category_names = {}
+    async for cat in db.categories.find({"group_id": {"$in": [None, group_id]}}, {"id": 1, "name": 1}):
+        categories[cat["name"].lower()] = cat["id"]
+        category_names[cat["id"]] = cat["name"]
+    
+    members = {}
+    member_names = {}
+    async for user in db.users.find({"id": {"$in": group.get("members", [])}}, {"id": 1, "name": 1}):
+        members[user["name"].lower()] = user["id"]
+        member_names[user["id"]] = user["name"]
+    
+    if default_category_id is not None and default_category_id not in category_names:
+        raise HTTPException(status_code=400, detail="Invalid default_category_id")
+    
+    context = {
+        "mapping": column_mapping,
+        "date_format": date_format,
+        "default_currency": current_user.get("default_currency", "INR"),
+        "default_category_id": default_category_id,
+        "categories": categories,
+        "category_names": category_names,
+        "members": members,
+        "member_names": member_names,
+        "user_id": current_user["id"],
+        "group_id": group_id,
+        "now": datetime.utcnow()
+    }
+    
+    reader = csv.DictReader(io.TextIOWrapper(file.file, encoding="utf-8-sig", newline=""))
+    
+    def read_batch():
+        return list(itertools.islice(reader, IMPORT_BATCH_SIZE))
+    
+    rows = imported = duplicates = failed = 0
+    errors = []
+    
+    try:
+        while True:
+            # Parsing touches the spooled upload on disk, so keep it off the event loop
+            batch = await run_in_threadpool(read_batch)
+            if not batch:
+                break
+            
+            parsed = []
+            for row in batch:
+                rows += 1
+                try:
+                    parsed.append(parse_import_row(row, context))
+                except ValueError as e:
+                    failed += 1
+                    if len(errors) < MAX_IMPORT_ERRORS:
+                        errors.append({"row": rows + 1, "error": str(e)})  # +1 for the header line
+            
+            if not parsed:
+                continue
+            
+            # The duplicate check, seqs and totals commit together with the inserts
+            async def write_batch(session):
+                hashes = [expense["content_hash"] for expense in parsed]
+                seen = set()
+                async for exp in db.expenses.find(
+                    {"group_id": group_id, "content_hash": {"$in": hashes}}, {"content_hash": 1, "_id": 0}, session=session
+                ):
+                    seen.add(exp["content_hash"])
+                
+                new_expenses = []
+                for expense in parsed:
+                    if expense["content_hash"] not in seen:
+                        seen.add(expense["content_hash"])
+                        new_expenses.append(expense)
+                
+                if new_expenses:
+                    last_seq = await next_change_seq(group_id, len(new_expenses), session=session)
+                    for offset, expense in enumerate(new_expenses):
+                        expense["seq"] = last_seq - len(new_expenses) + 1 + offset
+                    await db.expenses.insert_many(new_expenses, ordered=False, session=session)
+                    changes = [(None, expense) for expense in new_expenses]
+                    await update_group_ledgers(expense_changes=changes, session=session)
+                    await update_spending_rollups(changes, session=session)
+                    await update_budget_usage(changes, session=session)
+                return len(new_expenses), len(parsed) - len(new_expenses)
+            
+            inserted, skipped = await run_in_transaction(write_batch)
+            imported += inserted
+            duplicates += skipped
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read CSV after row {rows + 1}: {e}")
+    
+    elapsed = time.monotonic() - started
+    
+    return {
+        "rows": rows,
+        "imported": imported,
+        "duplicates": duplicates,
+        "failed": failed,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed > 0 else None
+    }
+
 # ==================== UTILITY ROUTES ====================
 
 @api_router.get("/currencies")
@@ -1866,8 +4646,37 @@ app.add_middleware(
     allow_origins=cors_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def detect_transaction_support():
+    global transactions_supported
+    try:
+        hello = await client.admin.command("hello")
+    except PyMongoError as e:
+        logger.warning(f"Could not determine transaction support: {e}")
+        return
+    transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+    logger.info(f"MongoDB transactions {'enabled' if transactions_supported else 'unavailable'}")
+
+@app.on_event("startup")
+async def start_thumbnail_workers():
+    global thumbnail_executor
+    if RECEIPTS_BUCKET and Image is not None:
+        thumbnail_executor = ProcessPoolExecutor(max_workers=RECEIPT_THUMBNAIL_WORKERS)
+    elif RECEIPTS_BUCKET:
+        logger.warning("Pillow is not installed; receipt thumbnails are disabled")
+
+@app.on_event("shutdown")
+async def stop_thumbnail_workers():
+    if thumbnail_executor is not None:
+        thumbnail_executor.shutdown(wait=False, cancel_futures=True)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -60,17 +60,12 @@ export default function Analytics() {
 
   const fetchData = async () => {
     try {
-      const [summaryData, categoryDataRes, memberDataRes, trendDataRes] = await Promise.all([
-        api.getAnalyticsSummary(),
-        api.getAnalyticsByCategory(),
-        api.getAnalyticsByMember(),
-        api.getAnalyticsTrends(6),
-      ]);
+      const dashboard = await api.getDashboard(['summary', 'by-category', 'by-member', 'trends'], undefined, 6);
 
-      setSummary(summaryData);
-      setCategoryData(categoryDataRes);
-      setMemberData(memberDataRes);
-      setTrendData(trendDataRes);
+      setSummary(dashboard.summary);
+      setCategoryData(dashboard.by_category);
+      setMemberData(dashboard.by_member);
+      setTrendData(dashboard.trends);
     } catch (error) {
       console.error('Error fetching analytics:', error);
     } finally {
@@ -23,6 +23,8 @@ const CURRENCY_SYMBOLS: Record<string, string> = {
   SAR: '﷼',
 };
 
+const PAGE_SIZE = 50;
+
 interface Expense {
   id: string;
   amount: number;
@@ -61,20 +63,26 @@ export default function Expenses() {
   const [filterCategory, setFilterCategory] = useState<string | null>(null);
   const [showFilters, setShowFilters] = useState(false);
   const [searchQuery, setSearchQuery] = useState('');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const expenseParams = (cursor?: string) => {
+    const params: any = { limit: PAGE_SIZE, cursor };
+    if (filterMember) params.paid_by = filterMember;
+    if (filterCategory) params.category_id = filterCategory;
+    return params;
+  };
 
   const fetchData = async () => {
     try {
-      const params: any = { limit: 100 };
-      if (filterMember) params.paid_by = filterMember;
-      if (filterCategory) params.category_id = filterCategory;
-
-      const [expensesData, familyData, categoriesData] = await Promise.all([
-        api.getExpenses(params),
+      const [expensesPage, familyData, categoriesData] = await Promise.all([
+        api.getExpenses(expenseParams()),
         api.getFamily().catch(() => ({ members: [] })),
         api.getCategories(),
       ]);
 
-      setExpenses(expensesData);
+      setExpenses(expensesPage.data);
+      setNextCursor(expensesPage.nextCursor);
       setMembers(familyData.members || []);
       setCategories(categoriesData);
     } catch (error) {
@@ -96,6 +104,20 @@ export default function Expenses() {
     fetchData();
   };
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await api.getExpenses(expenseParams(nextCursor));
+      setExpenses((loaded) => [...loaded, ...page.data]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error loading more expenses:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDeleteExpense = async (expenseId: string) => {
     Alert.alert(
       'Delete Expense',
@@ -159,20 +181,9 @@ export default function Expenses() {
     );
   });
 
-  const groupedExpenses = filteredExpenses.reduce((groups: Record<string, Expense[]>, expense) => {
-    const date = formatDate(expense.date);
-    if (!groups[date]) {
-      groups[date] = [];
-    }
-    groups[date].push(expense);
-    return groups;
-  }, {});
-
-  const groupedData = Object.entries(groupedExpenses).map(([date, items]) => ({
-    date,
-    items,
-    total: items.reduce((sum, item) => sum + item.amount, 0),
-  }));
+  // Rows are single expenses keyed by id; the first row of each day carries its date header
+  const startsDay = (index: number) =>
+    index === 0 || formatDate(filteredExpenses[index - 1].date) !== formatDate(filteredExpenses[index].date);
 
   if (isLoading) {
     return (
@@ -248,10 +259,13 @@ export default function Expenses() {
 
       {/* Expenses List */}
       <FlatList
-        data={groupedData}
-        keyExtractor={(item) => item.date}
+        data={filteredExpenses}
+        keyExtractor={(item) => item.id}
         refreshControl={<RefreshControl refreshing={refreshing} onRefresh={onRefresh} tintColor="#22D3EE" />}
         contentContainerStyle={styles.listContent}
+        onEndReached={loadMore}
+        onEndReachedThreshold={0.5}
+        ListFooterComponent={loadingMore ? <ActivityIndicator color="#22D3EE" style={styles.loadingMore} /> : null}
         ListEmptyComponent={
           <View style={styles.emptyState}>
             <Ionicons name="receipt-outline" size={64} color="#64748B" />
@@ -261,38 +275,37 @@ export default function Expenses() {
             </Text>
           </View>
         }
-        renderItem={({ item: group }) => (
-          <View style={styles.dateGroup}>
-            <View style={styles.dateHeader}>
-              <Text style={styles.dateText}>{group.date}</Text>
-            </View>
-            {group.items.map((expense) => (
-              <TouchableOpacity
-                key={expense.id}
-                style={styles.expenseCard}
-                onLongPress={() => handleDeleteExpense(expense.id)}
-              >
-                <View style={[styles.expenseIcon, { backgroundColor: expense.category_color + '20' }]}>
-                  <Ionicons name={getIconName(expense.category_icon)} size={20} color={expense.category_color} />
-                </View>
-                <View style={styles.expenseDetails}>
-                  <Text style={styles.expenseCategory}>{expense.category_name}</Text>
-                  {expense.description ? (
-                    <Text style={styles.expenseDescription} numberOfLines={1}>
-                      {expense.description}
-                    </Text>
-                  ) : null}
-                  <View style={styles.expenseMeta}>
-                    <View style={[styles.paidByDot, { backgroundColor: expense.paid_by_color }]} />
-                    <Text style={styles.expensePaidBy}>{expense.paid_by_name}</Text>
-                  </View>
+        renderItem={({ item: expense, index }) => (
+          <View>
+            {startsDay(index) ? (
+              <View style={[styles.dateHeader, index > 0 && styles.dateGroup]}>
+                <Text style={styles.dateText}>{formatDate(expense.date)}</Text>
+              </View>
+            ) : null}
+            <TouchableOpacity
+              style={styles.expenseCard}
+              onLongPress={() => handleDeleteExpense(expense.id)}
+            >
+              <View style={[styles.expenseIcon, { backgroundColor: expense.category_color + '20' }]}>
+                <Ionicons name={getIconName(expense.category_icon)} size={20} color={expense.category_color} />
+              </View>
+              <View style={styles.expenseDetails}>
+                <Text style={styles.expenseCategory}>{expense.category_name}</Text>
+                {expense.description ? (
+                  <Text style={styles.expenseDescription} numberOfLines={1}>
+                    {expense.description}
+                  </Text>
+                ) : null}
+                <View style={styles.expenseMeta}>
+                  <View style={[styles.paidByDot, { backgroundColor: expense.paid_by_color }]} />
+                  <Text style={styles.expensePaidBy}>{expense.paid_by_name}</Text>
                 </View>
-                <Text style={styles.expenseAmount}>
-                  {CURRENCY_SYMBOLS[expense.currency] || expense.currency}
-                  {expense.amount.toLocaleString('en-IN')}
-                </Text>
-              </TouchableOpacity>
-            ))}
+              </View>
+              <Text style={styles.expenseAmount}>
+                {CURRENCY_SYMBOLS[expense.currency] || expense.currency}
+                {expense.amount.toLocaleString('en-IN')}
+              </Text>
+            </TouchableOpacity>
           </View>
         )}
       />
@@ -386,6 +399,9 @@ const styles = StyleSheet.create({
     flex: 1,
     backgroundColor: '#0B1F2A',
   },
+  loadingMore: {
+    paddingVertical: 16,
+  },
   loadingContainer: {
     flex: 1,
     justifyContent: 'center',
@@ -483,7 +499,7 @@ const styles = StyleSheet.create({
     marginTop: 4,
   },
   dateGroup: {
-    marginBottom: 16,
+    marginTop: 16,
   },
   dateHeader: {
     paddingVertical: 8,
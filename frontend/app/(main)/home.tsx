@@ -60,12 +60,9 @@ export default function Home() {
   const fetchData = async () => {
     try {
       const groupId = selectedGroup?.id;
-      const [summaryData, expensesData] = await Promise.all([
-        api.getAnalyticsSummary(groupId),
-        api.getExpenses({ group_id: groupId, limit: 5 }),
-      ]);
-      setSummary(summaryData);
-      setRecentExpenses(expensesData);
+      const dashboard = await api.getDashboard(['summary', 'recent'], groupId);
+      setSummary(dashboard.summary);
+      setRecentExpenses(dashboard.recent_expenses);
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
@@ -10,6 +10,7 @@ interface User {
   email: string;
   avatar_color: string;
   default_currency: string;
+  timezone: string;
   biometric_enabled: boolean;
   auto_lock_enabled: boolean;
   auto_lock_timeout: number;
@@ -85,6 +86,21 @@ export function AuthProvider({ children }: { children: ReactNode }) {
     }
   }, [user, lastActivity]);
 
+  // Analytics bucket days in the profile's zone, which the server keeps rollups for,
+  // so the profile follows the device's zone
+  const withDeviceTimezone = async (profile: User): Promise<User> => {
+    const timezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
+    if (!timezone || profile.timezone === timezone) {
+      return profile;
+    }
+    try {
+      return await api.updateProfile({ timezone });
+    } catch (error) {
+      console.error('Error updating timezone:', error);
+      return profile;
+    }
+  };
+
   const loadStoredAuth = async () => {
     try {
       const storedToken = await AsyncStorage.getItem('token');
@@ -103,7 +119,7 @@ export function AuthProvider({ children }: { children: ReactNode }) {
         
         // Refresh user data
         try {
-          const response = await api.getMe();
+          const response = await withDeviceTimezone(await api.getMe());
           setUser(response);
           await AsyncStorage.setItem('user', JSON.stringify(response));
         } catch (error) {
@@ -120,23 +136,25 @@ export function AuthProvider({ children }: { children: ReactNode }) {
 
   const login = async (email: string, pin: string) => {
     const response = await api.login(email, pin);
+    api.setToken(response.access_token);
+    const profile = await withDeviceTimezone(response.user);
     setToken(response.access_token);
-    setUser(response.user);
+    setUser(profile);
     setIsLocked(false);
-    api.setToken(response.access_token);
     await AsyncStorage.setItem('token', response.access_token);
-    await AsyncStorage.setItem('user', JSON.stringify(response.user));
+    await AsyncStorage.setItem('user', JSON.stringify(profile));
     setLastActivity(new Date());
   };
 
   const register = async (name: string, email: string, pin: string) => {
     const response = await api.register(name, email, pin);
+    api.setToken(response.access_token);
+    const profile = await withDeviceTimezone(response.user);
     setToken(response.access_token);
-    setUser(response.user);
+    setUser(profile);
     setIsLocked(false);
-    api.setToken(response.access_token);
     await AsyncStorage.setItem('token', response.access_token);
-    await AsyncStorage.setItem('user', JSON.stringify(response.user));
+    await AsyncStorage.setItem('user', JSON.stringify(profile));
     setLastActivity(new Date());
   };
 
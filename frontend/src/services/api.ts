@@ -1,5 +1,11 @@
 const API_URL = process.env.EXPO_PUBLIC_BACKEND_URL || 'http://localhost:8001';
 
+// One page of a cursor-paged list; pass nextCursor back as `cursor` for the next page
+export interface Page<T = any> {
+  data: T[];
+  nextCursor: string | null;
+}
+
 class ApiService {
   private token: string | null = null;
 
@@ -7,7 +13,7 @@ class ApiService {
     this.token = token;
   }
 
-  private async request(endpoint: string, options: RequestInit = {}) {
+  private async send(endpoint: string, options: RequestInit = {}) {
     const url = `${API_URL}/api${endpoint}`;
     
     const headers: HeadersInit = {
@@ -29,6 +35,12 @@ class ApiService {
       throw new Error(error.detail || 'An error occurred');
     }
 
+    return response;
+  }
+
+  private async request(endpoint: string, options: RequestInit = {}) {
+    const response = await this.send(endpoint, options);
+
     // Check if response is CSV
     const contentType = response.headers.get('content-type');
     if (contentType && contentType.includes('text/csv')) {
@@ -38,6 +50,14 @@ class ApiService {
     return response.json();
   }
 
+  private async requestPage(endpoint: string, options: RequestInit = {}): Promise<Page> {
+    const response = await this.send(endpoint, options);
+    return {
+      data: await response.json(),
+      nextCursor: response.headers.get('X-Next-Cursor'),
+    };
+  }
+
   // Auth
   async register(name: string, email: string, pin: string) {
     return this.request('/auth/register', {
@@ -60,6 +80,7 @@ class ApiService {
   async updateProfile(data: {
     name?: string;
     default_currency?: string;
+    timezone?: string;
     biometric_enabled?: boolean;
     auto_lock_enabled?: boolean;
     auto_lock_timeout?: number;
@@ -130,6 +151,18 @@ class ApiService {
     });
   }
 
+  async archiveGroup(groupId: string) {
+    return this.request(`/groups/${groupId}/archive`, {
+      method: 'POST',
+    });
+  }
+
+  async unarchiveGroup(groupId: string) {
+    return this.request(`/groups/${groupId}/unarchive`, {
+      method: 'POST',
+    });
+  }
+
   // Categories
   async getCategories(groupId?: string) {
     const query = groupId ? `?group_id=${groupId}` : '';
@@ -171,6 +204,7 @@ class ApiService {
     category_id?: string;
     paid_by?: string;
     limit?: number;
+    cursor?: string;
   }) {
     const queryParams = new URLSearchParams();
     if (params) {
@@ -181,7 +215,19 @@ class ApiService {
       });
     }
     const query = queryParams.toString();
-    return this.request(`/expenses${query ? `?${query}` : ''}`);
+    return this.requestPage(`/expenses${query ? `?${query}` : ''}`);
+  }
+
+  async searchExpenses(q: string, params?: { group_id?: string; limit?: number; cursor?: string }) {
+    const queryParams = new URLSearchParams({ q });
+    if (params) {
+      Object.entries(params).forEach(([key, value]) => {
+        if (value !== undefined) {
+          queryParams.append(key, String(value));
+        }
+      });
+    }
+    return this.requestPage(`/expenses/search?${queryParams.toString()}`);
   }
 
   async getExpense(expenseId: string) {
@@ -194,6 +240,7 @@ class ApiService {
     category_id?: string;
     description?: string;
     date?: string;
+    version?: number; // Rejected with 409 if someone else changed the expense since
   }) {
     return this.request(`/expenses/${expenseId}`, {
       method: 'PUT',
@@ -207,6 +254,16 @@ class ApiService {
     });
   }
 
+  async getReceipts(expenseId: string) {
+    return this.request(`/expenses/${expenseId}/receipts`);
+  }
+
+  async deleteReceipt(expenseId: string, receiptId: string) {
+    return this.request(`/expenses/${expenseId}/receipts/${receiptId}`, {
+      method: 'DELETE',
+    });
+  }
+
   // Analytics
   async getAnalyticsSummary(groupId?: string) {
     const query = groupId ? `?group_id=${groupId}` : '';
@@ -258,6 +315,13 @@ class ApiService {
     return this.request(`/analytics/trends${query}`);
   }
 
+  async getDashboard(sections: string[], groupId?: string, months: number = 6) {
+    const queryParams = new URLSearchParams({ sections: sections.join(','), months: String(months) });
+    if (groupId) queryParams.append('group_id', groupId);
+    // Days are bucketed in the profile's zone, which AuthContext keeps in step with the device
+    return this.request(`/dashboard?${queryParams.toString()}`);
+  }
+
   async getAnalyticsDaily(groupId?: string, days: number = 30) {
     let query = `?days=${days}`;
     if (groupId) query += `&group_id=${groupId}`;
@@ -301,9 +365,41 @@ class ApiService {
     });
   }
 
-  async getSettlements(groupId?: string) {
-    const query = groupId ? `?group_id=${groupId}` : '';
-    return this.request(`/settlements${query}`);
+  async settleAllDebts(groupId: string) {
+    return this.request(`/groups/${groupId}/settle-all`, {
+      method: 'POST',
+    });
+  }
+
+  async getSettlements(params?: { group_id?: string; limit?: number; cursor?: string }) {
+    const queryParams = new URLSearchParams();
+    if (params) {
+      Object.entries(params).forEach(([key, value]) => {
+        if (value !== undefined) {
+          queryParams.append(key, String(value));
+        }
+      });
+    }
+    const query = queryParams.toString();
+    return this.requestPage(`/settlements${query ? `?${query}` : ''}`);
+  }
+
+  async updateSettlement(settlementId: string, data: {
+    paid_to?: string;
+    amount?: number;
+    currency?: string;
+    note?: string;
+  }) {
+    return this.request(`/settlements/${settlementId}`, {
+      method: 'PUT',
+      body: JSON.stringify(data),
+    });
+  }
+
+  async deleteSettlement(settlementId: string) {
+    return this.request(`/settlements/${settlementId}`, {
+      method: 'DELETE',
+    });
   }
 
   async updateGroupMode(groupId: string, mode: 'split' | 'contribution') {
@@ -312,6 +408,44 @@ class ApiService {
     });
   }
 
+  // Budgets
+  async getBudgets(groupId?: string) {
+    const query = groupId ? `?group_id=${groupId}` : '';
+    return this.request(`/budgets${query}`);
+  }
+
+  async createBudget(data: {
+    group_id: string;
+    category_id: string;
+    amount: number;
+    currency?: string;
+    thresholds?: number[];
+  }) {
+    return this.request('/budgets', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    });
+  }
+
+  async updateBudget(budgetId: string, data: { amount?: number; thresholds?: number[] }) {
+    return this.request(`/budgets/${budgetId}`, {
+      method: 'PUT',
+      body: JSON.stringify(data),
+    });
+  }
+
+  async deleteBudget(budgetId: string) {
+    return this.request(`/budgets/${budgetId}`, {
+      method: 'DELETE',
+    });
+  }
+
+  // Sync
+  async sync(since?: string) {
+    const query = since ? `?since=${encodeURIComponent(since)}` : '';
+    return this.request(`/sync${query}`);
+  }
+
   // Utilities
   async getCurrencies() {
     return this.request('/currencies');
@@ -1,8 +1,14 @@
+import asyncio
+import copy
+import io
 import os
+from types import SimpleNamespace
 from typing import Any, Dict, Iterable, List
 
+import bson
 import pytest
 from fastapi.testclient import TestClient
+from pymongo import DeleteOne
 
 os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
 os.environ.setdefault("DB_NAME", "family_expense_test")
@@ -23,15 +29,20 @@ class FakeCursor:
         self._docs = list(docs)
         self._limit = None
 
-    def sort(self, field: str, direction: int):
-        reverse = direction == -1
-        self._docs.sort(key=lambda doc: doc.get(field), reverse=reverse)
+    def sort(self, field, direction: int = 1):
+        keys = field if isinstance(field, list) else [(field, direction)]
+        # Stable sorts applied from the least significant key give a compound order
+        for key, key_direction in reversed(keys):
+            self._docs.sort(key=lambda doc: doc.get(key), reverse=key_direction == -1)
         return self
 
     def limit(self, limit: int):
         self._limit = limit
         return self
 
+    def batch_size(self, size: int):
+        return self
+
     async def to_list(self, length: int):
         docs = self._docs
         if self._limit is not None:
@@ -51,8 +62,16 @@ class FakeCursor:
 
 def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
     for key, value in query.items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in value):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, clause) for clause in value):
+                return False
+            continue
         doc_value = doc.get(key)
-        if isinstance(value, dict):
+        if isinstance(value, dict) and value and all(op.startswith("$") for op in value):
             if "$in" in value:
                 if isinstance(doc_value, list):
                     if not any(item in value["$in"] for item in doc_value):
@@ -63,6 +82,19 @@ def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
                 return False
             if "$lte" in value and (doc_value is None or doc_value > value["$lte"]):
                 return False
+            if "$gt" in value and (doc_value is None or doc_value <= value["$gt"]):
+                return False
+            if "$lt" in value and (doc_value is None or doc_value >= value["$lt"]):
+                return False
+            if "$all" in value:
+                if not isinstance(doc_value, list) or not all(item in doc_value for item in value["$all"]):
+                    return False
+            if "$ne" in value:
+                if isinstance(doc_value, list):
+                    if value["$ne"] in doc_value:
+                        return False
+                elif doc_value == value["$ne"]:
+                    return False
         else:
             if isinstance(doc_value, list):
                 if value not in doc_value:
@@ -74,47 +106,237 @@ def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
 
 def apply_projection(doc: Dict[str, Any], projection: Dict[str, int] | None):
     if not projection:
-        return doc
+        return copy.deepcopy(doc)
+    if not any(projection.values()):
+        return {key: value for key, value in doc.items() if key not in projection}
     projected = {key: doc[key] for key, include in projection.items() if include and key in doc}
     return projected
 
 
+def set_path(doc: Dict[str, Any], path: str, value: Any):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[leaf] = value
+
+
+def get_path(doc: Dict[str, Any], path: str, default: Any = None):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+def apply_update(doc: Dict[str, Any], update: Dict[str, Any]):
+    for key, value in update.get("$set", {}).items():
+        set_path(doc, key, value)
+    for key, value in update.get("$inc", {}).items():
+        set_path(doc, key, get_path(doc, key, 0) + value)
+    for key, value in update.get("$push", {}).items():
+        if isinstance(value, dict) and "$each" in value:
+            doc.setdefault(key, []).extend(value["$each"])
+        else:
+            doc.setdefault(key, []).append(value)
+    for key, value in update.get("$pull", {}).items():
+        if isinstance(value, dict):
+            doc[key] = [item for item in doc.get(key, []) if not matches(item, value)]
+        else:
+            doc[key] = [item for item in doc.get(key, []) if item != value]
+
+
+def evaluate(doc: Dict[str, Any], expression: Any):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return get_path(doc, expression[1:])
+    if isinstance(expression, dict) and len(expression) == 1:
+        (operator, args), = expression.items()
+        if operator == "$cond":
+            condition, then, otherwise = args
+            return evaluate(doc, then) if evaluate(doc, condition) else evaluate(doc, otherwise)
+        if operator == "$and":
+            return all(evaluate(doc, arg) for arg in args)
+        if operator == "$switch":
+            for branch in args["branches"]:
+                if evaluate(doc, branch["case"]):
+                    return evaluate(doc, branch["then"])
+            return evaluate(doc, args["default"])
+        if operator == "$multiply":
+            product = 1
+            for arg in args:
+                product *= evaluate(doc, arg)
+            return product
+        if operator == "$dateTrunc":
+            local = server.to_local(evaluate(doc, args["date"]), args.get("timezone", "UTC"))
+            local = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            local = local.replace(day=1) if args["unit"] == "month" else local
+            return server.to_utc(local, args.get("timezone", "UTC"))
+        comparisons = {
+            "$gte": lambda a, b: a >= b,
+            "$gt": lambda a, b: a > b,
+            "$lte": lambda a, b: a <= b,
+            "$lt": lambda a, b: a < b,
+            "$eq": lambda a, b: a == b,
+        }
+        if operator in comparisons:
+            left, right = (evaluate(doc, arg) for arg in args)
+            return comparisons[operator](left, right)
+        raise NotImplementedError(operator)
+    if isinstance(expression, dict):
+        return {key: evaluate(doc, value) for key, value in expression.items()}
+    return expression
+
+
+def group_docs(docs: List[Dict[str, Any]], spec: Dict[str, Any]):
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for doc in docs:
+        key = evaluate(doc, spec["_id"])
+        hashable = repr(key)
+        if hashable not in groups:
+            groups[hashable] = {"_id": key, **{field: 0 for field in spec if field != "_id"}}
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            if operator != "$sum":
+                raise NotImplementedError(operator)
+            value = evaluate(doc, expression)
+            if isinstance(value, (int, float)):
+                groups[hashable][field] += value
+    return list(groups.values())
+
+
+def run_pipeline(database, docs: List[Dict[str, Any]], pipeline: List[Dict[str, Any]]):
+    docs = [copy.deepcopy(doc) for doc in docs]
+    for stage in pipeline:
+        (operator, spec), = stage.items()
+        if operator == "$match":
+            docs = [doc for doc in docs if matches(doc, spec)]
+        elif operator == "$sort":
+            docs = FakeCursor(docs).sort(list(spec.items()))._docs
+        elif operator == "$limit":
+            docs = docs[:spec]
+        elif operator == "$project":
+            docs = [apply_projection(doc, spec) for doc in docs]
+        elif operator == "$group":
+            docs = group_docs(docs, spec)
+        elif operator == "$facet":
+            docs = [{name: run_pipeline(database, docs, stages) for name, stages in spec.items()}]
+        elif operator == "$lookup":
+            foreign = database[spec["from"]]._docs
+            for doc in docs:
+                joined = [item for item in foreign if item.get(spec["foreignField"]) == doc.get(spec["localField"])]
+                doc[spec["as"]] = run_pipeline(database, joined, spec.get("pipeline", []))
+        else:
+            raise NotImplementedError(operator)
+    return docs
+
+
 class FakeCollection:
     def __init__(self):
         self._docs: List[Dict[str, Any]] = []
+        self._indexes = {"_id_"}
 
-    async def find_one(self, query: Dict[str, Any], projection: Dict[str, int] | None = None):
+    async def find_one(self, query: Dict[str, Any], projection: Dict[str, int] | None = None, session=None):
         for doc in self._docs:
             if matches(doc, query):
-                return apply_projection(doc, projection)
+                # A copy, like a document read from the server
+                return copy.deepcopy(apply_projection(doc, projection))
         return None
 
-    async def insert_one(self, doc: Dict[str, Any]):
+    async def insert_one(self, doc: Dict[str, Any], session=None):
         self._docs.append(doc)
-        return {"inserted_id": doc.get("id")}
+        return SimpleNamespace(inserted_id=doc.get("id"))
+
+    async def insert_many(self, docs: List[Dict[str, Any]], ordered: bool = True, session=None):
+        self._docs.extend(docs)
+        return SimpleNamespace(inserted_ids=[doc.get("id") for doc in docs])
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, session=None):
+        for doc in self._docs:
+            if matches(doc, query):
+                apply_update(doc, update)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            apply_update(doc, update)
+            for key, value in update.get("$setOnInsert", {}).items():
+                set_path(doc, key, value)
+            self._docs.append(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc.get("id", len(self._docs)))
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any], session=None):
+        docs = [doc for doc in self._docs if matches(doc, query)]
+        for doc in docs:
+            apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(docs), modified_count=len(docs))
+
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any], session=None, **kwargs):
+        for doc in self._docs:
+            if matches(doc, query):
+                before = copy.deepcopy(doc)
+                apply_update(doc, update)
+                return doc if kwargs.get("return_document") else before
+        if kwargs.get("upsert"):
+            await self.update_one(query, update, upsert=True)
+            return self._docs[-1] if kwargs.get("return_document") else None
+        return None
+
+    async def bulk_write(self, requests, ordered: bool = True, session=None):
+        result = SimpleNamespace(matched_count=0, modified_count=0, deleted_count=0, upserted_ids={})
+        for index, request in enumerate(requests):
+            if isinstance(request, DeleteOne):
+                for doc in self._docs:
+                    if matches(doc, request._filter):
+                        self._docs.remove(doc)
+                        result.deleted_count += 1
+                        break
+                continue
+            written = await self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+            result.matched_count += written.matched_count
+            result.modified_count += written.modified_count
+            if written.upserted_id is not None:
+                result.upserted_ids[index] = written.upserted_id
+        return result
 
-    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any]):
+    async def find_one_and_delete(self, query: Dict[str, Any], session=None):
         for doc in self._docs:
             if matches(doc, query):
-                for key, value in update.get("$set", {}).items():
-                    doc[key] = value
-                return {"modified_count": 1}
-        return {"modified_count": 0}
+                self._docs.remove(doc)
+                return doc
+        return None
 
-    async def delete_one(self, query: Dict[str, Any]):
+    async def delete_one(self, query: Dict[str, Any], session=None):
         before = len(self._docs)
         self._docs = [doc for doc in self._docs if not matches(doc, query)]
-        return {"deleted_count": before - len(self._docs)}
+        return SimpleNamespace(deleted_count=before - len(self._docs))
 
-    async def delete_many(self, query: Dict[str, Any]):
+    async def delete_many(self, query: Dict[str, Any], session=None):
         return await self.delete_one(query)
 
-    def find(self, query: Dict[str, Any], projection: Dict[str, int] | None = None):
+    def find(self, query: Dict[str, Any], projection: Dict[str, int] | None = None, session=None):
         results = [apply_projection(doc, projection) for doc in self._docs if matches(doc, query)]
         return FakeCursor(results)
 
-    async def count_documents(self, query: Dict[str, Any]):
-        return len([doc for doc in self._docs if matches(doc, query)])
+    def aggregate(self, pipeline: List[Dict[str, Any]], session=None, **kwargs):
+        return FakeCursor(run_pipeline(self._database, self._docs, pipeline))
+
+    async def count_documents(self, query: Dict[str, Any], limit: int = 0):
+        count = len([doc for doc in self._docs if matches(doc, query)])
+        return min(count, limit) if limit else count
+
+    async def find_raw_batches(self, query: Dict[str, Any], projection: Dict[str, int] | None = None, batch_size: int = 100):
+        docs = [apply_projection(doc, projection) for doc in self._docs if matches(doc, query)]
+        for start in range(0, len(docs), batch_size):
+            yield b"".join(bson.encode(doc) for doc in docs[start:start + batch_size])
+
+    async def create_indexes(self, indexes):
+        names = [index.document["name"] for index in indexes]
+        self._indexes.update(names)
+        return names
+
+    async def index_information(self):
+        return {name: {} for name in self._indexes}
 
 
 class FakeDatabase:
@@ -124,12 +346,46 @@ class FakeDatabase:
         self.categories = FakeCollection()
         self.expenses = FakeCollection()
         self.settlements = FakeCollection()
+        self.group_ledgers = FakeCollection()
+        self.settlement_revisions = FakeCollection()
+        self.idempotency_keys = FakeCollection()
+        self.tombstones = FakeCollection()
+        self.receipt_objects = FakeCollection()
+        self.spending_rollups = FakeCollection()
+        self.exchange_rates = FakeCollection()
+        self.app_state = FakeCollection()
+        self.budgets = FakeCollection()
+        self.budget_usage = FakeCollection()
+        for collection in list(vars(self).values()):
+            collection._database = self
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return getattr(self, name)
+
+
+class FakeSession:
+    """Stands in for a transaction; the fake database applies every write at once anyway"""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def with_transaction(self, operation):
+        return await operation(self)
+
+
+class FakeClient:
+    async def start_session(self):
+        return FakeSession()
 
 
 @pytest.fixture()
 def client(monkeypatch):
     fake_db = FakeDatabase()
     monkeypatch.setattr(server_module, "db", fake_db)
+    monkeypatch.setattr(server_module, "exchange_rates", None)
     return TestClient(server.app)
 
 
@@ -178,3 +434,1190 @@ def test_auth_and_expense_flow(client):
     expenses = list_response.json()
     assert len(expenses) == 1
     assert expenses[0]["description"] == "Grocery run"
+
+
+def register_user(client, name: str, email: str) -> Dict[str, str]:
+    response = client.post("/api/auth/register", json={"name": name, "email": email, "pin": "1234"})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_archived_groups_excluded_from_all_groups_views(client):
+    headers = register_user(client, "Meera Iyer", "meera@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+
+    group_ids = []
+    for name in ("Home", "Goa Trip"):
+        response = client.post("/api/groups", headers=headers, json={"name": name, "type": "shared"})
+        group_ids.append(response.json()["id"])
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": 500, "category_id": category_id, "group_id": group_ids[-1], "description": name},
+        )
+
+    archive_response = client.post(f"/api/groups/{group_ids[1]}/archive", headers=headers)
+    assert archive_response.status_code == 200
+
+    groups = {g["id"]: g for g in client.get("/api/groups", headers=headers).json()}
+    assert groups[group_ids[1]]["archived"] is True
+
+    active = client.get("/api/expenses", headers=headers).json()
+    assert [e["description"] for e in active] == ["Home"]
+
+    everything = client.get("/api/expenses?include_archived=true", headers=headers).json()
+    assert sorted(e["description"] for e in everything) == ["Goa Trip", "Home"]
+
+    explicit = client.get(f"/api/expenses?group_id={group_ids[1]}", headers=headers).json()
+    assert [e["description"] for e in explicit] == ["Goa Trip"]
+
+    client.post(f"/api/groups/{group_ids[1]}/unarchive", headers=headers)
+    assert len(client.get("/api/expenses", headers=headers).json()) == 2
+
+
+def test_settlements_are_paged_with_cursor(client):
+    owner = register_user(client, "Kabir Rao", "kabir@example.com")
+    guest = register_user(client, "Anika Rao", "anika@example.com")
+    group = client.post("/api/groups", headers=owner, json={"name": "Flatmates", "type": "shared"}).json()
+    client.post("/api/groups/join", headers=guest, json={"invite_code": group["invite_code"]})
+    guest_id = client.get("/api/auth/me", headers=guest).json()["id"]
+
+    for amount in (100, 200, 300):
+        response = client.post(
+            "/api/settlements",
+            headers=owner,
+            json={"group_id": group["id"], "paid_to": guest_id, "amount": amount},
+        )
+        assert response.status_code == 200
+
+    first = client.get("/api/settlements?limit=2", headers=owner)
+    assert first.status_code == 200
+    assert len(first.json()) == 2
+    assert first.json()[0]["paid_to_name"] == "Anika Rao"
+    assert first.json()[0]["group_name"] == "Flatmates"
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get(f"/api/settlements?limit=2&cursor={cursor}", headers=guest)
+    assert len(second.json()) == 1
+    assert "X-Next-Cursor" not in second.headers
+    seen = {s["id"] for s in first.json()} | {s["id"] for s in second.json()}
+    assert len(seen) == 3
+
+    assert client.get("/api/settlements?cursor=not-a-cursor", headers=owner).status_code == 400
+
+    # Without a limit the default page size applies
+    default_page = client.get("/api/settlements", headers=owner)
+    assert len(default_page.json()) == 3 and "X-Next-Cursor" not in default_page.headers
+
+
+def test_settle_all_zeroes_group_balances(client):
+    owner = register_user(client, "Rohan Das", "rohan@example.com")
+    group = client.post("/api/groups", headers=owner, json={"name": "Trip", "type": "shared"}).json()
+    for name, email in (("Ira Das", "ira@example.com"), ("Dev Das", "dev@example.com")):
+        member = register_user(client, name, email)
+        client.post("/api/groups/join", headers=member, json={"invite_code": group["invite_code"]})
+    category_id = client.get("/api/categories", headers=owner).json()[0]["id"]
+    client.post(
+        "/api/expenses",
+        headers=owner,
+        json={"amount": 300, "category_id": category_id, "group_id": group["id"]},
+    )
+
+    before = client.get(f"/api/groups/{group['id']}/balances", headers=owner).json()
+    assert len(before["debts"]) == 2
+
+    response = client.post(f"/api/groups/{group['id']}/settle-all", headers=owner)
+    assert response.status_code == 200
+    settled = response.json()
+    assert settled["debts"] == []
+    assert sorted(s["amount"] for s in settled["settlements"]) == [100, 100]
+    assert all(b["net_balance"]["INR"] == 0 for b in settled["member_balances"])
+
+    after = client.get(f"/api/groups/{group['id']}/balances", headers=owner).json()
+    assert after["debts"] == []
+    assert after["member_balances"] == settled["member_balances"]
+
+
+def test_settle_all_rejects_a_plan_made_stale_by_a_concurrent_write(client, monkeypatch):
+    owner = register_user(client, "Lena Vos", "lena@example.com")
+    group = client.post("/api/groups", headers=owner, json={"name": "Cabin", "type": "shared"}).json()
+    member = register_user(client, "Joris Vos", "joris@example.com")
+    client.post("/api/groups/join", headers=member, json={"invite_code": group["invite_code"]})
+    category_id = client.get("/api/categories", headers=owner).json()[0]["id"]
+
+    def add_expense():
+        client.post("/api/expenses", headers=member, json={"amount": 80, "category_id": category_id, "group_id": group["id"]})
+
+    client.post("/api/expenses", headers=owner, json={"amount": 200, "category_id": category_id, "group_id": group["id"]})
+
+    # An expense lands after the debts were planned but before they are written
+    plan = server.simplify_debts
+    def plan_then_write(*args):
+        debts = plan(*args)
+        monkeypatch.setattr(server_module, "simplify_debts", plan)
+        add_expense()
+        return debts
+    monkeypatch.setattr(server_module, "simplify_debts", plan_then_write)
+
+    assert client.post(f"/api/groups/{group['id']}/settle-all", headers=owner).status_code == 409
+    assert client.get("/api/settlements", headers=owner).json() == []
+
+    settled = client.post(f"/api/groups/{group['id']}/settle-all", headers=owner).json()
+    assert [s["amount"] for s in settled["settlements"]] == [60]
+    assert all(b["net_balance"]["INR"] == 0 for b in settled["member_balances"])
+
+
+def test_ledger_rebuild_is_redone_when_a_write_races_with_it(client, monkeypatch):
+    headers = register_user(client, "Nils Berg", "nils@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+
+    def add(amount):
+        client.post("/api/expenses", headers=headers, json={"amount": amount, "category_id": category_id, "group_id": group_id})
+
+    add(100)
+    server_module.db.group_ledgers._docs.clear()
+
+    # An expense written while the history is scanned finds no ledger to update
+    expenses = server_module.db.expenses
+    scan = expenses.find
+    def scan_then_write(*args, **kwargs):
+        cursor = scan(*args, **kwargs)
+        monkeypatch.setattr(expenses, "find", scan)
+        add(50)
+        return cursor
+    monkeypatch.setattr(expenses, "find", scan_then_write)
+
+    balances = client.get(f"/api/groups/{group_id}/balances", headers=headers).json()
+    assert balances["member_balances"][0]["total_paid"] == {"INR": 150}
+
+
+def test_ledger_rebuild_is_redone_when_a_write_raised_its_seq_before_the_scan(client, monkeypatch):
+    headers = register_user(client, "Ola Berg", "ola@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    client.post("/api/expenses", headers=headers, json={"amount": 100, "category_id": category_id, "group_id": group_id})
+    server_module.db.group_ledgers._docs.clear()
+
+    # A writer that took its seq before the build inserts after the scan and misses the ledger
+    ledgers = server_module.db.group_ledgers
+    store = ledgers.find_one_and_update
+    async def write_then_store(*args, **kwargs):
+        monkeypatch.setattr(ledgers, "find_one_and_update", store)
+        expense = {**copy.deepcopy(server_module.db.expenses._docs[0]), "id": "late", "amount": 50}
+        server_module.db.expenses._docs.append(expense)
+        await server_module.update_group_ledgers([(None, expense)])
+        return await store(*args, **kwargs)
+    monkeypatch.setattr(ledgers, "find_one_and_update", write_then_store)
+
+    balances = client.get(f"/api/groups/{group_id}/balances", headers=headers).json()
+    assert balances["member_balances"][0]["total_paid"] == {"INR": 150}
+
+
+def test_settlement_edits_adjust_balances_incrementally(client):
+    owner = register_user(client, "Nisha Menon", "nisha@example.com")
+    guest = register_user(client, "Arjun Menon", "arjun@example.com")
+    group = client.post("/api/groups", headers=owner, json={"name": "Rent", "type": "shared"}).json()
+    client.post("/api/groups/join", headers=guest, json={"invite_code": group["invite_code"]})
+    owner_id = client.get("/api/auth/me", headers=owner).json()["id"]
+    category_id = client.get("/api/categories", headers=owner).json()[0]["id"]
+    client.post(
+        "/api/expenses",
+        headers=owner,
+        json={"amount": 1000, "category_id": category_id, "group_id": group["id"]},
+    )
+
+    def guest_net():
+        balances = client.get(f"/api/groups/{group['id']}/balances", headers=owner).json()
+        return next(b for b in balances["member_balances"] if b["user_id"] != owner_id)["net_balance"]["INR"]
+
+    assert guest_net() == -500
+
+    settlement = client.post(
+        "/api/settlements",
+        headers=guest,
+        json={"group_id": group["id"], "paid_to": owner_id, "amount": 300},
+    ).json()
+    assert guest_net() == -200
+
+    for amount in (0, -50):
+        assert client.put(f"/api/settlements/{settlement['id']}", headers=guest, json={"amount": amount}).status_code == 422
+
+    update = client.put(f"/api/settlements/{settlement['id']}", headers=guest, json={"amount": 500})
+    assert update.status_code == 200
+    assert update.json()["amount"] == 500
+    assert guest_net() == 0
+
+    outsider = register_user(client, "Zoya Khan", "zoya@example.com")
+    assert client.delete(f"/api/settlements/{settlement['id']}", headers=outsider).status_code == 403
+
+    assert client.delete(f"/api/settlements/{settlement['id']}", headers=owner).status_code == 200
+    assert guest_net() == -500
+    assert client.delete(f"/api/settlements/{settlement['id']}", headers=owner).status_code == 404
+
+    revisions = server_module.db.settlement_revisions._docs
+    assert [r["action"] for r in revisions] == ["update", "delete"]
+    assert revisions[0]["previous"] == {"amount": 300}
+
+
+def test_expenses_are_paged_with_cursor(client, monkeypatch):
+    headers = register_user(client, "Tara Bose", "tara@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for day in range(1, 6):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={
+                "amount": day * 10,
+                "category_id": category_id,
+                "group_id": group_id,
+                "description": f"Day {day}",
+                "date": f"2024-03-0{day}T10:00:00",
+            },
+        )
+
+    pages = []
+    url = f"/api/expenses?group_id={group_id}&limit=2"
+    while url:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        pages.append([e["description"] for e in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        url = f"/api/expenses?group_id={group_id}&limit=2&cursor={cursor}" if cursor else None
+
+    assert pages == [["Day 5", "Day 4"], ["Day 3", "Day 2"], ["Day 1"]]
+    # Clients that still ask for more than a page get a clamped page, not an error
+    monkeypatch.setattr(server_module, "MAX_PAGE_SIZE", 3)
+    clamped = client.get(f"/api/expenses?group_id={group_id}&limit=1000", headers=headers)
+    assert clamped.status_code == 200
+    assert len(clamped.json()) == 3
+    assert clamped.headers.get("X-Next-Cursor")
+
+
+def test_expense_batch_is_idempotent(client):
+    headers = register_user(client, "Sara Pillai", "sara@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+
+    def create(expense_id, amount):
+        return {
+            "op": "create",
+            "id": expense_id,
+            "expense": {"amount": amount, "category_id": category_id, "group_id": group_id},
+        }
+
+    batch = {"operations": [create("exp-1", 100), create("exp-2", 250)]}
+    first = client.post("/api/expenses/batch", headers={**headers, "Idempotency-Key": "k1"}, json=batch)
+    assert first.status_code == 200
+    assert [r["status"] for r in first.json()["results"]] == ["created", "created"]
+
+    replay = client.post("/api/expenses/batch", headers={**headers, "Idempotency-Key": "k1"}, json=batch)
+    assert replay.json() == first.json()
+
+    retry = client.post("/api/expenses/batch", headers=headers, json=batch)
+    assert [r["status"] for r in retry.json()["results"]] == ["unchanged", "unchanged"]
+
+    mixed = client.post(
+        "/api/expenses/batch",
+        headers=headers,
+        json={
+            "operations": [
+                {"op": "update", "id": "exp-1", "changes": {"amount": 150}},
+                {"op": "delete", "id": "exp-2"},
+                {"op": "delete", "id": "missing"},
+            ]
+        },
+    ).json()
+    assert [r["status"] for r in mixed["results"]] == ["updated", "deleted", "error"]
+    assert mixed["expenses"][0]["amount"] == 150
+
+    expenses = client.get(f"/api/expenses?group_id={group_id}", headers=headers).json()
+    assert [(e["id"], e["amount"]) for e in expenses] == [("exp-1", 150)]
+
+
+def test_expense_batch_reports_operations_made_stale_by_a_concurrent_update(client, monkeypatch):
+    headers = register_user(client, "Mira Kos", "mira@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for expense_id, amount in (("exp-1", 100), ("exp-2", 40)):
+        client.post(
+            "/api/expenses/batch",
+            headers=headers,
+            json={"operations": [{"op": "create", "id": expense_id, "expense": {"amount": amount, "category_id": category_id, "group_id": group_id}}]},
+        )
+
+    # exp-1 is edited and exp-3 created after the batch read them but before the batch writes
+    next_seq = server_module.next_change_seq
+    async def update_then_continue(*args, **kwargs):
+        monkeypatch.setattr(server_module, "next_change_seq", next_seq)
+        client.put("/api/expenses/exp-1", headers=headers, json={"amount": 300})
+        client.post(
+            "/api/expenses/batch",
+            headers=headers,
+            json={"operations": [{"op": "create", "id": "exp-3", "expense": {"amount": 70, "category_id": category_id, "group_id": group_id}}]},
+        )
+        return await next_seq(*args, **kwargs)
+    monkeypatch.setattr(server_module, "next_change_seq", update_then_continue)
+
+    batch = client.post(
+        "/api/expenses/batch",
+        headers=headers,
+        json={"operations": [
+            {"op": "update", "id": "exp-1", "changes": {"amount": 150}},
+            {"op": "delete", "id": "exp-2"},
+            {"op": "create", "id": "exp-3", "expense": {"amount": 20, "category_id": category_id, "group_id": group_id}},
+            {"op": "create", "id": "exp-4", "expense": {"amount": 10, "category_id": category_id, "group_id": group_id}},
+        ]},
+    ).json()
+    assert [(r["status"], r.get("status_code")) for r in batch["results"]] == [
+        ("error", 409), ("deleted", None), ("error", 409), ("created", None)
+    ]
+    assert [e["id"] for e in batch["expenses"]] == ["exp-4"]
+
+    expenses = client.get(f"/api/expenses?group_id={group_id}", headers=headers).json()
+    assert sorted((e["id"], e["amount"]) for e in expenses) == [("exp-1", 300), ("exp-3", 70), ("exp-4", 10)]
+    balances = client.get(f"/api/groups/{group_id}/balances", headers=headers).json()
+    assert balances["member_balances"][0]["total_paid"] == {"INR": 380}
+    summary = client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+    assert summary["total"] == {"INR": 380}
+
+
+def test_create_expense_with_client_id_is_retry_safe(client):
+    headers = register_user(client, "Vikram Sen", "vikram@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    payload = {"id": "client-42", "amount": 80, "category_id": category_id, "group_id": group_id}
+
+    first = client.post("/api/expenses", headers=headers, json=payload)
+    second = client.post("/api/expenses", headers=headers, json=payload)
+    assert first.status_code == second.status_code == 200
+    assert second.json()["id"] == "client-42"
+    assert len(client.get(f"/api/expenses?group_id={group_id}", headers=headers).json()) == 1
+
+
+def test_csv_import_skips_bad_rows_and_duplicates(client):
+    headers = register_user(client, "Lata Joshi", "lata@example.com")
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    statement = (
+        "Date,Category,Amount,Currency,Description,Paid By\n"
+        "2024-02-01,Utilities,1450.50,INR,Electricity bill,Lata Joshi\n"
+        "2024-02-03,Groceries,\"2,300\",INR,Weekly shop,\n"
+        "2024-02-04,Groceries,abc,INR,Broken row,\n"
+        "2024-02-05,Unknown,10,INR,No such category,\n"
+        "2024-02-06,Groceries,25,INR,Stranger's shop,Someone Else\n"
+    )
+
+    def upload():
+        return client.post(
+            "/api/import/csv",
+            headers=headers,
+            data={"group_id": group_id},
+            files={"file": ("statement.csv", statement, "text/csv")},
+        )
+
+    report = upload().json()
+    assert (report["rows"], report["imported"], report["failed"]) == (5, 2, 3)
+    assert [e["row"] for e in report["errors"]] == [4, 5, 6]
+    assert report["errors"][2]["error"] == "Unknown payer 'Someone Else'"
+
+    bad_default = client.post(
+        "/api/import/csv",
+        headers=headers,
+        data={"group_id": group_id, "default_category_id": "no-such-category"},
+        files={"file": ("statement.csv", statement, "text/csv")},
+    )
+    assert bad_default.status_code == 400
+
+    expenses = client.get(f"/api/expenses?group_id={group_id}", headers=headers).json()
+    assert sorted(e["amount"] for e in expenses) == [1450.5, 2300]
+    assert {e["category_name"] for e in expenses} == {"Utilities", "Groceries"}
+
+    again = upload().json()
+    assert (again["imported"], again["duplicates"]) == (0, 2)
+
+
+def test_csv_import_rejects_bad_amounts_and_skips_a_reimported_export(client):
+    headers = register_user(client, "Omar Haddad", "omar@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for amount, description in ((120.5, "Lunch"), (80, "Taxi")):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": amount, "category_id": category_id, "group_id": group_id, "description": description},
+        )
+    assert client.post(
+        "/api/expenses",
+        headers=headers,
+        json={"amount": -5, "category_id": category_id, "group_id": group_id},
+    ).status_code == 422
+
+    export = client.post("/api/export/csv", headers=headers, json={"export_type": "all", "group_id": group_id}).text
+    bad_rows = "".join(f"2024-02-01,Personal,Groceries,{amount},INR,Bad,\n" for amount in ("-5", "0", "nan", "inf"))
+    report = client.post(
+        "/api/import/csv",
+        headers=headers,
+        data={"group_id": group_id},
+        files={"file": ("export.csv", export + bad_rows, "text/csv")},
+    ).json()
+    assert (report["imported"], report["duplicates"], report["failed"]) == (0, 2, 4)
+    assert all(e["error"].startswith("Invalid amount") for e in report["errors"])
+
+
+def test_sync_is_refused_without_transactions(client):
+    headers = register_user(client, "Tariq Aziz", "tariq@example.com")
+    assert client.get("/api/sync", headers=headers).status_code == 503
+
+
+def test_sync_returns_only_changes_since_token(client, monkeypatch):
+    headers = register_user(client, "Pooja Nair", "pooja@example.com")
+    monkeypatch.setattr(server_module, "client", FakeClient())
+    monkeypatch.setattr(server_module, "transactions_supported", True)
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+
+    def add(description):
+        return client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": 10, "category_id": category_id, "group_id": group_id, "description": description},
+        ).json()
+
+    kept = add("Milk")
+    removed = add("Bread")
+
+    full = client.get("/api/sync", headers=headers).json()
+    assert full["reset"] is True
+    assert {e["description"] for e in full["expenses"]} == {"Milk", "Bread"}
+    assert len(full["categories"]) == 10
+
+    unchanged = client.get(f"/api/sync?since={full['token']}", headers=headers).json()
+    assert unchanged["reset"] is False
+    assert unchanged["groups"] == unchanged["expenses"] == []
+
+    client.put(f"/api/expenses/{kept['id']}", headers=headers, json={"amount": 12})
+    client.delete(f"/api/expenses/{removed['id']}", headers=headers)
+    add("Eggs")
+    client.post(
+        "/api/import/csv",
+        headers=headers,
+        data={"group_id": group_id},
+        files={"file": ("statement.csv", "Date,Category,Amount,Currency,Description,Paid By\n2024-02-01,Groceries,5,INR,Tea,\n", "text/csv")},
+    )
+
+    delta = client.get(f"/api/sync?since={unchanged['token']}", headers=headers).json()
+    assert sorted(e["description"] for e in delta["expenses"]) == ["Eggs", "Milk", "Tea"]
+    assert delta["deleted"]["expenses"] == [removed["id"]]
+    assert [g["id"] for g in delta["groups"]] == [group_id]
+    assert delta["categories"] == []
+
+    assert client.get("/api/sync?since=garbage", headers=headers).status_code == 400
+
+    # A seq taken outside run_in_transaction could be seen by /sync before its writes
+    with pytest.raises(RuntimeError):
+        asyncio.run(server_module.next_change_seq(group_id, session=None))
+
+
+def test_search_ranks_description_matches_and_pages(client):
+    headers = register_user(client, "Elena Ruiz", "elena@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for day, description in enumerate(["Electricity bill", "Electrician visit", "Water bill", "Groceries"], start=1):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={
+                "amount": 10,
+                "category_id": category_id,
+                "group_id": group_id,
+                "description": description,
+                "date": f"2024-04-0{day}T10:00:00",
+            },
+        )
+
+    response = client.get("/api/expenses/search?q=elec", headers=headers)
+    assert response.status_code == 200
+    assert [e["description"] for e in response.json()] == ["Electrician visit", "Electricity bill"]
+
+    first = client.get("/api/expenses/search?q=bill&limit=1", headers=headers)
+    assert [e["description"] for e in first.json()] == ["Water bill"]
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get(f"/api/expenses/search?q=bill&limit=1&cursor={cursor}", headers=headers)
+    assert [e["description"] for e in second.json()] == ["Electricity bill"]
+    assert "X-Next-Cursor" not in second.headers
+
+    # Payer names are searchable too, but rank below description hits
+    assert len(client.get("/api/expenses/search?q=elena", headers=headers).json()) == 4
+    client.put(
+        f"/api/expenses/{response.json()[0]['id']}", headers=headers, json={"description": "Plumber"}
+    )
+    assert [e["description"] for e in client.get("/api/expenses/search?q=plum", headers=headers).json()] == ["Plumber"]
+    assert client.get("/api/expenses/search?q=a", headers=headers).status_code == 400
+
+
+def test_search_ranks_matches_by_window_and_follows_payer_renames(client, monkeypatch):
+    headers = register_user(client, "Hana Ito", "hana@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for day, description in enumerate(["Rent", "Rental car", "Rental bike", "Rental skis", "Rental boat"], start=1):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={
+                "amount": 10,
+                "category_id": category_id,
+                "group_id": group_id,
+                "description": description,
+                "date": f"2024-05-0{day}T10:00:00",
+            },
+        )
+
+    # Matches are ranked within windows of the newest three, and pages go on to older windows
+    monkeypatch.setattr(server_module, "SEARCH_WINDOW_SIZE", 3)
+
+    def pages(limit):
+        found, url = [], f"/api/expenses/search?q=rent&limit={limit}"
+        while url:
+            response = client.get(url, headers=headers)
+            found.append([e["description"] for e in response.json()])
+            cursor = response.headers.get("X-Next-Cursor")
+            url = f"/api/expenses/search?q=rent&limit={limit}&cursor={cursor}" if cursor else None
+        return found
+
+    assert pages(2) == [["Rental boat", "Rental skis"], ["Rental bike", "Rent"], ["Rental car"]]
+    assert pages(3) == [["Rental boat", "Rental skis", "Rental bike"], ["Rent", "Rental car"]]
+    assert pages(10) == [["Rental boat", "Rental skis", "Rental bike", "Rent", "Rental car"]]
+
+    client.put("/api/auth/profile", headers=headers, json={"name": "Hana Mori"})
+    assert len(client.get("/api/expenses/search?q=mori", headers=headers).json()) == 5
+    assert client.get("/api/expenses/search?q=ito", headers=headers).json() == []
+
+
+def test_ensure_indexes_is_idempotent_and_skips_conflicts(monkeypatch):
+    fake_db = FakeDatabase()
+    monkeypatch.setattr(server_module, "db", fake_db)
+
+    async def conflicting(indexes):
+        raise server.OperationFailure("Index with name: email_1 already exists with different options", 85)
+
+    asyncio.run(server.ensure_indexes())
+    built = {name: set(fake_db[name]._indexes) for name in server.INDEXES}
+    assert "email_1" in built["users"]
+    assert "members_1" in built["groups"]
+
+    fake_db.users._indexes = {"_id_"}
+    monkeypatch.setattr(fake_db.users, "create_indexes", conflicting)
+    asyncio.run(server.ensure_indexes())
+    assert {name: set(fake_db[name]._indexes) for name in server.INDEXES if name != "users"} == {
+        name: indexes for name, indexes in built.items() if name != "users"
+    }
+
+
+def test_lookup_enrichment_matches_batched_queries(client, monkeypatch):
+    headers = register_user(client, "Ines Moreau", "ines@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for day in range(1, 4):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={
+                "amount": day * 5,
+                "category_id": category_id,
+                "group_id": group_id,
+                "description": f"Lunch {day}",
+                "date": f"2024-05-0{day}T12:00:00",
+            },
+        )
+
+    def fetch(strategy):
+        monkeypatch.setitem(server.ENRICHMENT_STRATEGIES, "expenses", strategy)
+        monkeypatch.setitem(server.ENRICHMENT_STRATEGIES, "export", strategy)
+        listing = client.get("/api/expenses?limit=2", headers=headers)
+        export = client.post("/api/export/csv", headers=headers, json={"export_type": "all"})
+        return listing.json(), listing.headers.get("X-Next-Cursor"), export.text
+
+    queries, lookup = fetch("queries"), fetch("lookup")
+    assert queries == lookup
+    assert [e["description"] for e in lookup[0]] == ["Lunch 3", "Lunch 2"]
+    assert lookup[0][0]["category_name"] != "Unknown"
+    assert "Ines Moreau" in lookup[2]
+
+
+def test_group_updates_apply_conditions_atomically(client):
+    owner = register_user(client, "Kofi Mensah", "kofi@example.com")
+    guest = register_user(client, "Lena Fischer", "lena@example.com")
+    personal_id = client.get("/api/groups", headers=owner).json()[0]["id"]
+    group = client.post("/api/groups", headers=owner, json={"name": "Flat", "type": "shared"}).json()
+
+    joined = client.post("/api/groups/join", headers=guest, json={"invite_code": group["invite_code"].lower()})
+    assert joined.status_code == 200
+    assert [m["name"] for m in joined.json()["members"]] == ["Kofi Mensah", "Lena Fischer"]
+    again = client.post("/api/groups/join", headers=guest, json={"invite_code": group["invite_code"]})
+    assert again.status_code == 400
+    assert client.post("/api/groups/join", headers=guest, json={"invite_code": "NOPE00"}).status_code == 404
+
+    renamed = client.put(f"/api/groups/{group['id']}", headers=guest, json={"name": "Shared flat"})
+    assert renamed.status_code == 200
+    assert renamed.json()["name"] == "Shared flat"
+    assert len(renamed.json()["members"]) == 2
+    assert client.put(f"/api/groups/{personal_id}", headers=owner, json={"name": "Mine"}).status_code == 400
+    assert client.put(f"/api/groups/{personal_id}", headers=guest, json={"name": "Mine"}).status_code == 403
+    assert client.put("/api/groups/missing", headers=owner, json={"name": "Mine"}).status_code == 404
+
+
+def test_versioned_updates_reject_stale_writes(client):
+    headers = register_user(client, "Mara Costa", "mara@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group = client.post("/api/groups", headers=headers, json={"name": "Trip", "type": "shared"}).json()
+    assert group["version"] == 1
+    expense = client.post(
+        "/api/expenses",
+        headers=headers,
+        json={"amount": 40, "category_id": category_id, "group_id": group["id"], "description": "Fuel"},
+    ).json()
+    assert expense["version"] == 1
+
+    fetched = client.get(f"/api/expenses/{expense['id']}", headers=headers)
+    assert fetched.headers["ETag"] == '"1"'
+    assert client.get(f"/api/expenses/{expense['id']}", headers={**headers, "If-None-Match": '"1"'}).status_code == 304
+
+    updated = client.put(f"/api/expenses/{expense['id']}", headers={**headers, "If-Match": '"1"'}, json={"amount": 45})
+    assert updated.status_code == 200
+    assert updated.json()["version"] == 2
+    assert updated.headers["ETag"] == '"2"'
+
+    stale = client.put(f"/api/expenses/{expense['id']}", headers={**headers, "If-Match": '"1"'}, json={"amount": 50})
+    assert stale.status_code == 409
+    assert client.put(f"/api/expenses/{expense['id']}", headers=headers, json={"amount": 50, "version": 1}).status_code == 409
+    assert client.delete(f"/api/expenses/{expense['id']}", headers={**headers, "If-Match": '"1"'}).status_code == 409
+    assert client.get(f"/api/expenses/{expense['id']}", headers=headers).json()["amount"] == 45
+
+    # A rename bumps the group version, so a mode change based on the old one conflicts
+    client.put(f"/api/groups/{group['id']}", headers=headers, json={"name": "Road trip"})
+    mode = client.put(f"/api/groups/{group['id']}/mode?mode=contribution", headers={**headers, "If-Match": '"1"'})
+    assert mode.status_code == 409
+    mode = client.put(f"/api/groups/{group['id']}/mode?mode=contribution", headers={**headers, "If-Match": '"2"'})
+    assert mode.json()["version"] == 3
+
+
+def test_receipts_are_deduplicated_and_served_by_presigned_url(client, monkeypatch):
+    moto = pytest.importorskip("moto")
+    pytest.importorskip("PIL")
+    import boto3
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(server_module, "RECEIPTS_BUCKET", "receipts-test")
+    monkeypatch.setattr(server_module, "S3_CLIENT_OPTIONS", {"endpoint_url": None, "region_name": "us-east-1"})
+    monkeypatch.setattr(server_module, "s3_client", None)
+    # The mocked S3 only exists in this process, so render thumbnails on a thread
+    monkeypatch.setattr(server_module, "thumbnail_executor", ThreadPoolExecutor(max_workers=1))
+
+    image = io.BytesIO()
+    Image.new("RGB", (1200, 800), "white").save(image, "PNG")
+
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="receipts-test")
+
+        headers = register_user(client, "Noor Haddad", "noor@example.com")
+        category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+        group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+        expense_ids = [
+            client.post(
+                "/api/expenses",
+                headers=headers,
+                json={"amount": 10, "category_id": category_id, "group_id": group_id, "description": name},
+            ).json()["id"]
+            for name in ("Pharmacy", "Pharmacy again")
+        ]
+
+        for expense_id in expense_ids:
+            response = client.post(
+                f"/api/expenses/{expense_id}/receipts",
+                headers=headers,
+                files={"file": ("receipt.png", image.getvalue(), "image/png")},
+            )
+            assert response.status_code == 200
+            assert response.json()["size"] == len(image.getvalue())
+
+        keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket="receipts-test")["Contents"]]
+        assert len([k for k in keys if k.startswith("receipts/")]) == 1
+        assert len([k for k in keys if k.startswith("thumbnails/")]) == 1
+
+        receipts = client.get(f"/api/expenses/{expense_ids[1]}/receipts", headers=headers).json()
+        assert len(receipts) == 1
+        assert "X-Amz-Signature" in receipts[0]["url"] or "Signature=" in receipts[0]["url"]
+        assert receipts[0]["thumbnail_url"]
+
+        bad = client.post(
+            f"/api/expenses/{expense_ids[0]}/receipts",
+            headers=headers,
+            files={"file": ("notes.txt", b"hello", "text/plain")},
+        )
+        assert bad.status_code == 400
+
+        removed = client.delete(f"/api/expenses/{expense_ids[1]}/receipts/{receipts[0]['id']}", headers=headers)
+        assert removed.status_code == 200
+        assert client.get(f"/api/expenses/{expense_ids[1]}/receipts", headers=headers).json() == []
+
+
+def test_analytics_summary_sums_periods_per_currency(client):
+    from datetime import datetime, timedelta
+
+    headers = register_user(client, "Omar Aziz", "omar@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    last_month = (month_start - timedelta(days=1)).replace(day=10)
+    for amount, currency, date in [
+        (100, "INR", None),
+        (50, "INR", None),
+        (7, "USD", None),
+        (30, "INR", last_month),
+        (999, "INR", datetime(2020, 1, 5)),
+    ]:
+        payload = {"amount": amount, "currency": currency, "category_id": category_id, "group_id": group_id}
+        if date:
+            payload["date"] = date.isoformat()
+        client.post("/api/expenses", headers=headers, json=payload)
+
+    summary = client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+    assert summary["today"] == {"INR": 150, "USD": 7}
+    assert summary["this_month"] == {"INR": 150, "USD": 7}
+    assert summary["last_month"] == {"INR": 30}
+    assert summary["total"] == {"INR": 1179, "USD": 7}
+    assert summary["total_count"] == 5
+
+
+def test_trends_and_daily_fill_empty_buckets(client):
+    from datetime import datetime, timedelta
+
+    headers = register_user(client, "Rhea Kapoor", "rhea@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    now = datetime.utcnow()
+    two_days_ago = now - timedelta(days=2)
+    for amount, currency, date in [(20, "INR", now), (5, "USD", now), (12, "INR", two_days_ago)]:
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": amount, "currency": currency, "category_id": category_id, "group_id": group_id, "date": date.isoformat()},
+        )
+
+    daily = client.get(f"/api/analytics/daily?group_id={group_id}&days=3", headers=headers).json()
+    assert [d["date"] for d in daily] == [(now - timedelta(days=n)).strftime("%Y-%m-%d") for n in (2, 1, 0)]
+    assert [d["amounts"] for d in daily] == [{"INR": 12}, {}, {"INR": 20, "USD": 5}]
+
+    trends = client.get(f"/api/analytics/trends?group_id={group_id}&months=3", headers=headers).json()
+    assert len(trends) == 3
+    assert trends[-1]["month_num"] == now.month
+    assert sum(t["amounts"].get("INR", 0) for t in trends) == 32
+    assert trends[-1]["amounts"]["USD"] == 5
+
+
+def test_rollups_follow_writes_and_partial_days_match_raw_expenses(client):
+    from datetime import datetime
+
+    headers = register_user(client, "Tomas Berg", "tomas@example.com")
+    categories = client.get("/api/categories", headers=headers).json()
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    created = []
+    for amount, category, date in [
+        (40, categories[0], datetime(2024, 3, 1, 9)),
+        (60, categories[0], datetime(2024, 3, 1, 18)),
+        (25, categories[1], datetime(2024, 3, 2, 12)),
+        (15, categories[1], datetime(2024, 3, 5, 8)),
+    ]:
+        created.append(client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": amount, "currency": "INR", "category_id": category["id"], "group_id": group_id, "date": date.isoformat()},
+        ).json())
+
+    # Rollups are built on first read and then maintained by every write
+    client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers)
+    client.put(f"/api/expenses/{created[1]['id']}", headers=headers, json={"category_id": categories[1]["id"]})
+    client.delete(f"/api/expenses/{created[3]['id']}", headers=headers)
+
+    rollups = server_module.db.spending_rollups
+    maintained = sorted((r["day"], r["category_id"], r["amount"], r["count"]) for r in rollups._docs)
+    asyncio.run(server.rebuild_spending_rollups(group_id))
+    assert maintained == sorted((r["day"], r["category_id"], r["amount"], r["count"]) for r in rollups._docs)
+    assert len(maintained) == 3
+
+    def by_category(start, end):
+        rows = client.get(
+            f"/api/analytics/by-category?group_id={group_id}&start_date={start}&end_date={end}", headers=headers
+        ).json()
+        return {row["category_id"]: (row["amounts"], row["count"]) for row in rows}
+
+    assert by_category("2024-03-01T12:00:00", "2024-03-31T00:00:00") == {categories[1]["id"]: ({"INR": 85}, 2)}
+    assert by_category("2024-03-01T00:00:00", "2024-03-02T11:00:00") == {
+        categories[0]["id"]: ({"INR": 40}, 1),
+        categories[1]["id"]: ({"INR": 60}, 1),
+    }
+
+
+def test_rollup_rebuild_is_redone_when_an_expense_write_races_with_it(client, monkeypatch):
+    headers = register_user(client, "Vera Lind", "vera@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+
+    def add(amount):
+        client.post("/api/expenses", headers=headers, json={"amount": amount, "category_id": category_id, "group_id": group_id, "date": "2024-03-01T10:00:00"})
+
+    add(100)
+    client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers)
+
+    # An expense of the same day is written after the rebuild aggregated but before it stored its rows
+    expenses = server_module.db.expenses
+    aggregate = expenses.aggregate
+    def aggregate_then_write(*args, **kwargs):
+        cursor = aggregate(*args, **kwargs)
+        monkeypatch.setattr(expenses, "aggregate", aggregate)
+        add(50)
+        return cursor
+    monkeypatch.setattr(expenses, "aggregate", aggregate_then_write)
+
+    asyncio.run(server.rebuild_spending_rollups(group_id))
+    rows = [r for r in server_module.db.spending_rollups._docs if r["group_id"] == group_id]
+    assert [(r["amount"], r["count"]) for r in rows] == [(150, 2)]
+
+
+def test_analytics_cache_hits_until_group_changes(client):
+    headers = register_user(client, "Uma Rao", "uma@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+
+    def add(amount):
+        client.post("/api/expenses", headers=headers, json={"amount": amount, "currency": "INR", "category_id": category_id, "group_id": group_id})
+
+    def by_category():
+        return client.get(f"/api/analytics/by-category?group_id={group_id}", headers=headers).json()[0]["amounts"]
+
+    add(10)
+    before = client.get("/api/analytics/cache-stats", headers=headers).json()
+    assert by_category() == {"INR": 10}
+    assert by_category() == {"INR": 10}
+    add(5)
+    assert by_category() == {"INR": 15}
+    after = client.get("/api/analytics/cache-stats", headers=headers).json()
+    assert (after["hits"] - before["hits"], after["misses"] - before["misses"]) == (1, 2)
+
+    cache = server.AnalyticsCache(max_bytes=2000)
+    for n in range(50):
+        cache.put(("key", n), {"INR": n})
+    assert 0 < len(cache.entries) < 50
+    assert cache.size <= 2000 and cache.evictions == 50 - len(cache.entries)
+    assert cache.get(("key", 0)) is None and cache.get(("key", 49)) == {"INR": 49}
+
+
+def test_analytics_cache_never_keeps_a_result_read_mid_write(client, monkeypatch):
+    headers = register_user(client, "Ines Faro", "ines@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+
+    def by_category():
+        return client.get(f"/api/analytics/by-category?group_id={group_id}", headers=headers).json()[0]["amounts"]
+
+    client.post("/api/expenses", headers=headers, json={"amount": 10, "category_id": category_id, "group_id": group_id})
+    assert by_category() == {"INR": 10}
+
+    # Analytics read after the expense is stored but before its rollups are
+    update_rollups = server.update_spending_rollups
+    async def read_then_update(*args, **kwargs):
+        monkeypatch.setattr(server_module, "update_spending_rollups", update_rollups)
+        assert by_category() == {"INR": 10}
+        return await update_rollups(*args, **kwargs)
+    monkeypatch.setattr(server_module, "update_spending_rollups", read_then_update)
+    client.post("/api/expenses", headers=headers, json={"amount": 5, "category_id": category_id, "group_id": group_id})
+    assert by_category() == {"INR": 15}
+
+    # Rebuilding the rollups, as rebuild-rollups and load-rates do, is seen too
+    expense = dict(server_module.db.expenses._docs[0], id="outside-the-api", amount=100)
+    server_module.db.expenses._docs.append(expense)
+    asyncio.run(server.rebuild_spending_rollups(group_id, "UTC"))
+    assert by_category() == {"INR": 115}
+
+
+def test_dashboard_matches_individual_analytics_endpoints(client):
+    headers = register_user(client, "Vera Lind", "vera@example.com")
+    categories = client.get("/api/categories", headers=headers).json()
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for n, (amount, currency) in enumerate([(30, "INR"), (12, "USD"), (8, "INR"), (40, "INR"), (3, "USD"), (9, "INR")]):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": amount, "currency": currency, "category_id": categories[n % 2]["id"], "group_id": group_id, "description": f"item {n}"},
+        )
+
+    dashboard = client.get(f"/api/dashboard?group_id={group_id}", headers=headers).json()
+    assert dashboard["summary"] == client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+
+    def by_key(rows, key):
+        return sorted(rows, key=lambda row: row[key])
+
+    category = client.get(f"/api/analytics/by-category?group_id={group_id}", headers=headers).json()
+    assert by_key(dashboard["by_category"], "category_id") == by_key(category, "category_id")
+    member = client.get(f"/api/analytics/by-member?group_id={group_id}", headers=headers).json()
+    assert dashboard["by_member"] == member
+    trends = client.get(f"/api/analytics/trends?group_id={group_id}&months=6", headers=headers).json()
+    assert dashboard["trends"] == trends
+    recent = client.get(f"/api/expenses?group_id={group_id}&limit=5", headers=headers).json()
+    assert dashboard["recent_expenses"] == recent
+
+    partial = client.get(f"/api/dashboard?group_id={group_id}&sections=summary,recent", headers=headers).json()
+    assert set(partial) == {"summary", "recent_expenses"}
+    assert client.get("/api/dashboard?sections=summary,bogus", headers=headers).status_code == 400
+
+
+def test_analytics_bucket_days_in_requested_time_zone(client):
+    headers = register_user(client, "Wen Li", "wen@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+
+    def add(date):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": 10, "currency": "INR", "category_id": category_id, "group_id": group_id, "date": date},
+        )
+
+    def april_count(tz):
+        rows = client.get(
+            f"/api/analytics/by-category?group_id={group_id}&start_date=2024-04-01&end_date=2024-04-30&tz={tz}",
+            headers=headers,
+        ).json()
+        return rows[0]["count"] if rows else 0
+
+    # 20:00 UTC on 31 March is already 1 April in India
+    add("2024-03-31T20:00:00")
+    assert april_count("UTC") == 0
+    assert april_count("Asia/Kolkata") == 1
+
+    # Zones outside the members' profiles are aggregated on the fly, not stored
+    add("2024-04-02T10:00:00")
+    assert april_count("UTC") == 1
+    assert april_count("Asia/Kolkata") == 2
+    group = next(g for g in server_module.db.groups._docs if g["id"] == group_id)
+    assert group["rollup_timezones"] == ["UTC"]
+
+    profile = client.put("/api/auth/profile", headers=headers, json={"timezone": "Asia/Kolkata"}).json()
+    assert profile["timezone"] == "Asia/Kolkata"
+    assert group["rollup_timezones"] == []
+    rows = client.get(f"/api/analytics/by-category?group_id={group_id}&start_date=2024-04-01", headers=headers).json()
+    assert rows[0]["count"] == 2
+    assert client.put("/api/auth/profile", headers=headers, json={"timezone": "Mars/Olympus"}).status_code == 400
+
+    stored = client.get(f"/api/dashboard?group_id={group_id}&months=12", headers=headers).json()
+    for tz in ["America/Toronto", "Asia/Riyadh", "Europe/Paris", "Asia/Tokyo"]:
+        client.get(f"/api/analytics/summary?group_id={group_id}&tz={tz}", headers=headers)
+    assert group["rollup_timezones"] == ["Asia/Kolkata"]
+    kept = {r["timezone"] for r in server_module.db.spending_rollups._docs if r["group_id"] == group_id}
+    assert kept == {"Asia/Kolkata"}
+
+    # On the fly and stored rollups give the same answers
+    server_module.analytics_cache.entries.clear()
+    client.put("/api/auth/profile", headers=headers, json={"timezone": "UTC"})
+    fly = client.get(f"/api/dashboard?group_id={group_id}&months=12&tz=Asia/Kolkata", headers=headers).json()
+    assert group["rollup_timezones"] == []
+    assert {k: v for k, v in fly.items() if k != "recent_expenses"} == {k: v for k, v in stored.items() if k != "recent_expenses"}
+
+
+def test_pandas_engine_matches_database_grouping(client, monkeypatch):
+    pytest.importorskip("pandas")
+    headers = register_user(client, "Xavi Puig", "xavi@example.com")
+    categories = client.get("/api/categories", headers=headers).json()
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for n in range(12):
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={
+                "amount": 5 + n,
+                "currency": ["INR", "USD"][n % 2],
+                "category_id": categories[n % 3]["id"],
+                "group_id": group_id,
+                "date": f"2024-05-{n + 1:02d}T12:00:00",
+            },
+        )
+
+    def by_category(min_rows):
+        monkeypatch.setattr(server, "ANALYTICS_PANDAS_MIN_ROWS", min_rows)
+        monkeypatch.setattr(server, "analytics_cache", server.AnalyticsCache(server.ANALYTICS_CACHE_MAX_BYTES))
+        rows = client.get(f"/api/analytics/by-category?group_id={group_id}&start_date=2024-05-03", headers=headers).json()
+        return sorted((row["category_id"], row["amounts"], row["count"]) for row in rows)
+
+    assert by_category(1) == by_category(0)
+
+
+def test_large_groups_are_neither_truncated_in_analytics_balances_nor_export(client):
+    from datetime import datetime, timedelta
+
+    headers = register_user(client, "Yusuf Kaya", "yusuf@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    user_id = client.get("/api/auth/me", headers=headers).json()["id"]
+
+    # Written straight to the collection, as by an older server or a restore:
+    # ledgers and rollups are rebuilt from history on first read
+    count = 50_001
+    start = datetime(2023, 1, 1)
+    server_module.db.expenses._docs.extend({
+        "id": f"bulk-{n:06d}",
+        "amount": 2,
+        "currency": "INR",
+        "category_id": category_id,
+        "description": "",
+        "paid_by": user_id,
+        "group_id": group_id,
+        "date": start + timedelta(minutes=17 * n),
+        "created_at": start,
+    } for n in range(count))
+    server_module.db.group_ledgers._docs.clear()
+
+    rows = client.get(f"/api/analytics/by-category?group_id={group_id}", headers=headers).json()
+    assert rows[0]["count"] == count and rows[0]["amounts"] == {"INR": 2 * count}
+    summary = client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+    assert summary["total_count"] == count
+
+    balances = client.get(f"/api/groups/{group_id}/balances", headers=headers).json()
+    assert balances["member_balances"][0]["total_paid"] == {"INR": 2 * count}
+
+    export = client.post("/api/export/csv", headers=headers, json={"export_type": "all", "group_id": group_id})
+    lines = export.text.strip().splitlines()
+    assert len(lines) == count + 1
+    assert lines[1].startswith((start + timedelta(minutes=17 * (count - 1))).strftime("%Y-%m-%d"))
+
+
+def test_converted_totals_use_rates_of_each_day(client):
+    from datetime import datetime
+
+    headers = register_user(client, "Zara Sheikh", "zara@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    server_module.db.exchange_rates._docs.extend([
+        {"currency": "USD", "date": datetime(2024, 1, 1), "per_usd": 1},
+        {"currency": "INR", "date": datetime(2024, 1, 1), "per_usd": 80},
+        {"currency": "INR", "date": datetime(2024, 3, 2), "per_usd": 90},
+    ])
+
+    created = []
+    for amount, currency, date in [
+        (10, "USD", datetime(2024, 3, 1, 12)),
+        (20, "USD", datetime(2024, 3, 3, 9)),
+        (100, "INR", datetime(2024, 3, 3, 10)),
+        (5, "CAD", datetime(2024, 3, 4, 8)),
+    ]:
+        created.append(client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": amount, "currency": currency, "category_id": category_id, "group_id": group_id, "date": date.isoformat()},
+        ).json())
+
+    summary = client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+    assert summary["converted"]["currency"] == "INR"
+    assert summary["converted"]["total"] == 10 * 80 + 20 * 90 + 100
+    assert summary["converted"]["unconverted_currencies"] == ["CAD"]
+
+    # Rollups keep converted amounts as expenses change; partial days are converted in the aggregation
+    client.put(f"/api/expenses/{created[0]['id']}", headers=headers, json={"amount": 12})
+    rollups = server_module.db.spending_rollups
+    maintained = sorted((r["day"], r["currency"], r["converted"]) for r in rollups._docs)
+    asyncio.run(server.rebuild_spending_rollups(group_id))
+    assert maintained == sorted((r["day"], r["currency"], r["converted"]) for r in rollups._docs)
+
+    rows = client.get(
+        f"/api/analytics/by-category?group_id={group_id}&start_date=2024-03-01T06:00:00&end_date=2024-03-03T12:00:00",
+        headers=headers,
+    ).json()
+    assert rows[0]["converted_amount"] == 12 * 80 + 20 * 90 + 100
+
+    client.put("/api/auth/profile", headers=headers, json={"default_currency": "USD"})
+    summary = client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+    assert summary["converted"]["currency"] == "USD"
+    assert summary["converted"]["total"] == pytest.approx(12 + 20 + 100 / 90)
+
+    # Newly loaded rates are picked up without restarting, as manage.py load-rates leaves them
+    server_module.db.exchange_rates._docs.append({"currency": "INR", "date": datetime(2024, 3, 3), "per_usd": 100})
+    asyncio.run(server.mark_rates_changed())
+    asyncio.run(server.rebuild_spending_rollups(group_id))
+    summary = client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+    assert summary["converted"]["total"] == pytest.approx(12 + 20 + 100 / 100)
+
+
+def test_converted_totals_keep_the_target_currency_without_rates(client):
+    headers = register_user(client, "Ravi Kapoor", "ravi@example.com")
+    category_id = client.get("/api/categories", headers=headers).json()[0]["id"]
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    for amount, currency, date in [(100, "INR", "2024-03-01T12:00:00"), (40, "INR", "2024-03-02T09:00:00"), (5, "USD", "2024-03-02T10:00:00")]:
+        client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": amount, "currency": currency, "category_id": category_id, "group_id": group_id, "date": date},
+        )
+
+    summary = client.get(f"/api/analytics/summary?group_id={group_id}", headers=headers).json()
+    assert summary["converted"]["total"] == 140
+    assert summary["converted"]["unconverted_currencies"] == ["USD"]
+
+    # The partial second day is aggregated from the expenses rather than the rollups
+    rows = client.get(
+        f"/api/analytics/by-category?group_id={group_id}&start_date=2024-03-01T00:00:00&end_date=2024-03-02T09:30:00",
+        headers=headers,
+    ).json()
+    assert rows[0]["converted_amount"] == 140
+
+
+def test_budget_counters_follow_expense_writes_and_record_alerts(client, monkeypatch):
+    from datetime import datetime
+
+    headers = register_user(client, "Amir Haddad", "amir@example.com")
+    categories = client.get("/api/categories", headers=headers).json()
+    group_id = client.get("/api/groups", headers=headers).json()[0]["id"]
+    server_module.db.exchange_rates._docs.extend([
+        {"currency": "USD", "date": datetime(2024, 1, 1), "per_usd": 1},
+        {"currency": "INR", "date": datetime(2024, 1, 1), "per_usd": 80},
+    ])
+
+    def add(amount, currency="INR"):
+        return client.post(
+            "/api/expenses",
+            headers=headers,
+            json={"amount": amount, "currency": currency, "category_id": categories[0]["id"], "group_id": group_id},
+        ).json()
+
+    add(500)
+    budget = client.post(
+        "/api/budgets", headers=headers, json={"group_id": group_id, "category_id": categories[0]["id"], "amount": 1000}
+    ).json()
+    assert (budget["spent"], budget["count"], budget["alerts"]) == (500, 1, [])
+    duplicate = client.post("/api/budgets", headers=headers, json={"group_id": group_id, "category_id": categories[0]["id"], "amount": 5})
+    assert duplicate.status_code == 409
+
+    moved = add(350)
+    usd = add(10, "USD")
+
+    # A point read of the counters, without aggregating expenses or rollups
+    def no_aggregation(*args, **kwargs):
+        raise AssertionError("GET /budgets must not aggregate")
+    monkeypatch.setattr(server_module.db.expenses, "aggregate", no_aggregation)
+    monkeypatch.setattr(server_module.db.spending_rollups, "aggregate", no_aggregation)
+    budget = client.get(f"/api/budgets?group_id={group_id}", headers=headers).json()[0]
+    assert (budget["spent"], budget["count"]) == (500 + 350 + 800, 3)
+    assert budget["crossed_thresholds"] == [80, 100]
+    assert [(a["threshold"], a["expense_id"]) for a in budget["alerts"]] == [(80, moved["id"]), (100, usd["id"])]
+
+    client.delete(f"/api/expenses/{usd['id']}", headers=headers)
+    client.put(f"/api/expenses/{moved['id']}", headers=headers, json={"category_id": categories[1]["id"]})
+    budget = client.get(f"/api/budgets?group_id={group_id}", headers=headers).json()[0]
+    assert (budget["spent"], budget["count"], budget["crossed_thresholds"]) == (500, 1, [])
+
+    budget = client.put(f"/api/budgets/{budget['id']}", headers=headers, json={"amount": 550, "thresholds": [50, 90]}).json()
+    assert budget["crossed_thresholds"] == [50, 90]
+    assert [a["threshold"] for a in budget["alerts"]][-2:] == [50, 90]
@@ -0,0 +1,338 @@
+"""Query-plan regression tests.
+
+Runs the query shapes and aggregation pipelines issued by the API, built
+with the same helpers the routes use, against a real mongod seeded with
+synthetic data and checks the winning plans with explain(). A hot query
+fails the suite if it scans a collection or examines many more documents
+than it returns; a pipeline fails if it scans a collection, joins without
+an index or examines many more documents than its $match selects.
+
+Skipped unless a mongod is reachable at MONGO_TEST_URL
+(default mongodb://localhost:27017). When MONGO_TEST_URL is set, as in CI,
+an unreachable mongod fails the tests instead.
+"""
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "family_expense_test")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import server  # noqa: E402
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL", "mongodb://localhost:27017")
+PLAN_DB_NAME = "family_expense_query_plans"
+
+GROUPS = 8
+EXPENSES = 8000
+SETTLEMENTS = 400
+DAYS = 400
+
+# A plan may examine at most this many documents per document returned, plus
+# a little slack for sort-merge plans that read ahead one entry per branch
+MAX_EXAMINED_RATIO = 2
+EXAMINED_SLACK = GROUPS + 5
+
+WORDS = ["electricity", "bill", "groceries", "rent", "water", "fuel", "taxi", "dinner", "school", "fees"]
+
+
+@pytest.fixture(scope="module")
+def plan_db():
+    mongo = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=1000)
+    try:
+        mongo.admin.command("ping")
+    except PyMongoError:
+        if "MONGO_TEST_URL" in os.environ:
+            raise
+        pytest.skip(f"No mongod reachable at {MONGO_TEST_URL}")
+
+    mongo.drop_database(PLAN_DB_NAME)
+    database = mongo[PLAN_DB_NAME]
+    for collection_name, indexes in server.INDEXES.items():
+        database[collection_name].create_indexes(indexes)
+
+    seed = seed_data(database)
+    yield database, seed
+
+    mongo.drop_database(PLAN_DB_NAME)
+    mongo.close()
+
+
+def seed_data(database):
+    rng = random.Random(0)
+    now = datetime(2024, 6, 1)
+
+    users = [{"id": str(uuid.UUID(int=rng.getrandbits(128))), "name": f"User {n}", "email": f"user{n}@example.com"} for n in range(6)]
+    database.users.insert_many(users)
+
+    categories = [{"id": f"cat-{n}", "name": f"Category {n}", "group_id": None} for n in range(10)]
+    database.categories.insert_many(categories)
+
+    groups = []
+    for n in range(GROUPS):
+        members = rng.sample([u["id"] for u in users], rng.randint(2, 4))
+        groups.append({"id": f"group-{n}", "name": f"Group {n}", "members": members, "invite_code": f"CODE{n:02d}", "change_seq": 0})
+    database.groups.insert_many(groups)
+    database.group_ledgers.insert_many([server.empty_ledger(g["id"]) for g in groups])
+
+    expenses = []
+    for n in range(EXPENSES):
+        group = rng.choice(groups)
+        category = rng.choice(categories)
+        payer = rng.choice(group["members"])
+        description = " ".join(rng.sample(WORDS, 2))
+        expense = {
+            "id": f"exp-{n:06d}",
+            "amount": rng.randint(1, 500),
+            "currency": "INR",
+            "category_id": category["id"],
+            "description": description,
+            "paid_by": payer,
+            "group_id": group["id"],
+            "date": now - timedelta(days=rng.randint(0, DAYS), minutes=rng.randint(0, 1440)),
+            "created_at": now,
+            "seq": n + 1,
+        }
+        expense["content_hash"] = server.expense_content_hash(expense)
+        expense["search_terms"] = server.build_search_terms(description, category["name"], payer)
+        expenses.append(expense)
+    database.expenses.insert_many(expenses)
+
+    rollups = {}
+    for expense in expenses:
+        key = server.rollup_key(expense, "UTC")
+        row = rollups.setdefault(tuple(key.items()), {**key, "amount": 0, "count": 0, "converted": {"INR": 0}})
+        row["amount"] += expense["amount"]
+        row["count"] += 1
+        row["converted"]["INR"] += expense["amount"]
+    database.spending_rollups.insert_many(list(rollups.values()))
+    database.groups.update_many({}, {"$set": {"rollup_timezones": ["UTC"]}})
+
+    budgets = []
+    for n, group in enumerate(groups):
+        budgets.append({
+            "id": f"budget-{n}",
+            "group_id": group["id"],
+            "category_id": categories[n]["id"],
+            "amount": 5000,
+            "currency": "INR",
+            "thresholds": [80, 100],
+            "timezone": "UTC",
+            "start_month": datetime(2024, 1, 1),
+        })
+    database.budgets.insert_many(budgets)
+    database.budget_usage.insert_many([
+        {"budget_id": b["id"], "month": datetime(2024, month, 1), "spent": 0, "count": 0, "alerts": []}
+        for b in budgets for month in range(1, 7)
+    ])
+
+    settlements = []
+    for n in range(SETTLEMENTS):
+        group = rng.choice(groups)
+        paid_by, paid_to = rng.sample(group["members"], 2)
+        settlements.append({
+            "id": f"set-{n:05d}",
+            "group_id": group["id"],
+            "paid_by": paid_by,
+            "paid_to": paid_to,
+            "amount": rng.randint(1, 500),
+            "currency": "INR",
+            "date": now - timedelta(days=rng.randint(0, DAYS)),
+            "seq": n + 1,
+        })
+    database.settlements.insert_many(settlements)
+
+    return {"users": users, "groups": groups, "expenses": expenses, "budgets": budgets}
+
+
+def search_windows(seed, group_ids, token):
+    """Every window cursor a search for token walks through, from the newest matches to the oldest"""
+    matches = sorted(
+        (e for e in seed["expenses"] if e["group_id"] in group_ids and token in e["search_terms"]),
+        key=lambda e: (e["date"], e["id"]),
+        reverse=True,
+    )
+    size = server.SEARCH_WINDOW_SIZE
+    return [None] + [server.encode_cursor(e["date"], e["id"]) for e in matches[size - 1:-1:size]]
+
+
+def query_shapes(seed):
+    """The find() shapes issued by the endpoints, filled in with seeded values"""
+    user = seed["users"][0]
+    group_ids = [g["id"] for g in seed["groups"] if user["id"] in g["members"]]
+    group = seed["groups"][0]
+    expense = seed["expenses"][100]
+    page_end = sorted(
+        (e for e in seed["expenses"] if e["group_id"] in group_ids), key=lambda e: (e["date"], e["id"]), reverse=True
+    )[server.DEFAULT_PAGE_SIZE - 1]
+    cursor = server.encode_cursor(page_end["date"], page_end["id"])
+    year_start = datetime(2023, 6, 1)
+    page = server.DEFAULT_PAGE_SIZE + 1
+    by_date = [("date", -1), ("id", -1)]
+    budgets = [b for b in seed["budgets"] if b["group_id"] in group_ids]
+    now = datetime(2024, 5, 20)
+
+    return [
+        ("user by id", "users", {"id": user["id"]}, None, None, None),
+        ("user by email", "users", {"email": user["email"]}, None, None, None),
+        ("group by id", "groups", {"id": group["id"]}, None, None, None),
+        ("group membership check", "groups", {"id": group["id"], "members": user["id"]}, {"id": 1}, None, None),
+        ("groups for member", "groups", server.member_groups_query(user["id"]), {"id": 1}, None, None),
+        ("group by invite code", "groups", {"invite_code": group["invite_code"]}, None, None, None),
+        ("category by id", "categories", {"id": "cat-3"}, None, None, None),
+        ("ledger by group", "group_ledgers", {"group_id": group["id"]}, None, None, None),
+        ("expense by id", "expenses", {"id": expense["id"]}, None, None, None),
+        ("expenses first page", "expenses", server.expenses_query(group_ids), None, by_date, page),
+        ("expenses next page", "expenses", server.expenses_query(group_ids, cursor=cursor), None, by_date, page),
+        ("expenses by category", "expenses", server.expenses_query(group_ids, category_id="cat-3"), None, by_date, page),
+        ("expenses by payer", "expenses", server.expenses_query(group_ids, paid_by=user["id"]), None, by_date, page),
+        ("expenses since", "expenses", server.expenses_query(group_ids, start=year_start), None, by_date, page),
+        *[
+            (f"expense search '{token}' window {n + 1}", "expenses", server.search_query(group_ids, [token], window),
+             {"_id": 0, "search_terms": 0}, by_date, server.SEARCH_WINDOW_SIZE + 1)
+            for token in ("electr", "categ")
+            for n, window in enumerate(search_windows(seed, group_ids, token))
+        ],
+        ("rollups since", "spending_rollups", server.rollup_match(group_ids, "UTC", {"$gte": year_start}), None, None, None),
+        ("budgets for groups", "budgets", {"group_id": {"$in": group_ids}}, None, None, None),
+        ("budget usage this month", "budget_usage", {"$or": [{"budget_id": b["id"], "month": server.month_start(now, b["timezone"])} for b in budgets]}, None, None, None),
+        ("import duplicate check", "expenses", {"group_id": group["id"], "content_hash": {"$in": [expense["content_hash"]]}}, {"content_hash": 1, "_id": 0}, None, None),
+        ("expenses changed since", "expenses", server.changed_since_query(group_ids, {gid: EXPENSES - 50 for gid in group_ids}), server.SYNC_EXPENSE_FIELDS, None, None),
+        ("settlements for user", "settlements", server.settlements_query(user["id"]), None, by_date, page),
+        ("settlements for user in group", "settlements", server.settlements_query(user["id"], group_ids[0]), None, by_date, page),
+        ("settlements for group", "settlements", {"group_id": group["id"]}, None, by_date, page),
+        ("tombstones since", "tombstones", {"group_id": group["id"], "seq": {"$gt": 10}}, None, None, None),
+        ("idempotency key", "idempotency_keys", {"user_id": user["id"], "key": "k"}, None, None, None),
+    ]
+
+
+def pipeline_shapes(seed):
+    """The aggregation pipelines issued by the analytics, dashboard, listing and budget code"""
+    user = seed["users"][0]
+    group_ids = [g["id"] for g in seed["groups"] if user["id"] in g["members"]]
+    now = datetime(2024, 5, 20)
+    periods = server.summary_periods(now, "UTC")
+    month_starts = server.trend_month_starts(now, 6)
+    trends_range = {"$gte": month_starts[0], "$lt": server.next_month_start(month_starts[-1])}
+    year_range = {"$gte": datetime(2023, 6, 1), "$lt": datetime(2024, 5, 20)}
+    partial_day = {"$gte": datetime(2024, 5, 20, 6), "$lte": datetime(2024, 5, 20, 18)}
+    budget = next(b for b in seed["budgets"] if b["group_id"] in group_ids)
+    facets = server.dashboard_facets(list(server.DASHBOARD_SECTIONS), periods, trends_range, "UTC", "INR")
+
+    return [
+        ("summary", "spending_rollups", [{"$match": server.rollup_match(group_ids, "UTC")}, server.summary_group_stage(periods, "INR")]),
+        ("dashboard", "spending_rollups", [{"$match": server.rollup_match(group_ids, "UTC")}, {"$facet": facets}]),
+        ("by category", "spending_rollups", [
+            {"$match": server.rollup_match(group_ids, "UTC", year_range)},
+            server.dimension_group_stage("category_id", "$count", "$converted.INR"),
+        ]),
+        ("by category partial day", "expenses", [
+            {"$match": {"group_id": {"$in": group_ids}, "date": partial_day}},
+            server.dimension_group_stage("category_id", 1, server.converted_amount_expression({}, "INR", datetime(2024, 5, 20), "UTC")),
+        ]),
+        ("monthly trends", "spending_rollups", [
+            {"$match": server.rollup_match(group_ids, "UTC", trends_range)}, server.bucket_group_stage("month", "UTC", "INR"),
+        ]),
+        ("rollups of an unstored zone", "expenses", server.rollup_pipeline({"group_id": {"$in": group_ids}, "date": year_range}, "Asia/Kolkata")),
+        ("expenses with $lookup", "expenses", server.expense_lookup_pipeline(
+            server.expenses_query(group_ids), [("date", -1), ("id", -1)], server.DEFAULT_PAGE_SIZE + 1
+        )),
+        ("budget recount", "spending_rollups", server.budget_month_pipeline(budget, datetime(2024, 5, 1))),
+    ]
+
+
+def plan_stages(node):
+    if isinstance(node, dict):
+        if "stage" in node:
+            yield node["stage"]
+        for value in node.values():
+            yield from plan_stages(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from plan_stages(item)
+
+
+def explain(database, collection, query, projection, sort, limit):
+    command = {"find": collection, "filter": query}
+    if projection:
+        command["projection"] = projection
+    if sort:
+        command["sort"] = dict(sort)
+    if limit:
+        command["limit"] = limit
+    return database.command({"explain": command, "verbosity": "executionStats"})
+
+
+def explain_aggregate(database, collection, pipeline):
+    command = {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+    return database.command({"explain": command, "verbosity": "executionStats"})
+
+
+INDEXED_JOINS = {"IndexedLoopJoin", "DynamicIndexedLoopJoin"}
+
+
+def unindexed_joins(node):
+    """$lookup joins in an explain document that do not probe an index on the foreign field.
+
+    The slot-based engine reports them as EQ_LOOKUP stages with a join
+    strategy, the classic engine as $lookup stages counting collection scans.
+    """
+    if isinstance(node, dict):
+        if node.get("stage") == "EQ_LOOKUP" and node.get("strategy") not in INDEXED_JOINS:
+            yield f"{node.get('foreignCollection')} ({node.get('strategy')})"
+        if "$lookup" in node and node.get("collectionScans"):
+            yield f"{node['$lookup'].get('from')} ({node['collectionScans']} collection scans)"
+        for value in node.values():
+            yield from unindexed_joins(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from unindexed_joins(item)
+
+
+def match_stats(result):
+    """executionStats of the part of a pipeline's plan that reads the collection"""
+    if "executionStats" in result:
+        return result["executionStats"]
+    return result["stages"][0]["$cursor"]["executionStats"]
+
+
+def test_hot_queries_use_indexes(plan_db):
+    database, seed = plan_db
+    failures = []
+    for name, collection, query, projection, sort, limit in query_shapes(seed):
+        result = explain(database, collection, query, projection, sort, limit)
+        stages = set(plan_stages(result["queryPlanner"]["winningPlan"]))
+        stats = result["executionStats"]
+        examined, returned = stats["totalDocsExamined"], stats["nReturned"]
+        if "COLLSCAN" in stages:
+            failures.append(f"{name}: COLLSCAN on {collection}")
+        elif examined > returned * MAX_EXAMINED_RATIO + EXAMINED_SLACK:
+            failures.append(f"{name}: examined {examined} documents to return {returned} ({sorted(stages)})")
+    assert not failures, "\n".join(failures)
+
+
+def test_pipelines_use_indexes(plan_db):
+    database, seed = plan_db
+    failures = []
+    for name, collection, pipeline in pipeline_shapes(seed):
+        result = explain_aggregate(database, collection, pipeline)
+        stages = set(plan_stages(result))
+        matched = database[collection].count_documents(pipeline[0]["$match"])
+        examined = match_stats(result)["totalDocsExamined"]
+        if "COLLSCAN" in stages:
+            failures.append(f"{name}: COLLSCAN on {collection}")
+        elif examined > matched * MAX_EXAMINED_RATIO + EXAMINED_SLACK:
+            failures.append(f"{name}: examined {examined} documents for {matched} matches ({sorted(stages)})")
+        for join in unindexed_joins(result):
+            failures.append(f"{name}: $lookup from {join} without an index")
+    assert not failures, "\n".join(failures)